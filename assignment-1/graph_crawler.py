@@ -0,0 +1,395 @@
+##########################################################
+#           Link graph engine for the wiki crawlers      #
+##########################################################
+
+# Finds the shortest chain of links between two Wikipedia pages, keeping every link it learns
+# in a compact graph on disk so later questions can be answered without crawling again.
+#
+#   python graph_crawler.py path /wiki/Star_Wars /wiki/Pokémon     search both ways until the pages meet
+#   python graph_crawler.py crawl /wiki/Redis --pages 500           BFS outward to grow the graph
+#   python graph_crawler.py query "Star Wars" "Pokémon"             answer from the saved graph only
+#
+# Pages are integer IDs. Links are kept in CSR form (one offsets array, one targets array), so the
+# whole graph is two flat arrays and a list of titles, and can be written and read back in one go.
+# Links come from the MediaWiki API, 50 pages per request, several requests at once over pooled connections.
+import os
+import sys
+import json
+import argparse
+from array import array
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from urllib.parse import unquote, quote
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+WIKIPEDIA = "https://en.wikipedia.org"
+API_URL = WIKIPEDIA + "/w/api.php"
+# Wikipedia asks API clients to say who they are
+USER_AGENT = "CMSI-6998-Web-Crawler/1.0 (graph_crawler.py; https://github.com/Xan-22/CMSI-6998-Web-Crawler)"
+GRAPH_PATH = "wiki-graph.bin"
+# Most titles the API takes in one query
+TITLES_PER_REQUEST = 50
+WORKERS = 4
+
+# Per-page flags: its outgoing / incoming links are all in the graph
+LINKS_OUT = 1
+LINKS_IN = 2
+
+# Title prefixes of every namespace but 0 (articles), with their aliases. The API is asked for
+# namespace 0 directly; links scraped from HTML are checked against these instead.
+NAMESPACES = {
+    "talk", "user", "user talk", "wikipedia", "wikipedia talk", "wp", "wt", "project", "project talk",
+    "file", "file talk", "image", "image talk", "mediawiki", "mediawiki talk", "template", "template talk",
+    "help", "help talk", "category", "category talk", "portal", "portal talk", "draft", "draft talk",
+    "timedtext", "timedtext talk", "module", "module talk", "special", "media",
+}
+
+
+def title_from_url(url):
+    # "/wiki/Star_Wars", "https://en.wikipedia.org/wiki/Star_Wars" or "Star Wars" -> "Star Wars"
+    if "/wiki/" in url:
+        url = url.split("/wiki/", 1)[1]
+    return unquote(url).replace("_", " ").split("#")[0]
+
+
+def is_article(title):
+    # "Star Wars: Episode IV" is an article, "Special:Random" and "Category:Films" are not
+    prefix, colon, _ = title.partition(":")
+    return bool(title) and not (colon and prefix.strip().lower() in NAMESPACES)
+
+
+def url_for_title(title):
+    return f"{WIKIPEDIA}/wiki/{quote(title.replace(' ', '_'))}"
+
+
+class LinkGraph:
+    # Pages and the links between them.
+    #   titles/ids      page ID <-> title
+    #   offsets/targets CSR rows, page n links to targets[offsets[n]:offsets[n + 1]]
+    #   pending         links added since the last compact(), merged into the CSR arrays by it
+    #   flags           LINKS_OUT / LINKS_IN per page
+    def __init__(self):
+        self.titles = []
+        self.ids = {}
+        self.offsets = array('q', [0])
+        self.targets = array('i')
+        self.pending = {}
+        self.flags = bytearray()
+        self.reverse = None
+
+    def __len__(self):
+        return len(self.titles)
+
+    def edges(self):
+        return len(self.targets) + sum(len(links) for links in self.pending.values())
+
+    def intern(self, title):
+        # ID for title, adding the page if it's new
+        node = self.ids.get(title)
+        if node is None:
+            node = self.ids[title] = len(self.titles)
+            self.titles.append(title)
+            self.flags.append(0)
+        return node
+
+    def add_links(self, source, targets):
+        self.pending.setdefault(source, array('i')).extend(targets)
+
+    def out_links(self, node):
+        links = self.targets[self.offsets[node]:self.offsets[node + 1]] if node + 1 < len(self.offsets) else array('i')
+        if node in self.pending:
+            links = links + self.pending[node]
+        return links
+
+    def in_links(self, node):
+        # Pages linking to node, as of the last compact()
+        if self.reverse is None:
+            self.reverse = self.build_reverse()
+        offsets, sources = self.reverse
+        return sources[offsets[node]:offsets[node + 1]] if node + 1 < len(offsets) else array('i')
+
+    def compact(self):
+        # Merge pending links into the CSR arrays, each row sorted and without repeats
+        if len(self.pending) == 0 and len(self.offsets) == len(self.titles) + 1:
+            return
+        offsets = array('q', [0])
+        targets = array('i')
+        rows = len(self.offsets) - 1
+        for node in range(len(self.titles)):
+            row = self.targets[self.offsets[node]:self.offsets[node + 1]] if node < rows else ()
+            extra = self.pending.get(node)
+            if extra is not None:
+                row = sorted(set(row).union(extra))
+            targets.extend(row)
+            offsets.append(len(targets))
+        self.offsets = offsets
+        self.targets = targets
+        self.pending = {}
+        self.reverse = None
+
+    def build_reverse(self):
+        # CSR of incoming links, by counting sort over the outgoing ones
+        nodes = len(self.offsets) - 1
+        offsets = array('q', bytes(8 * (nodes + 1)))
+        for target in self.targets:
+            offsets[target + 1] += 1
+        for node in range(nodes):
+            offsets[node + 1] += offsets[node]
+        sources = array('i', bytes(4 * len(self.targets)))
+        fill = array('q', offsets)
+        for node in range(nodes):
+            for target in self.targets[self.offsets[node]:self.offsets[node + 1]]:
+                sources[fill[target]] = node
+                fill[target] += 1
+        return offsets, sources
+
+    def shortest_path(self, start, goal):
+        # Titles from start to goal using only the links already in the graph, None if they don't connect
+        if start not in self.ids or goal not in self.ids:
+            return None
+        self.compact()
+        path = bidirectional_search(
+            self.ids[start], self.ids[goal],
+            lambda nodes: ( (node, self.out_links(node)) for node in nodes ),
+            lambda nodes: ( (node, self.in_links(node)) for node in nodes )
+        )
+        return [ self.titles[node] for node in path ] if path is not None else None
+
+    def save(self, path=GRAPH_PATH):
+        # One JSON header line, then the titles, offsets, targets and flags as raw bytes
+        self.compact()
+        titles = "\n".join(self.titles).encode('utf-8')
+        header = {
+            "version": 1,
+            "byteorder": sys.byteorder,
+            "nodes": len(self.titles),
+            "edges": len(self.targets),
+            "titles_bytes": len(titles),
+        }
+        partial = path + ".partial"
+        with open(partial, "wb") as f:
+            f.write(json.dumps(header).encode('utf-8') + b"\n")
+            f.write(titles)
+            f.write(self.offsets.tobytes())
+            f.write(self.targets.tobytes())
+            f.write(bytes(self.flags))
+        os.replace(partial, path) # Never leave a half-written graph behind
+
+    @classmethod
+    def load(cls, path=GRAPH_PATH):
+        graph = cls()
+        with open(path, "rb") as f:
+            header = json.loads(f.readline())
+            titles = f.read(header["titles_bytes"]).decode('utf-8')
+            graph.titles = titles.split("\n") if header["nodes"] > 0 else []
+            graph.offsets = array('q')
+            graph.offsets.frombytes(f.read(graph.offsets.itemsize * (header["nodes"] + 1)))
+            graph.targets.frombytes(f.read(graph.targets.itemsize * header["edges"]))
+            graph.flags = bytearray(f.read(header["nodes"]))
+        if header["byteorder"] != sys.byteorder:
+            graph.offsets.byteswap()
+            graph.targets.byteswap()
+        graph.ids = { title: node for node, title in enumerate(graph.titles) }
+        return graph
+
+
+def walk(parents, node):
+    # node, its parent, its parent's parent... up to the root of a search
+    chain = []
+    while node != -1:
+        chain.append(node)
+        node = parents[node]
+    return chain
+
+
+def bidirectional_search(start, goal, forward, backward):
+    # Shortest path of page IDs from start to goal, or None.
+    # forward(nodes) / backward(nodes) yield (node, linked IDs) for every node given, following links
+    # out of / into those pages. Each round expands the whole of the smaller frontier, so the first
+    # round where the searches meet has the shortest path among its meetings.
+    if start == goal:
+        return [start]
+    parents = ({ start: -1 }, { goal: -1 }) # Visited pages on each side, each with the page it was reached from
+    frontiers = ([start], [goal])
+    while len(frontiers[0]) > 0 and len(frontiers[1]) > 0:
+        side = 0 if len(frontiers[0]) <= len(frontiers[1]) else 1
+        seen, other = parents[side], parents[1 - side]
+        next_frontier = []
+        meetings = []
+        for node, links in (forward, backward)[side](frontiers[side]):
+            for link in links:
+                if link in seen:
+                    continue
+                seen[link] = node
+                next_frontier.append(link)
+                if link in other:
+                    meetings.append(link)
+        if len(meetings) > 0:
+            meeting = min(meetings, key=lambda node: len(walk(other, node)))
+            return walk(parents[0], meeting)[::-1] + walk(parents[1], meeting)[1:]
+        frontiers[side][:] = next_frontier
+    return None
+
+
+def build_session(workers=WORKERS):
+    # One connection pool shared by all fetch threads, retrying throttled and failed requests
+    session = requests.Session()
+    retry = Retry(total=5, backoff_factor=0.5, status_forcelist=(429, 500, 502, 503, 504), respect_retry_after_header=True)
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=workers, max_retries=retry)
+    session.mount("https://", adapter)
+    session.headers["User-Agent"] = USER_AGENT
+    return session
+
+
+class GraphCrawler:
+    # Searches and grows a LinkGraph, fetching only the pages whose links the graph doesn't have yet
+    def __init__(self, graph=None, workers=WORKERS, session=None):
+        self.graph = graph if graph is not None else LinkGraph()
+        self.workers = workers
+        self.session = session or build_session(workers)
+        self.pool = ThreadPoolExecutor(workers)
+        self.requests = 0
+
+    def close(self):
+        self.pool.shutdown()
+        self.session.close()
+
+    def fetch_links(self, titles, direction):
+        # {title: [linked titles]} for up to TITLES_PER_REQUEST titles, following all continuations.
+        # direction "out" is the links on each page, "in" the pages linking to it
+        if direction == "out":
+            prop, params = "links", { "prop": "links", "plnamespace": 0, "pllimit": "max" }
+        else:
+            prop, params = "linkshere", { "prop": "linkshere", "lhnamespace": 0, "lhlimit": "max", "lhprop": "title" }
+        params.update({ "action": "query", "format": "json", "formatversion": 2, "redirects": 1, "titles": "|".join(titles) })
+        links = { title: [] for title in titles }
+        requested = None
+        while True:
+            response = self.session.get(API_URL, params=params, timeout=30)
+            self.requests += 1
+            response.raise_for_status()
+            data = response.json()
+            query = data.get("query", {})
+            if requested is None:
+                requested = self.requested_titles(titles, query)
+            for page in query.get("pages", []):
+                found = [ link["title"] for link in page.get(prop, []) ]
+                for title in requested.get(page["title"], ()):
+                    links[title] += found
+            if "continue" not in data:
+                return links
+            params.update(data["continue"])
+
+    def requested_titles(self, titles, query):
+        # {title the API answered under: [titles we asked for]}, following its normalizing and redirects
+        normalized = { item["from"]: item["to"] for item in query.get("normalized", []) }
+        redirects = { item["from"]: item["to"] for item in query.get("redirects", []) }
+        requested = {}
+        for title in titles:
+            answered = normalized.get(title, title)
+            answered = redirects.get(answered, answered)
+            requested.setdefault(answered, []).append(title)
+        return requested
+
+    def expand(self, nodes, direction):
+        # Yields (node, linked IDs) for every node, from the graph when it already has them,
+        # otherwise fetched in batches as the requests come back. Runs on the calling thread only,
+        # so the graph is never touched by two threads at once
+        flag = LINKS_OUT if direction == "out" else LINKS_IN
+        graph = self.graph
+        missing = []
+        for node in nodes:
+            if graph.flags[node] & flag:
+                yield node, graph.out_links(node) if direction == "out" else graph.in_links(node)
+            else:
+                missing.append(node)
+        batches = [ missing[i:i + TITLES_PER_REQUEST] for i in range(0, len(missing), TITLES_PER_REQUEST) ]
+        futures = { self.pool.submit(self.fetch_links, [ graph.titles[node] for node in batch ], direction): batch for batch in batches }
+        for future in as_completed(futures):
+            links = future.result()
+            for node in futures[future]:
+                linked = [ graph.intern(title) for title in links[graph.titles[node]] ]
+                if direction == "out":
+                    graph.add_links(node, linked)
+                else:
+                    for source in linked:
+                        graph.add_links(source, [node])
+                graph.flags[node] |= flag
+                yield node, linked
+
+    def find_path(self, start, goal):
+        # Titles of the shortest chain of links from start to goal, crawling both ways as needed
+        self.graph.compact() # Incoming links for pages searched before come from the compacted graph
+        path = bidirectional_search(
+            self.graph.intern(title_from_url(start)), self.graph.intern(title_from_url(goal)),
+            lambda nodes: self.expand(nodes, "out"),
+            lambda nodes: self.expand(nodes, "in")
+        )
+        return [ self.graph.titles[node] for node in path ] if path is not None else None
+
+    def crawl(self, start, max_pages=1000):
+        # Plain BFS outward from start until max_pages pages have had their links read
+        queue = deque([ self.graph.intern(title_from_url(start)) ])
+        visited = { queue[0] }
+        expanded = 0
+        while len(queue) > 0 and expanded < max_pages:
+            level = [ queue.popleft() for _ in range(min(len(queue), max_pages - expanded, TITLES_PER_REQUEST * self.workers)) ]
+            for node, links in self.expand(level, "out"):
+                expanded += 1
+                for link in links:
+                    if link not in visited:
+                        visited.add(link)
+                        queue.append(link)
+        return expanded
+
+
+def open_graph(path=GRAPH_PATH):
+    # The saved graph, or an empty one if there isn't one yet
+    return LinkGraph.load(path) if os.path.exists(path) else LinkGraph()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Shortest link paths between Wikipedia pages")
+    parser.add_argument("--graph", default=GRAPH_PATH, help="where the link graph is saved")
+    parser.add_argument("--workers", type=int, default=WORKERS, help="API requests in flight at once")
+    commands = parser.add_subparsers(dest="command", required=True)
+    path_parser = commands.add_parser("path", help="crawl until the two pages are connected")
+    path_parser.add_argument("start")
+    path_parser.add_argument("goal")
+    crawl_parser = commands.add_parser("crawl", help="grow the graph outward from a page")
+    crawl_parser.add_argument("start")
+    crawl_parser.add_argument("--pages", type=int, default=1000)
+    query_parser = commands.add_parser("query", help="shortest path using only the saved graph")
+    query_parser.add_argument("start")
+    query_parser.add_argument("goal")
+    args = parser.parse_args()
+
+    graph = open_graph(args.graph)
+    print(f"Graph has {len(graph)} pages and {graph.edges()} links")
+    if args.command == "query":
+        path = graph.shortest_path(title_from_url(args.start), title_from_url(args.goal))
+    else:
+        crawler = GraphCrawler(graph, args.workers)
+        try:
+            if args.command == "crawl":
+                print(f"Read the links of {crawler.crawl(args.start, args.pages)} pages")
+            else:
+                path = crawler.find_path(args.start, args.goal)
+        finally:
+            crawler.close()
+            graph.save(args.graph)
+        print(f"{crawler.requests} API requests, graph now has {len(graph)} pages and {graph.edges()} links")
+        if args.command == "crawl":
+            return
+    if path is None:
+        print("No path found")
+        return
+    print(f"{len(path) - 1} clicks:")
+    for title in path:
+        print(f"    {url_for_title(title)}")
+
+
+if __name__ == "__main__":
+    main()
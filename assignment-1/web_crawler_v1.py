@@ -1,47 +1,33 @@
 ##########################################################
 #           First Iteration described in-class           #
+#           Search now runs on graph_crawler.py          #
 ##########################################################
 
-import requests
-from bs4 import BeautifulSoup
+from graph_crawler import GraphCrawler, open_graph
 
-class WebCrawler: #Implements BFS
+class WebCrawler: #Implements BFS, from both ends at once
     def __init__(self, starting_url, target_url):
         self.target_url = target_url
         self.current_url = starting_url
-        self.queue = [starting_url]
-        self.visited = set()
+        # Pages are integer IDs in the graph, which remembers every link from earlier runs
+        self.graph = open_graph()
+        self.crawler = GraphCrawler(self.graph)
         self.run()
 
-    def get_all_links(self, url):
-        try:
-            response = requests.get("https://en.wikipedia.org" + url)
-            if response.status_code == 200:
-                soup = BeautifulSoup(response.text, 'html.parser')
-                return soup.find_all('a')
-        except Exception:
-            return []
-    
     def run(self):
-        while self.queue != []:
-             if (self.current_url == self.target_url):
-                 print('Target URL found!')
-                 return
-             self.current_url = self.queue.pop(0)
-             self.visited.add(self.current_url)
-             print (self.current_url.split('/')[-1])
-             self.crawl(self.current_url)
-        print('Target URL not found')
-
-    def crawl(self, url):
-        if (url is None) or (url == ''):
+        try:
+            path = self.crawler.find_path(self.current_url, self.target_url)
+        finally:
+            self.crawler.close()
+            self.graph.save()
+        if path is None:
+            print('Target URL not found')
             return
-        links = self.get_all_links(url)
-        if (links is not None):
-            for link in links:
-                ref = link.get('href')
-                if ref is not None and ref not in self.queue and ref not in self.visited and ref.startswith('/wiki/'):
-                    self.queue.append(ref)
-                
+        for title in path:
+            print(title)
+        self.current_url = self.target_url
+        print('Target URL found!')
+        print(f"{len(path) - 1} clicks, {self.crawler.requests} API requests")
+
 #"5-Clicks-to-Jesus game" used as an example (https://en.wikipedia.org/wiki/Wikipedia:Wiki_Game)
-c = WebCrawler('/wiki/Star_Wars', "/wiki/Pokémon")
\ No newline at end of file
+c = WebCrawler('/wiki/Star_Wars', "/wiki/Pokémon")
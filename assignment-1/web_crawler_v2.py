@@ -1,53 +1,31 @@
 ##########################################################
 #           Second Iteration based on sample code        #
-#           Neo4J Implementation commented               #
+#           Link graph kept with graph_crawler.py        #
 ##########################################################
 
 import mechanicalsoup as ms
 import redis
 import os
 from elasticsearch import Elasticsearch
-# from neo4j import GraphDatabase
-
-# class Neo4JConnector:
-#     def __init__(self, uri, user, password):
-#         self.driver = GraphDatabase.driver(uri, auth=(user, password))
-
-#     def close(self):
-#         self.driver.close()
-
-#     def add_links(self, page, links):
-#         with self.driver.session() as session: 
-#             session.execute_write(self._create_links, page, links)
-
-#     def flush_db(self):
-#         print("clearing graph db")
-#         with self.driver.session() as session: 
-#             session.execute_write(self._flush_db)
-    
-#     @staticmethod
-#     def _create_links(tx, page, links):
-#         # because Redis stores strings as ByteStrings,
-#         # we must decode our url into a string of a specific encoding
-#         # for it to be valid JSON
-#         page = page.decode('utf-8')
-#         tx.run("CREATE (:Page { url: $page })", page=page)
-#         for link in links:
-#             tx.run("MATCH (p:Page) WHERE p.url = $page "
-#                    "CREATE (:Page { url: $link }) -[:LINKS_TO]-> (p)",
-#                    link=link, page=page)
-
-#     @staticmethod
-#     def _flush_db(tx):
-#         tx.run("MATCH (a) -[r]-> () DELETE a, r")
-#         tx.run("MATCH (a) DELETE a")
+from graph_crawler import open_graph, title_from_url, is_article, LINKS_OUT
+
+# Queues each link only the first time it's seen, KEYS: queue, seen set
+PUSH_SCRIPT = """
+local added = 0
+for _, link in ipairs(ARGV) do
+    if redis.call('SADD', KEYS[2], link) == 1 then
+        redis.call('LPUSH', KEYS[1], link)
+        added = added + 1
+    end
+end
+return added
+"""
 
 
 class WebCrawler:
     def __init__(self, starting_url, target_url):
-        # # Initialize Neo4j
-        # self.neo = Neo4JConnector("bolt://localhost:7687", "", "")
-        # self.neo.flush_db()
+        # Initialize the link graph, pages are integer IDs and every link found is kept
+        self.graph = open_graph()
 
         # Initialize Elasticsearch
         username = 'elastic'
@@ -63,20 +41,24 @@ class WebCrawler:
        # Initialize Redis
         self.r = redis.Redis()
         self.r.flushall()
+        self.push_links = self.r.register_script(PUSH_SCRIPT)
 
        # Initialize MechanicalSoup headless browser
         self.browser = ms.StatefulBrowser()
         self.run(starting_url, target_url)
 
-        # # Close connection to Neo4j
-        # self.neo.close()
+        # Save the link graph, graph_crawler.py can answer shortest paths from it without crawling again
+        self.graph.save()
+        path = self.graph.shortest_path(title_from_url(starting_url), title_from_url(target_url))
+        if path is not None:
+            print(" -> ".join(path))
 
     def run(self, starting_url, target_url):
         # Add root url as the entrypoint to our crawl
-        self.r.lpush("links", starting_url)
+        self.push_links(keys=["links", "seen-links"], args=[starting_url])
         # Start crawl
         while link := self.r.rpop("links"):
-            if (link == target_url):
+            if (link.decode('utf-8') == target_url):
                 print('Target URL found!')
                 break
             self.crawl(link)
@@ -104,16 +86,21 @@ class WebCrawler:
         a_tags = self.browser.page.find_all("a")
         hrefs = [ a.get("href") for a in a_tags ]
 
-        # Do wikipedia specific URL filtering
+        # Do wikipedia specific URL filtering, articles only (Special:, File:, Category: ... pages are left out)
+        # so the graph holds the same links the API crawler would find for this page
         wikipedia_domain = "https://en.wikipedia.org"
-        links = [ wikipedia_domain + a for a in hrefs if a and a.startswith("/wiki/") ]
+        links = [ wikipedia_domain + a for a in hrefs if a and a.startswith("/wiki/") and is_article(title_from_url(a)) ]
 
         # Put urls in Redis queue
         # create a linked list in Redis, call it "links"
-        self.r.lpush("links", *links)
-
-        # # Add links to Neo4J graph
-        # self.neo.add_links(url, links)
+        # Links already queued or crawled are left out, "seen-links" holds every link ever queued
+        if len(links) > 0:
+            self.push_links(keys=["links", "seen-links"], args=links)
+
+        # Add links to the graph
+        page = self.graph.intern(title_from_url(decoded_url))
+        self.graph.add_links(page, [ self.graph.intern(title_from_url(link)) for link in links ])
+        self.graph.flags[page] |= LINKS_OUT
 
 
 WebCrawler("https://en.wikipedia.org/wiki/Redis", "https://en.wikipedia.org/wiki/Jesus")
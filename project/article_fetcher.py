@@ -0,0 +1,92 @@
+import time
+import asyncio
+import aiohttp
+from threading import Thread
+from urllib.parse import urlsplit
+from metrics import log, FETCH_SECONDS, FETCH_RESPONSES
+from http_cache import NOT_MODIFIED
+
+USER_AGENT = "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/124.0 Safari/537.36"
+
+
+class ArticleFetcher:
+    # Fetches server-rendered article HTML over plain HTTP.
+    # One aiohttp session lives on a background event loop, so keep-alive connections
+    # are pooled per host and reused across batches and crawler threads.
+    # Every request first waits for its host's turn from the scheduler, so requests
+    # to a host that is cooling down don't hold up requests to other hosts.
+    # With an HttpCache, refetches are conditional and unchanged pages come back as NOT_MODIFIED.
+    def __init__(self, scheduler, concurrency=8, limit_per_host=2, timeout=20, cache=None):
+        self.scheduler = scheduler
+        self.cache = cache
+        self.validators = {} # url -> (ETag, Last-Modified) of fetched pages not remembered yet
+        self.concurrency = concurrency
+        self.limit_per_host = limit_per_host
+        self.timeout = timeout
+        self.session = None
+        self.loop = asyncio.new_event_loop()
+        self.thread = Thread(target=self.loop.run_forever, name="article-fetcher", daemon=True)
+        self.thread.start()
+        asyncio.run_coroutine_threadsafe(self._open(), self.loop).result()
+
+    async def _open(self):
+        connector = aiohttp.TCPConnector(limit=self.concurrency, limit_per_host=self.limit_per_host, keepalive_timeout=60)
+        self.session = aiohttp.ClientSession(
+            connector=connector,
+            timeout=aiohttp.ClientTimeout(total=self.timeout),
+            headers={ "User-Agent": USER_AGENT }
+        )
+
+    def fetch_all(self, urls):
+        # Blocking call for the crawler threads: returns [(url, html)] in order,
+        # html being None if the fetch failed or NOT_MODIFIED if the page is the same as last time
+        return asyncio.run_coroutine_threadsafe(self._fetch_all(urls), self.loop).result()
+
+    async def _fetch_all(self, urls):
+        pages = await asyncio.gather(*[ self._fetch(url) for url in urls ])
+        return list(zip(urls, pages))
+
+    async def _fetch(self, url):
+        # The first request to a host reads its robots.txt and a shared scheduler talks to Redis,
+        # so don't block the loop on either
+        await asyncio.sleep(await self.loop.run_in_executor(None, self.scheduler.reserve, url))
+        # A 429 may have paused the host while we slept, queue up again behind it
+        while await self.loop.run_in_executor(None, self.scheduler.paused, url):
+            await asyncio.sleep(await self.loop.run_in_executor(None, self.scheduler.reserve, url))
+        host = urlsplit(url).netloc
+        headers = self.cache.validators(url) if self.cache is not None else {}
+        start = time.perf_counter()
+        try:
+            async with self.session.get(url, headers=headers) as response:
+                self.scheduler.feedback(url, response.status, response.headers.get("Retry-After"))
+                FETCH_RESPONSES.inc(host=host, status=response.status)
+                if response.status == 304 and self.cache is not None:
+                    self.cache.not_modified(url)
+                    return NOT_MODIFIED
+                if response.status != 200 or "html" not in response.headers.get("Content-Type", ""):
+                    log("Fetcher", f"{url} returned {response.status}", url=url, status=response.status)
+                    return None
+                html = await response.text()
+                if self.cache is not None:
+                    validators = (response.headers.get("ETag"), response.headers.get("Last-Modified"))
+                    if self.cache.unchanged(url, html, *validators):
+                        return NOT_MODIFIED
+                    self.validators[url] = validators
+                return html
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            FETCH_RESPONSES.inc(host=host, status="error")
+            log("Fetcher", f"Failed to fetch {url}: {e!r}", url=url)
+            return None
+        finally:
+            FETCH_SECONDS.observe(time.perf_counter() - start, host=host)
+
+    def remember(self, url, html):
+        # Call once a page has been processed. Until then a refetch is unconditional,
+        # so a crash between fetching and writing doesn't turn into a 304 and a lost article
+        if self.cache is not None:
+            self.cache.store(url, html, *self.validators.pop(url, (None, None)))
+
+    def close(self):
+        asyncio.run_coroutine_threadsafe(self.session.close(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
@@ -0,0 +1,101 @@
+import base64
+import hashlib
+import re
+from collections import Counter
+from threading import Lock
+from elasticsearch import helpers, NotFoundError
+
+# Articles whose SimHashes agree on at least this fraction of bits count as the same story
+NEAR_DUPLICATE_THRESHOLD = 0.9
+# Bodies shorter than this many words are too short to fingerprint reliably
+MIN_WORDS = 30
+SHINGLE_SIZE = 3
+WORD = re.compile(r"\w+")
+# SimHash bit columns are summed in one big int, one LANE-bit counter per hash bit. SPREAD[k][b] puts
+# the bits of byte b, found at byte k of a hash, into their lanes, so the columns are summed from the
+# counts of each byte value rather than bit by bit per shingle.
+LANE = 32
+SPREAD = [ [ sum(1 << ((8 * k + bit) * LANE) for bit in range(8) if b >> bit & 1) for b in range(256) ] for k in range(8) ]
+
+
+def generate_id(site, headline, date):
+    # Fixed-width ID for an article: 128-bit hash of the same key the old IDs used, base64url encoded (22 chars)
+    combined_key = "".join(site.split()) + "".join(headline.split()) + "".join(date.split())
+    digest = hashlib.blake2b(combined_key.encode('utf-8'), digest_size=16).digest()
+    return base64.urlsafe_b64encode(digest).rstrip(b"=").decode('ascii')
+
+
+def legacy_id(site, headline, date):
+    # The old variable-length ID, kept so existing documents can be migrated
+    combined_key = "".join(site.split()) + "".join(headline.split()) + "".join(date.split())
+    return combined_key
+
+
+def simhash(body):
+    # 64-bit SimHash over word shingles, None if the body is too short to say anything
+    if not isinstance(body, str):
+        body = "\n".join(body)
+    words = WORD.findall(body.lower())
+    if len(words) < MIN_WORDS:
+        return None
+    shingles = { " ".join(words[i:i + SHINGLE_SIZE]) for i in range(len(words) - SHINGLE_SIZE + 1) }
+    digests = b"".join(hashlib.blake2b(shingle.encode('utf-8'), digest_size=8).digest() for shingle in shingles)
+    columns = 0
+    for k in range(8):
+        for b, count in Counter(digests[k::8]).items():
+            columns += SPREAD[k][b] * count
+    # A bit is set when more than half the shingle hashes have it set
+    mask = (1 << LANE) - 1
+    return sum(1 << bit for bit in range(64) if 2 * ((columns >> (bit * LANE)) & mask) > len(shingles))
+
+
+class NearDuplicateIndex:
+    # Answers "have we indexed something at least `threshold` similar?" without touching Elasticsearch.
+    # Two 64-bit SimHashes within k differing bits must agree exactly on at least one of k+1 bands
+    # (pigeonhole), so each band is a hash table and a lookup only compares a handful of candidates.
+    def __init__(self, threshold=NEAR_DUPLICATE_THRESHOLD):
+        self.max_distance = int((1 - threshold) * 64)
+        num_bands = self.max_distance + 1
+        edges = [ round(i * 64 / num_bands) for i in range(num_bands + 1) ]
+        self.bands = [ (start, (1 << (end - start)) - 1) for start, end in zip(edges, edges[1:]) ]
+        self.tables = [ {} for _ in self.bands ]
+        self.lock = Lock()
+        self.count = 0
+
+    def _keys(self, fingerprint):
+        return [ (fingerprint >> start) & mask for start, mask in self.bands ]
+
+    def find(self, fingerprint):
+        # (doc id, similarity) of the closest indexed article within the threshold, or None
+        best = None
+        with self.lock:
+            for table, key in zip(self.tables, self._keys(fingerprint)):
+                for other, doc_id in table.get(key, ()):
+                    distance = (fingerprint ^ other).bit_count()
+                    if distance <= self.max_distance and (best is None or distance < best[1]):
+                        best = (doc_id, distance)
+        if best is None:
+            return None
+        return best[0], 1 - best[1] / 64
+
+    def add(self, fingerprint, doc_id):
+        with self.lock:
+            for table, key in zip(self.tables, self._keys(fingerprint)):
+                table.setdefault(key, []).append((fingerprint, doc_id))
+            self.count += 1
+
+    def warm(self, es_client, index='unique-articles'):
+        # Load the fingerprints stored with already indexed articles
+        loaded = 0
+        try:
+            for hit in helpers.scan(es_client, index=index, query={"_source": ["simhash"], "query": {"exists": {"field": "simhash"}}}, size=5000):
+                self.add(int(hit['_source']['simhash'], 16), hit['_id'])
+                loaded += 1
+        except NotFoundError:
+            pass
+        return loaded
+
+
+def format_simhash(fingerprint):
+    # Stored as 16 hex digits, ES longs are signed and would mangle the top bit
+    return f"{fingerprint:016x}"
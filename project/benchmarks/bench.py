@@ -0,0 +1,528 @@
+# Offline benchmarks for the crawler's hot paths.
+# Replays recorded listing and article pages from fixtures/ through the real WebCrawler methods,
+# with Redis, Elasticsearch and Chrome replaced by the stand-ins in fakes.py, so runs need no network
+# and no services and can be compared from one commit to the next.
+#
+#   python benchmarks/bench.py run                 micro benchmarks, feed memory and the end-to-end loop
+#   python benchmarks/bench.py compare OLD NEW     compare two saved runs (commit or file)
+#   python benchmarks/bench.py record URL NAME     save a live page as a new fixture
+import os
+import re
+import sys
+import json
+import time
+import random
+import platform
+import argparse
+import statistics
+import shutil
+import tempfile
+import subprocess
+import tracemalloc
+from contextlib import redirect_stdout
+from threading import Thread
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+PROJECT_DIR = os.path.dirname(BENCHMARKS_DIR)
+sys.path.insert(0, PROJECT_DIR)
+
+import parsers
+from scraper import SITE, ARTICLE_BATCH_SIZE, WebCrawler
+from parsers import Document
+from seen_urls import SeenUrlIndex
+from bulk_writer import BulkWriter
+from scheduler import PolitenessScheduler
+from article_fetcher import ArticleFetcher
+from article_ids import NearDuplicateIndex
+from html_archive import HtmlArchive
+from feed_discovery import FeedDiscovery, read_entries
+from fakes import FakeRedis, FakeElasticsearch, FakeDriver, FakeDriverPool
+
+FIXTURES_DIR = os.path.join(BENCHMARKS_DIR, "fixtures")
+RESULTS_DIR = os.path.join(BENCHMARKS_DIR, "results")
+# fixtures are named <site>-<listing|article>[-anything].html, site being a SITE name in lower case
+FIXTURE_NAME = re.compile(r"^(?P<site>[a-z]+)-(?P<kind>listing|article)(?:-[\w-]+)?\.html$")
+PARAGRAPH = re.compile(r"(<p[^>]*>)([^<]*)(</p>)")
+# top-level feeds are named <site>-feed[-anything].xml, the sitemaps they point to anything else
+FEED_NAME = re.compile(r"^(?P<site>[a-z]+)-feed(?:-[\w-]+)?\.xml$")
+HEADLINE = re.compile(r"(<h1[^>]*>)([^<]*)(</h1>)")
+# One sitemap, page or feed item in a feed fixture, to be repeated into a big feed
+FEED_ENTRY = re.compile(r"<(item|entry|url|sitemap)\b.*?</\1>", re.S)
+# Entries in the small and big copies of each feed, and how much more memory the big one may peak at
+FEED_MEMORY_ENTRIES = (2_000, 20_000)
+FEED_MEMORY_GROWTH = 1.5
+
+
+class Quiet:
+    # The crawler prints as it goes, swallow it while timing
+    def write(self, text):
+        return len(text)
+
+    def flush(self):
+        pass
+
+
+QUIET = Quiet()
+
+
+def load_fixtures(pattern=None):
+    # [(site, kind, name, html)] for every fixture, optionally only names containing pattern
+    sites = { site.name.lower(): site for site in SITE }
+    fixtures = []
+    for name in sorted(os.listdir(FIXTURES_DIR)):
+        match = FIXTURE_NAME.match(name)
+        if match is None or match["site"] not in sites or (pattern and pattern not in name):
+            continue
+        with open(os.path.join(FIXTURES_DIR, name), encoding='utf-8') as f:
+            fixtures.append((sites[match["site"]], match["kind"], name, f.read()))
+    return fixtures
+
+
+def load_feeds(pattern=None):
+    # {site: [file URI of each top-level feed fixture]}, optionally only names containing pattern
+    sites = { site.name.lower(): site for site in SITE }
+    feeds = {}
+    for name in sorted(os.listdir(FIXTURES_DIR)):
+        match = FEED_NAME.match(name)
+        if match is None or match["site"] not in sites or (pattern and pattern not in name):
+            continue
+        feeds.setdefault(sites[match["site"]], []).append("file://" + os.path.join(FIXTURES_DIR, name))
+    return feeds
+
+
+def git_commit():
+    # Results are keyed by the commit they were measured at, "-dirty" if the project had uncommitted changes
+    def git(*args):
+        try:
+            return subprocess.run(["git", *args], cwd=PROJECT_DIR, capture_output=True, text=True, check=True).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            return ""
+    commit = git("rev-parse", "--short", "HEAD") or "unknown"
+    dirty = git("status", "--porcelain", "--untracked-files=no", "--", ".")
+    return commit + ("-dirty" if dirty else "")
+
+
+def measure(function, repeat, setup=None):
+    # Seconds per call, setup (if any) runs before each call and isn't timed
+    times = []
+    with redirect_stdout(QUIET):
+        for _ in range(repeat):
+            if setup is not None:
+                setup()
+            start = time.perf_counter()
+            function()
+            times.append(time.perf_counter() - start)
+    return times
+
+
+def summarize(case, fixture, size, times, items=None):
+    median = statistics.median(times)
+    result = {
+        "case": case,
+        "fixture": fixture,
+        "bytes": size,
+        "runs": len(times),
+        "median_ms": median * 1000,
+        "p90_ms": (statistics.quantiles(times, n=10)[-1] if len(times) > 1 else median) * 1000,
+        "mb_per_s": size / 1e6 / median if median > 0 else None,
+    }
+    if items is not None:
+        result["items"] = items
+        result["us_per_item"] = median * 1e6 / items if items > 0 else None
+    return result
+
+
+class Stack:
+    # The services a crawler talks to, all in-process
+    def __init__(self):
+        self.es = FakeElasticsearch()
+        self.es_client = self.es.client()
+        self.r = FakeRedis()
+        self.archive_dir = tempfile.mkdtemp(prefix="bench-archive-")
+        self.archive = HtmlArchive(self.archive_dir)
+
+    def crawler(self, site, driver, subdirectory="", feeds=None, **components):
+        # A WebCrawler wired to the stand-ins, set up but not running.
+        # It scrolls for links unless given a FeedDiscovery, the site's real feeds would need the network
+        with redirect_stdout(QUIET):
+            crawler = WebCrawler(
+                site,
+                subdirectory,
+                seen_urls=components.pop("seen_urls", None) or SeenUrlIndex(self.es_client),
+                near_duplicates=components.pop("near_duplicates", None) or NearDuplicateIndex(),
+                archive=self.archive,
+                driver_pool=FakeDriverPool(driver),
+                es_client=self.es_client,
+                r=self.r,
+                autorun=False,
+                **components
+            )
+        crawler.feeds = feeds
+        return crawler
+
+    def close(self):
+        self.es.close()
+        self.archive.close()
+        shutil.rmtree(self.archive_dir)
+
+
+def bench_listing(stack, components, site, name, html, repeat):
+    # Link extraction from a listing page, both by parsing page_source and from in-browser harvesting
+    url = site.value
+    driver = FakeDriver(html, url)
+    crawler = stack.crawler(site, driver, **components)
+    size = len(html.encode('utf-8'))
+    hrefs = [ href for href in Document(url, html).hrefs if href ]
+
+    def reset():
+        driver.reset()
+        crawler.has_links = True
+
+    return [
+        summarize("extract_links", name, size,
+                  measure(lambda: crawler.extract_links(url, driver), repeat, reset), len(hrefs)),
+        summarize("extract_links[harvest]", name, size,
+                  measure(lambda: crawler.extract_links(url, driver, harvest=True), repeat, reset), len(hrefs)),
+        summarize("check_filters", name, size,
+                  measure(lambda: [ crawler.check_filters(href) for href in hrefs ], repeat), len(hrefs)),
+    ]
+
+
+def bench_article(stack, components, site, name, html, repeat):
+    # Parsing an article and pulling its fields out
+    url = site.value + name
+    crawler = stack.crawler(site, FakeDriver(html, url), **components)
+    size = len(html.encode('utf-8'))
+    soup = Document(url, html).soup
+
+    def forget_articles():
+        # Otherwise every run after the first is skipped as a near-duplicate of the first
+        crawler.near_duplicates = NearDuplicateIndex()
+
+    return [
+        summarize("parse", name, size, measure(lambda: Document(url, html).soup, repeat)),
+        summarize("scrape_article_data", name, size, measure(lambda: crawler.scrape_article_data(soup), repeat, forget_articles)),
+        summarize("scrape_date", name, size, measure(lambda: crawler.scrape_date(soup), repeat)),
+    ]
+
+
+def bench_feeds(stack, components, site, feeds, repeat):
+    # Streaming a site's sitemaps and feeds from scratch, every entry parsed and filtered
+    crawler = stack.crawler(site, FakeDriver("<html></html>", site.value), **components)
+    size = 0
+    discovery = None
+
+    def forget_feeds():
+        # A fresh discovery each time or every run after the first would skip the unchanged sitemaps
+        nonlocal discovery
+        discovery = FeedDiscovery(site, feeds, crawler.check_filters, use_robots=False)
+
+    forget_feeds()
+    with redirect_stdout(QUIET):
+        found, _ = discovery.discover()
+    for name in os.listdir(FIXTURES_DIR):
+        if name.startswith(site.name.lower() + "-") and name.endswith(".xml"):
+            size += os.path.getsize(os.path.join(FIXTURES_DIR, name))
+    return [ summarize("feed_discovery", f"{site.name.lower()}-feeds", size, measure(lambda: discovery.discover(), repeat, forget_feeds), len(found)) ]
+
+
+def scaled_feed(path, entries):
+    # A copy of the feed fixture at path with its entries repeated until there are `entries` of them, each with its own URL
+    with open(path, encoding='utf-8') as f:
+        text = f.read()
+    found = list(FEED_ENTRY.finditer(text))
+    if len(found) == 0:
+        return None
+    start, end = found[0].start(), found[-1].end()
+    repeated = []
+    for n in range(entries):
+        entry = found[n % len(found)].group(0)
+        repeated.append(re.sub(r"(https?://[^<\"]*?)(/?)(</|\")", lambda m: f"{m[1]}-copy-{n}{m[2]}{m[3]}", entry, count=1))
+    return text[:start] + "\n".join(repeated) + text[end:]
+
+
+def bench_feed_memory(feeds):
+    # Peak memory streaming a small and a big copy of each feed fixture, which should be about the same
+    results = []
+    for site_feeds in feeds.values():
+        for feed in site_feeds:
+            name = os.path.basename(feed)
+            peaks = []
+            for entries in FEED_MEMORY_ENTRIES:
+                text = scaled_feed(feed[len("file://"):], entries)
+                if text is None:
+                    break
+                with tempfile.NamedTemporaryFile("w", suffix=".xml", encoding='utf-8', delete=False) as f:
+                    f.write(text)
+                del text
+                try:
+                    tracemalloc.start()
+                    with open(f.name, "rb") as source:
+                        read = sum(1 for _ in read_entries(source))
+                    peaks.append(tracemalloc.get_traced_memory()[1])
+                    tracemalloc.stop()
+                finally:
+                    os.remove(f.name)
+                if read != entries:
+                    raise RuntimeError(f"{name}: read {read} of {entries} entries")
+            if len(peaks) < len(FEED_MEMORY_ENTRIES):
+                continue
+            result = {
+                "case": "feed_memory",
+                "fixture": name,
+                "entries": list(FEED_MEMORY_ENTRIES),
+                "peak_kb": [ peak / 1024 for peak in peaks ],
+                "flat": peaks[-1] <= peaks[0] * FEED_MEMORY_GROWTH,
+            }
+            print(f"{'feed_memory':<24} {name:<28} " + "  ".join(f"{n} entries {kb:8.1f} KB" for n, kb in zip(result["entries"], result["peak_kb"]))
+                  + ("" if result["flat"] else "  GROWS WITH THE FEED"))
+            results.append(result)
+    return results
+
+
+def run_micro(stack, fixtures, feeds, repeat):
+    scheduler = PolitenessScheduler(honor_robots=False)
+    components = {
+        "scheduler": scheduler,
+        "fetcher": ArticleFetcher(scheduler),
+        "bulk_writer": BulkWriter(stack.es_client),
+    }
+    results = []
+    try:
+        for site, kind, name, html in fixtures:
+            bench = bench_listing if kind == "listing" else bench_article
+            for result in bench(stack, components, site, name, html, repeat):
+                print_result(result)
+                results.append(result)
+        for site, site_feeds in feeds.items():
+            for result in bench_feeds(stack, components, site, site_feeds, repeat):
+                print_result(result)
+                results.append(result)
+    finally:
+        components["fetcher"].close()
+        components["bulk_writer"].close()
+    return results
+
+
+class ArticleServer:
+    # Serves any path as the recorded article, reworded by the path so every URL
+    # is a different article as far as the IDs and the near-duplicate check go
+    def __init__(self, html):
+        self.html = html
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            disable_nagle_algorithm = True
+
+            def do_GET(self):
+                data = server.article(self.path).encode('utf-8')
+                self.send_response(200)
+                self.send_header("Content-Type", "text/html; charset=utf-8")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.httpd.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self.httpd.server_port}"
+        Thread(target=self.httpd.serve_forever, name="article-server", daemon=True).start()
+
+    def article(self, path):
+        rng = random.Random(path)
+        def reword(match):
+            # Shuffle and swap out a third of the words
+            words = [ word if rng.random() > 1 / 3 else f"{rng.getrandbits(24):x}" for word in match[2].split() ]
+            rng.shuffle(words)
+            return match[1] + " ".join(words) + match[3]
+        # A headline of its own too, or every article would get the same ID
+        html = HEADLINE.sub(lambda match: match[1] + f"{match[2]} {path}" + match[3], self.html, count=1)
+        return PARAGRAPH.sub(reword, html)
+
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+def run_end_to_end(stack, fixtures, articles):
+    # Per site: discover links on the recorded listing (scrolling, extraction, seen-URL check, frontier push),
+    # then drain a frontier of local article URLs through scrape_batch: HTTP fetch, parse, extract, bulk write
+    by_site = {}
+    for site, kind, name, html in fixtures:
+        by_site.setdefault(site, {}).setdefault(kind, html)
+    results = []
+    for site, pages in by_site.items():
+        if "listing" not in pages or "article" not in pages:
+            continue
+        server = ArticleServer(pages["article"])
+        scheduler = PolitenessScheduler(default_rate=1000, burst=ARTICLE_BATCH_SIZE, honor_robots=False)
+        fetcher = ArticleFetcher(scheduler)
+        bulk_writer = BulkWriter(stack.es_client, max_age=0.5)
+        driver = FakeDriver(pages["listing"], site.value)
+        crawler = stack.crawler(site, driver, scheduler=scheduler, fetcher=fetcher, bulk_writer=bulk_writer)
+        crawler.frontier.clear() # Drop what the micro benchmarks queued
+        written_before = stack.es.count('unique-articles')
+        try:
+            with redirect_stdout(QUIET):
+                start = time.perf_counter()
+                crawler.discover()
+                discovered = crawler.frontier.depth()
+                discover_seconds = time.perf_counter() - start
+
+                crawler.frontier.clear()
+                crawler.frontier.push([ f"{server.url}/{site.name.lower()}/{n}" for n in range(articles) ])
+                start = time.perf_counter()
+                while crawler.scrape_batch(crawler.frontier.pop(ARTICLE_BATCH_SIZE)):
+                    pass
+                bulk_writer.close() # Includes the final flush
+                scrape_seconds = time.perf_counter() - start
+        finally:
+            fetcher.close()
+            server.close()
+        result = {
+            "case": "end_to_end",
+            "fixture": site.name,
+            "discovered": discovered,
+            "discover_ms": discover_seconds * 1000,
+            "articles": articles,
+            "written": stack.es.count('unique-articles') - written_before,
+            "scrape_s": scrape_seconds,
+            "articles_per_s": articles / scrape_seconds,
+            "bulk_failed": bulk_writer.failed,
+        }
+        print(f"{'end_to_end':<24} {site.name:<28} discovered {discovered} in {result['discover_ms']:.1f} ms, "
+              f"{articles} articles in {scrape_seconds:.2f} s ({result['articles_per_s']:.1f}/s, {result['written']} written)")
+        results.append(result)
+    return results
+
+
+def print_result(result):
+    line = f"{result['case']:<24} {result['fixture']:<28} {result['median_ms']:8.3f} ms  p90 {result['p90_ms']:8.3f} ms"
+    if result["mb_per_s"] is not None:
+        line += f"  {result['mb_per_s']:7.2f} MB/s"
+    if result.get("us_per_item") is not None:
+        line += f"  {result['us_per_item']:7.2f} us/" + ("entry" if result["case"] == "feed_discovery" else "href")
+    print(line)
+
+
+def run(args):
+    fixtures = load_fixtures(args.only)
+    feeds = load_feeds(args.only)
+    if len(fixtures) + len(feeds) == 0:
+        sys.exit(f"No fixtures in {FIXTURES_DIR}" + (f" matching '{args.only}'" if args.only else ""))
+    commit = git_commit()
+    print(f"Benchmarking {commit}: {len(fixtures)} fixtures, {sum(len(f) for f in feeds.values())} feeds, parsers {parsers.TREE_BACKEND}/{parsers.LINK_BACKEND}")
+    stack = Stack()
+    try:
+        micro = run_micro(stack, fixtures, feeds, args.repeat)
+        memory = bench_feed_memory(feeds)
+        end_to_end = [] if args.skip_end_to_end else run_end_to_end(stack, fixtures, args.articles)
+    finally:
+        stack.close()
+    results = {
+        "commit": commit,
+        "date": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "tree_parser": parsers.TREE_BACKEND,
+        "link_parser": parsers.LINK_BACKEND,
+        "repeat": args.repeat,
+        "micro": micro,
+        "memory": memory,
+        "end_to_end": end_to_end,
+    }
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    path = args.output or os.path.join(RESULTS_DIR, f"{commit}.json")
+    with open(path, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"Saved results to {path}")
+    growing = [ result["fixture"] for result in memory if not result["flat"] ]
+    if len(growing) > 0:
+        sys.exit(f"Memory grows with the size of {', '.join(growing)}")
+
+
+def load_results(name):
+    path = name if os.path.exists(name) else os.path.join(RESULTS_DIR, f"{name}.json")
+    with open(path) as f:
+        return json.load(f)
+
+
+def compare(args):
+    old, new = load_results(args.old), load_results(args.new)
+    print(f"{old['commit']} -> {new['commit']}")
+    before = { (r["case"], r["fixture"]): r for r in old["micro"] }
+    for result in new["micro"]:
+        previous = before.get((result["case"], result["fixture"]))
+        if previous is None:
+            continue
+        change = result["median_ms"] / previous["median_ms"] - 1
+        print(f"{result['case']:<24} {result['fixture']:<28} {previous['median_ms']:8.3f} -> {result['median_ms']:8.3f} ms  {change:+7.1%}")
+    before = { r["fixture"]: r for r in old["end_to_end"] }
+    for result in new["end_to_end"]:
+        previous = before.get(result["fixture"])
+        if previous is None:
+            continue
+        change = result["articles_per_s"] / previous["articles_per_s"] - 1
+        print(f"{'end_to_end':<24} {result['fixture']:<28} {previous['articles_per_s']:8.1f} -> {result['articles_per_s']:8.1f} articles/s  {change:+7.1%}")
+
+
+def record(args):
+    # Listings need a browser to scroll in more of the feed, articles are saved as served over HTTP
+    if FIXTURE_NAME.match(args.name + ".html") is None:
+        sys.exit("NAME must look like <site>-<listing|article>[-anything], e.g. ign-article-review")
+    if args.name.split("-")[1] == "listing":
+        from selenium import webdriver
+        from link_harvester import page_size, wait_for_growth
+        from scraper import CHROME_OPTIONS
+        driver = webdriver.Chrome(options=CHROME_OPTIONS)
+        try:
+            driver.get(args.url)
+            for _ in range(args.scrolls):
+                size = page_size(driver)
+                driver.execute_script("window.scrollTo(0, document.body.scrollHeight);")
+                if not wait_for_growth(driver, size):
+                    break
+            html = driver.page_source
+        finally:
+            driver.quit()
+    else:
+        scheduler = PolitenessScheduler()
+        fetcher = ArticleFetcher(scheduler)
+        try:
+            (_, html), = fetcher.fetch_all([args.url])
+        finally:
+            fetcher.close()
+        if html is None:
+            sys.exit(f"Couldn't fetch {args.url}")
+    path = os.path.join(FIXTURES_DIR, args.name + ".html")
+    with open(path, "w", encoding='utf-8') as f:
+        f.write(html)
+    print(f"Saved {len(html.encode('utf-8')) / 1024:.0f} KB to {path}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline crawler benchmarks")
+    commands = parser.add_subparsers(dest="command", required=True)
+    run_parser = commands.add_parser("run", help="run the benchmarks and save the results under the current commit")
+    run_parser.add_argument("--repeat", type=int, default=50, help="timed runs per micro benchmark")
+    run_parser.add_argument("--articles", type=int, default=200, help="articles scraped per site in the end-to-end loop")
+    run_parser.add_argument("--only", help="only fixtures whose file name contains this")
+    run_parser.add_argument("--skip-end-to-end", action="store_true")
+    run_parser.add_argument("--output", help="where to save the results, default results/<commit>.json")
+    compare_parser = commands.add_parser("compare", help="compare two saved runs")
+    compare_parser.add_argument("old", help="commit or results file")
+    compare_parser.add_argument("new", help="commit or results file")
+    record_parser = commands.add_parser("record", help="save a live page as a fixture")
+    record_parser.add_argument("url")
+    record_parser.add_argument("name", help="fixture name without .html, e.g. pcgamer-listing-archive")
+    record_parser.add_argument("--scrolls", type=int, default=10, help="times to scroll a listing before saving it")
+    args = parser.parse_args()
+    { "run": run, "compare": compare, "record": record }[args.command](args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,507 @@
+import json
+import bisect
+from threading import Thread, RLock
+from contextlib import contextmanager
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit, parse_qs
+from elasticsearch import Elasticsearch
+from parsers import Document
+from driver_pool import PooledDriver
+from frontier import PUSH_SCRIPT, POP_SCRIPT
+from trends import COUNT_SCRIPT
+from link_harvester import HARVEST_SCRIPT, GROWTH_SCRIPT
+from load_profile import PAGE_STATS_SCRIPT
+
+# In-process stand-ins for Redis, Elasticsearch and Chrome, just enough of each for the crawler code paths.
+# Anything they don't implement raises instead of quietly doing nothing, so a benchmark can't
+# end up timing a code path that silently skipped its work.
+
+
+def encode(value):
+    # Redis hands everything back as bytes
+    if isinstance(value, bytes):
+        return value
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    return str(value).encode('utf-8')
+
+
+def parse_score(value):
+    # ZRANGEBYSCORE bounds: numbers, -inf/+inf and "(" for exclusive
+    value = value.decode('utf-8') if isinstance(value, bytes) else str(value)
+    exclusive = value.startswith("(")
+    value = value.lstrip("(")
+    return float(value.replace("+inf", "inf")), exclusive
+
+
+def command(method):
+    # Each command runs under the client's lock and is counted
+    def locked(self, *args, **kwargs):
+        with self.lock:
+            self.commands += 1
+            return method(self, *args, **kwargs)
+    locked.__name__ = method.__name__
+    return locked
+
+
+class FakeRedis:
+    # Strings, sets, hashes and sorted sets in dicts, plus pipelines and the Lua scripts the frontier uses.
+    # Lua isn't interpreted, each known script has a Python equivalent in SCRIPTS.
+    def __init__(self):
+        self.data = {}
+        self.lock = RLock()
+        self.commands = 0
+
+    def _get(self, name, kind):
+        value = self.data.get(encode(name))
+        if value is not None and not isinstance(value, kind):
+            raise TypeError(f"WRONGTYPE {name!r} holds a {type(value).__name__}")
+        return value
+
+    def _create(self, name, kind):
+        value = self._get(name, kind)
+        if value is None:
+            value = self.data[encode(name)] = kind()
+        return value
+
+    # Keys
+    @command
+    def delete(self, *names):
+        return sum(1 for name in names if self.data.pop(encode(name), None) is not None)
+
+    @command
+    def exists(self, *names):
+        return sum(1 for name in names if encode(name) in self.data)
+
+    @command
+    def expire(self, name, seconds):
+        return encode(name) in self.data # Nothing lives long enough here for expiry to matter
+
+    @command
+    def flushdb(self):
+        self.data.clear()
+        return True
+
+    # Strings
+    @command
+    def get(self, name):
+        return self._get(name, bytes)
+
+    @command
+    def set(self, name, value, **kwargs):
+        self.data[encode(name)] = encode(value)
+        return True
+
+    # Sets
+    @command
+    def sadd(self, name, *values):
+        members = self._create(name, set)
+        before = len(members)
+        members.update(encode(value) for value in values)
+        return len(members) - before
+
+    @command
+    def srem(self, name, *values):
+        members = self._get(name, set) or set()
+        before = len(members)
+        members.difference_update(encode(value) for value in values)
+        return before - len(members)
+
+    @command
+    def sismember(self, name, value):
+        return encode(value) in (self._get(name, set) or ())
+
+    @command
+    def smembers(self, name):
+        return set(self._get(name, set) or ())
+
+    @command
+    def scard(self, name):
+        return len(self._get(name, set) or ())
+
+    # Hashes
+    @command
+    def hset(self, name, key=None, value=None, mapping=None):
+        fields = self._create(name, dict)
+        items = dict(mapping or {})
+        if key is not None:
+            items[key] = value
+        added = 0
+        for field, field_value in items.items():
+            added += encode(field) not in fields
+            fields[encode(field)] = encode(field_value)
+        return added
+
+    @command
+    def hget(self, name, key):
+        return (self._get(name, dict) or {}).get(encode(key))
+
+    @command
+    def hgetall(self, name):
+        return dict(self._get(name, dict) or {})
+
+    @command
+    def hdel(self, name, *keys):
+        fields = self._get(name, dict) or {}
+        return sum(1 for key in keys if fields.pop(encode(key), None) is not None)
+
+    @command
+    def hincrby(self, name, key, amount=1):
+        fields = self._create(name, dict)
+        total = int(fields.get(encode(key), b"0")) + amount
+        fields[encode(key)] = encode(total)
+        return total
+
+    # Sorted sets, kept as {member: score}
+    @command
+    def zadd(self, name, mapping):
+        scores = self._create(name, ZSet)
+        return sum(scores.add(member, score) for member, score in mapping.items())
+
+    @command
+    def zrem(self, name, *values):
+        scores = self._get(name, ZSet)
+        if scores is None:
+            return 0
+        return sum(scores.remove(value) for value in values)
+
+    @command
+    def zcard(self, name):
+        return len(self._get(name, ZSet) or ())
+
+    @command
+    def zscore(self, name, value):
+        return (self._get(name, ZSet) or ZSet()).scores.get(encode(value))
+
+    @command
+    def zpopmin(self, name, count=1):
+        scores = self._get(name, ZSet)
+        if scores is None:
+            return []
+        return scores.pop_min(int(count))
+
+    @command
+    def zrangebyscore(self, name, min, max):
+        scores = self._get(name, ZSet)
+        if scores is None:
+            return []
+        return scores.range_by_score(parse_score(min), parse_score(max))
+
+    # Batching and scripts
+    def pipeline(self, transaction=True):
+        return FakePipeline(self)
+
+    def register_script(self, script):
+        if script not in SCRIPTS:
+            raise NotImplementedError("FakeRedis has no Python version of this script:\n" + script)
+        return FakeScript(self, SCRIPTS[script])
+
+    def _run_script(self, function, keys, args):
+        with self.lock:
+            self.commands += 1
+            return function(self, keys, args)
+
+
+class ZSet:
+    # Members ordered by (score, member) like Redis, so ZPOPMIN is a slice off the front
+    def __init__(self):
+        self.scores = {}
+        self.order = []
+
+    def __len__(self):
+        return len(self.scores)
+
+    def add(self, member, score):
+        member, score = encode(member), float(score)
+        added = member not in self.scores
+        if not added:
+            self.order.remove((self.scores[member], member))
+        self.scores[member] = score
+        bisect.insort(self.order, (score, member))
+        return int(added)
+
+    def remove(self, member):
+        member = encode(member)
+        if member not in self.scores:
+            return 0
+        self.order.remove((self.scores.pop(member), member))
+        return 1
+
+    def pop_min(self, count):
+        popped, self.order = self.order[:count], self.order[count:]
+        for _, member in popped:
+            del self.scores[member]
+        return [ (member, score) for score, member in popped ]
+
+    def range_by_score(self, low, high):
+        (low, low_exclusive), (high, high_exclusive) = low, high
+        return [
+            member for score, member in self.order
+            if (score > low if low_exclusive else score >= low) and (score < high if high_exclusive else score <= high)
+        ]
+
+
+class FakeScript:
+    def __init__(self, r, function):
+        self.r = r
+        self.function = function
+
+    def __call__(self, keys=[], args=[], client=None):
+        return (client or self.r)._run_script(self.function, keys, args)
+
+
+class FakePipeline:
+    # Queues commands and runs them back to back under the lock on execute()
+    def __init__(self, r):
+        self.r = r
+        self.queued = []
+
+    def __getattr__(self, name):
+        method = getattr(self.r, name)
+        def queue(*args, **kwargs):
+            self.queued.append((method, args, kwargs))
+            return self
+        return queue
+
+    def _run_script(self, function, keys, args):
+        self.queued.append((self.r._run_script, (function, keys, args), {}))
+        return self
+
+    def execute(self):
+        with self.r.lock:
+            queued, self.queued = self.queued, []
+            return [ method(*args, **kwargs) for method, args, kwargs in queued ]
+
+
+def push_script(r, keys, args):
+    added = 0
+    for score, url in zip(args[::2], args[1::2]):
+        if r.sadd(keys[1], url) == 1:
+            r.zadd(keys[0], { url: score })
+            added += 1
+    return added
+
+
+def pop_script(r, keys, args):
+    count, now, lease_until = args
+    for url in r.zrangebyscore(keys[1], "-inf", now):
+        r.zrem(keys[1], url)
+        r.zadd(keys[0], { url: 0 })
+    urls = []
+    for url, _ in r.zpopmin(keys[0], count):
+        urls.append(url)
+        r.zadd(keys[1], { url: lease_until })
+    return urls
+
+
+def count_script(r, keys, args):
+    _id, ttl, *fields = args
+    if r.sadd(keys[0], _id) == 0:
+        return 0
+    for field in fields:
+        r.hincrby(keys[1], field, 1)
+        r.hincrby(keys[2], field, 1)
+    r.expire(keys[1], ttl)
+    return 1
+
+
+SCRIPTS = {
+    PUSH_SCRIPT: push_script,
+    POP_SCRIPT: pop_script,
+    COUNT_SCRIPT: count_script,
+}
+
+
+class FakeElasticsearch:
+    # A local HTTP server speaking the slice of the REST API the crawler uses:
+    # info, _bulk, _mget and scroll searches. The real client talks to it, so request
+    # serialization and the bulk helpers are part of what gets timed.
+    def __init__(self):
+        self.indices = {}
+        self.requests = {}
+        self.lock = RLock()
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), ElasticsearchHandler)
+        self.server.daemon_threads = True
+        self.server.fake = self
+        self.url = f"http://127.0.0.1:{self.server.server_port}"
+        self.thread = Thread(target=self.server.serve_forever, name="fake-elasticsearch", daemon=True)
+        self.thread.start()
+
+    def client(self):
+        return Elasticsearch(self.url, request_timeout=30)
+
+    def count(self, index):
+        with self.lock:
+            return len(self.indices.get(index, {}))
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def handle(self, method, path, query, body):
+        parts = [ part for part in path.split("/") if part ]
+        endpoint = next((part for part in parts if part.startswith("_")), "")
+        with self.lock:
+            self.requests[endpoint or method] = self.requests.get(endpoint or method, 0) + 1
+        if len(parts) == 0:
+            return 200, {
+                "name": "fake", "cluster_name": "benchmarks", "cluster_uuid": "benchmarks",
+                "version": { "number": "8.13.0", "build_flavor": "default" }, "tagline": "You Know, for Search"
+            }
+        index = parts[0] if not parts[0].startswith("_") else None
+        if endpoint == "_bulk":
+            return 200, self.bulk(index, body)
+        if endpoint == "_mget":
+            return 200, self.mget(index, json.loads(body or b"{}"))
+        if endpoint == "_search" and parts[-1] == "scroll":
+            # Every search returns all of its hits on the first page
+            if method == "DELETE":
+                return 200, { "succeeded": True, "num_freed": 0 }
+            return 200, { "_scroll_id": "done", "hits": { "total": { "value": 0, "relation": "eq" }, "hits": [] } }
+        if endpoint == "_search":
+            return self.search(index, json.loads(body or b"{}"))
+        return 400, { "error": { "type": "illegal_argument_exception", "reason": f"FakeElasticsearch doesn't support {method} {path}" }, "status": 400 }
+
+    def bulk(self, default_index, body):
+        lines = [ json.loads(line) for line in body.splitlines() if line.strip() ]
+        items = []
+        position = 0
+        with self.lock:
+            while position < len(lines):
+                (action, meta), = lines[position].items()
+                position += 1
+                index = meta.get("_index", default_index)
+                documents = self.indices.setdefault(index, {})
+                _id = meta.get("_id")
+                if action == "delete":
+                    found = documents.pop(_id, None) is not None
+                    items.append({ action: { "_index": index, "_id": _id, "status": 200 if found else 404, "result": "deleted" if found else "not_found" } })
+                    continue
+                source = lines[position]
+                position += 1
+                if action == "update":
+                    source = { **documents.get(_id, {}), **source.get("doc", {}) }
+                created = _id not in documents
+                documents[_id] = source
+                items.append({ action: { "_index": index, "_id": _id, "status": 201 if created else 200, "result": "created" if created else "updated" } })
+        return { "took": 0, "errors": False, "items": items }
+
+    def mget(self, index, body):
+        ids = body.get("ids") or [ doc["_id"] for doc in body.get("docs", []) ]
+        with self.lock:
+            documents = self.indices.get(index, {})
+            return { "docs": [ { "_index": index, "_id": _id, "found": _id in documents } for _id in ids ] }
+
+    def search(self, index, body):
+        with self.lock:
+            if index not in self.indices:
+                return 404, {
+                    "error": { "type": "index_not_found_exception", "reason": f"no such index [{index}]", "index": index },
+                    "status": 404
+                }
+            documents = list(self.indices[index].items())
+        field = body.get("query", {}).get("exists", {}).get("field")
+        if field is not None:
+            documents = [ (_id, source) for _id, source in documents if source.get(field) is not None ]
+        wanted = body.get("_source", True)
+        hits = []
+        for _id, source in documents:
+            hit = { "_index": index, "_id": _id }
+            if wanted is True:
+                hit["_source"] = source
+            elif wanted:
+                hit["_source"] = { key: source.get(key) for key in wanted }
+            hits.append(hit)
+        return 200, { "_scroll_id": "done", "hits": { "total": { "value": len(hits), "relation": "eq" }, "hits": hits } }
+
+
+class ElasticsearchHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True # Headers and body go out in separate writes
+
+    def respond(self):
+        request = urlsplit(self.path)
+        length = int(self.headers.get("Content-Length", 0))
+        body = self.rfile.read(length) if length else b""
+        status, payload = self.server.fake.handle(self.command, request.path, parse_qs(request.query), body)
+        data = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("X-Elastic-Product", "Elasticsearch")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        if self.command != "HEAD":
+            self.wfile.write(data)
+
+    do_GET = do_POST = do_PUT = do_DELETE = do_HEAD = respond
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FakeDriver:
+    # Plays back a recorded page as if Chrome had it open. Scrolling makes the page one screen taller,
+    # like an infinite feed that always has more, so scroll_page never sits waiting for growth.
+    def __init__(self, html, url="about:blank", screen_height=1080):
+        self.html = html
+        self.current_url = url
+        self.screen_height = screen_height
+        self.links = html.count("<a ")
+        self.reset()
+
+    def reset(self):
+        self.height = self.screen_height * 2
+        self.harvested = False
+
+    def get(self, url):
+        self.current_url = url
+        self.reset()
+
+    @property
+    def page_source(self):
+        return self.html
+
+    def execute_script(self, script, *args):
+        if script == "return window.screen.height;":
+            return self.screen_height
+        if script == "return document.readyState;":
+            return "complete"
+        if script == "return document.body.scrollHeight;":
+            return self.height
+        if script == "return document.querySelector(arguments[0]) !== null;":
+            return True
+        if script.startswith("window.scrollTo("):
+            self.height += self.screen_height
+            return None
+        if script == GROWTH_SCRIPT:
+            return [self.height, self.links]
+        if script == HARVEST_SCRIPT:
+            # Everything on the first call, the recording never grows so nothing after that
+            if self.harvested:
+                return []
+            self.harvested = True
+            return self.hrefs()
+        if script == PAGE_STATS_SCRIPT:
+            return [len(self.html.encode('utf-8')), 0.0]
+        raise NotImplementedError("FakeDriver can't run this script:\n" + script)
+
+    def hrefs(self):
+        return Document(self.current_url, self.html).hrefs
+
+    def quit(self):
+        pass
+
+
+class FakeDriverPool:
+    # A one-browser DriverPool around a FakeDriver
+    def __init__(self, driver):
+        self.size = 1
+        self.pooled = PooledDriver(driver, 1)
+
+    @contextmanager
+    def lease(self, owner=None):
+        self.pooled.owner = owner or self.pooled.owner
+        yield self.pooled
+
+    def close(self):
+        pass
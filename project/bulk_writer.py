@@ -0,0 +1,95 @@
+import json
+import time
+from queue import Queue, Empty
+from threading import Thread, Event
+from elasticsearch import helpers
+from metrics import log, BULK_SECONDS, BULK_DOCUMENTS, BULK_QUEUE
+
+
+class BulkWriter:
+    # Queues documents and writes them with the bulk API from a background thread.
+    # A batch is flushed when it reaches max_docs or max_bytes, or when its oldest
+    # document has waited max_age seconds. Call close() on shutdown to flush the rest.
+    def __init__(self, es_client, max_docs=500, max_bytes=5 * 1024 * 1024, max_age=5.0, max_retries=3):
+        self.es_client = es_client
+        self.max_docs = max_docs
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.max_retries = max_retries
+        self.queue = Queue()
+        self.stopping = Event()
+        self.written = 0
+        self.failed = 0
+        self.worker = Thread(target=self._run, name="bulk-writer", daemon=True)
+        self.worker.start()
+        BULK_QUEUE.track(self.queue.qsize)
+
+    def add(self, index, _id, document):
+        action = { '_index': index, '_id': _id, '_source': document }
+        self.queue.put((action, len(json.dumps(document, default=str))))
+
+    def close(self):
+        # Stop the worker once everything already queued has been written
+        self.stopping.set()
+        self.worker.join()
+        log("Bulk writer", f"{self.written} written, {self.failed} failed")
+
+    def _run(self):
+        batch = []
+        batch_bytes = 0
+        batch_started = None
+        while True:
+            if batch_started is None:
+                timeout = 0.5
+            else:
+                timeout = max(0.0, self.max_age - (time.monotonic() - batch_started))
+            try:
+                action, size = self.queue.get(timeout=timeout)
+                if batch_started is None:
+                    batch_started = time.monotonic()
+                batch.append(action)
+                batch_bytes += size
+            except Empty:
+                if self.stopping.is_set() and self.queue.empty():
+                    self._flush(batch)
+                    return
+
+            aged = batch_started is not None and time.monotonic() - batch_started >= self.max_age
+            if len(batch) >= self.max_docs or batch_bytes >= self.max_bytes or aged:
+                self._flush(batch)
+                batch = []
+                batch_bytes = 0
+                batch_started = None
+
+    def _flush(self, batch):
+        if len(batch) == 0:
+            return
+        # Rejected (429) and unavailable (5xx) items are retried with backoff by the helper,
+        # whole-request failures (e.g. a dropped connection) resend the batch here
+        for attempt in range(self.max_retries + 1):
+            start = time.perf_counter()
+            try:
+                errors = 0
+                for ok, item in helpers.streaming_bulk(
+                    self.es_client,
+                    batch,
+                    chunk_size=self.max_docs,
+                    max_chunk_bytes=self.max_bytes,
+                    raise_on_error=False,
+                    max_retries=self.max_retries,
+                    retry_on_status=(429, 502, 503, 504),
+                    yield_ok=False
+                ):
+                    errors += 1
+                    log("Bulk writer", f"Failed to write document: {item}")
+                self.written += len(batch) - errors
+                self.failed += errors
+                BULK_SECONDS.observe(time.perf_counter() - start)
+                BULK_DOCUMENTS.inc(len(batch) - errors, outcome="written")
+                BULK_DOCUMENTS.inc(errors, outcome="failed")
+                return
+            except Exception as e:
+                log("Bulk writer", f"Bulk request failed (attempt {attempt + 1}): {e}")
+                time.sleep(2 ** attempt)
+        self.failed += len(batch)
+        BULK_DOCUMENTS.inc(len(batch), outcome="failed")
@@ -1,15 +1,20 @@
 import os
+import sys
 import time
 import hashlib
+import sqlite3
+import argparse
+import tempfile
 from enum import Enum
+from queue import Queue
+from threading import Thread, Lock
 from elasticsearch import Elasticsearch, helpers
-from selenium import webdriver
-from selenium.webdriver.chrome.options import Options
+from article_ids import generate_id, legacy_id, simhash, format_simhash
 
 # Enum for supported sites
-SITE = Enum('SITE', 
+SITE = Enum('SITE',
             [
-                ('IGN', "https://www.ign.com/"), 
+                ('IGN', "https://www.ign.com/"),
                 ('GameInformer', "https://www.gameinformer.com/"), # RIP GameInformer
                 ('PCGamer', "https://www.pcgamer.com/")
                 ]
@@ -23,62 +28,233 @@ es = Elasticsearch(
             ES_CLOUD_ID,
             api_key=ES_API_KEY
         )
-print(str(es.info()) + "\n\n")
-
-new_docs = []
-unique_headlines = set()
-
-# Helper function to generate a unique ID for articles
-def generate_id(site, headline, date):
-    combined_key = "".join(site.split()) + "".join(headline.split()) + "".join(date.split())
-    _id = combined_key.encode('utf-8')
-    # Elasticsearch did not like using hashed IDs
-    return _id
-        
-
-def write_to_elastic(es_client, site, headline, date, authors, body, topics):
-        print("Writing to Elastic Articles: " + headline)
-        es_client.index(
-            index='unique-articles', 
-            id = generate_id(site, headline, date),
-            document={ 
-                'site': site, 
-                'headline': headline, 
-                'date': date, 
-                'authors': authors, 
-                'body': body, 
-                'topics': topics 
-            }
-        )
 
-def scroll_over_all_docs():
-    for hit in helpers.scan(es, index='articles'):
-        if (hit['_source']['headline'] not in unique_headlines):
-            unique_headlines.add(hit['_source']['headline'])
-            new_docs.append(hit)
-            print("New Article Found: " + hit['_source']['headline'])
-
-def write_article(article):
-
-    site = article['_source']['site']
-    print(site)
-    headline = article['_source']['headline']
-    print(headline)
-    date = article['_source']['date']
-    print(date)
-    authors = [a for a in article['_source']['author']]
-    print(authors)
-    body = [b for b in article['_source']['body']]
-    print("Body Found")
-    topics = [t for t in article['_source']['topics']]
-    print(topics)
-    write_to_elastic(es, site, headline, date, authors, body, topics)
+# Marks the end of one slice's hits in the queue
+SLICE_DONE = object()
+
+
+class HeadlineDedup:
+    # Headlines we've already copied, kept on disk as 8-byte hashes so memory stays flat
+    # no matter how many articles go through.
+    # A headline is claimed when its article is queued and only recorded once the write succeeds,
+    # so a rerun after a crash or failed bulk items copies those articles again instead of skipping them.
+    # The bulk threads claim and the main thread records, so the connection is shared under a lock
+    def __init__(self, path):
+        self.lock = Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode = OFF")
+        self.db.execute("PRAGMA synchronous = OFF")
+        self.db.execute("CREATE TABLE IF NOT EXISTS headlines (hash BLOB PRIMARY KEY) WITHOUT ROWID")
+        self.in_flight = {} # document ID -> headline hash, queued but not written yet
+        self.claimed = set()
+        self.pending = 0
+
+    def claim(self, _id, headline):
+        # True if the headline hasn't been copied and isn't on its way
+        digest = hashlib.blake2b(headline.encode('utf-8'), digest_size=8).digest()
+        with self.lock:
+            if digest in self.claimed or self.db.execute("SELECT 1 FROM headlines WHERE hash = ?", (digest,)).fetchone() is not None:
+                return False
+            self.claimed.add(digest)
+            self.in_flight[_id] = digest
+        return True
+
+    def done(self, _id, ok):
+        # The write of _id finished, record its headline if it succeeded
+        with self.lock:
+            digest = self.in_flight.pop(_id, None)
+            if digest is None:
+                return
+            self.claimed.discard(digest)
+            if not ok:
+                return
+            self.db.execute("INSERT OR IGNORE INTO headlines VALUES (?)", (digest,))
+            self.pending += 1
+            if self.pending >= 10000:
+                self.db.commit()
+                self.pending = 0
+
+    def close(self):
+        with self.lock:
+            self.db.commit()
+            self.db.close()
+
+
+class Progress:
+    def __init__(self, every=5.0):
+        self.every = every
+        self.started = time.monotonic()
+        self.last_report = self.started
+        self.read = 0
+        self.duplicates = 0
+        self.written = 0
+        self.failed = 0
+
+    def report(self, force=False):
+        now = time.monotonic()
+        if not force and now - self.last_report < self.every:
+            return
+        self.last_report = now
+        elapsed = now - self.started
+        print(f"{elapsed:7.0f}s  read {self.read}  duplicates {self.duplicates}  written {self.written}  "
+              f"failed {self.failed}  ({self.read / elapsed:.0f} docs/s read, {self.written / elapsed:.0f} docs/s written)")
+
+
+def scan_slices(source, slices, queue, size, errors):
+    # One scroll per slice, all running at once. The queue is bounded,
+    # so the scrolls pause whenever the writers fall behind instead of piling hits up in memory.
+    # A slice whose scroll fails (expired context, lost node) still ends, with its exception in errors
+    def scan_slice(slice_id):
+        # Sliced scroll needs at least two slices
+        sliced = { 'slice': { "id": slice_id, "max": slices } } if slices > 1 else {}
+        try:
+            for hit in helpers.scan(es, index=source, size=size, **sliced):
+                queue.put(hit)
+        except Exception as e:
+            errors.append((slice_id, e))
+        finally:
+            queue.put(SLICE_DONE)
+
+    threads = [ Thread(target=scan_slice, args=(i,), daemon=True) for i in range(max(1, slices)) ]
+    for thread in threads:
+        thread.start()
+    return len(threads)
+
+
+def to_action(hit, dest):
+    article = hit['_source']
+    site = article['site']
+    headline = article['headline']
+    date = article['date']
+    authors = [a for a in article['author']]
+    body = [b for b in article['body']]
+    topics = [t for t in article['topics']]
+    fingerprint = simhash(body)
+    return {
+        '_index': dest,
+        '_id': generate_id(site, headline, date),
+        '_source': {
+            'site': site,
+            'headline': headline,
+            'date': date,
+            'authors': authors,
+            'body': body,
+            'topics': topics,
+            'simhash': format_simhash(fingerprint) if fingerprint is not None else None
+        }
+    }
+
+
+def reindex(source, dest, slices, bulk_threads, chunk_size, dedup_path=None):
+    # Without a dedup_path the headline hashes go in a new file that's removed afterwards.
+    # Returns [(slice, exception)] for slices whose scroll failed, their remaining documents weren't copied
+    temporary = dedup_path is None
+    if temporary:
+        handle, dedup_path = tempfile.mkstemp(prefix="data-transfer-headlines-", suffix=".sqlite")
+        os.close(handle)
+    queue = Queue(maxsize=chunk_size * bulk_threads * 2)
+    progress = Progress()
+    dedup = HeadlineDedup(dedup_path)
+    scan_errors = []
+    running = scan_slices(source, slices, queue, chunk_size, scan_errors)
+
+    def actions():
+        # parallel_bulk pulls these from its own thread
+        nonlocal running
+        while running > 0:
+            hit = queue.get()
+            if hit is SLICE_DONE:
+                running -= 1
+                continue
+            progress.read += 1
+            action = to_action(hit, dest)
+            if dedup.claim(action['_id'], hit['_source']['headline']):
+                yield action
+            else:
+                progress.duplicates += 1
+            progress.report()
+
+    try:
+        for ok, item in helpers.parallel_bulk(es, actions(), thread_count=bulk_threads, chunk_size=chunk_size, raise_on_error=False):
+            dedup.done(item['index'].get('_id'), ok)
+            if ok:
+                progress.written += 1
+            else:
+                progress.failed += 1
+                print(f"Failed to write: {item}")
+    finally:
+        dedup.close()
+        if temporary:
+            os.remove(dedup_path)
+    progress.report(force=True)
+    # Everything the other slices read is written by now, but the failed slices' documents are missing
+    for slice_id, error in scan_errors:
+        print(f"Slice {slice_id} stopped early: {error!r}")
+    return scan_errors
+
+
+def migrate_ids(index='unique-articles'):
+    # Move documents still stored under the old variable-length IDs to the fixed-width ones,
+    # adding the SimHash used for near-duplicate checks on the way.
+    # Every copy is written first, and an old ID is only deleted once its copy was stored,
+    # so a rejected write leaves the article where it was. Returns the failed operations
+    legacy = {} # new ID -> old ID, for copies that haven't come back yet
+
+    def copies():
+        for hit in helpers.scan(es, index=index):
+            source = hit['_source']
+            new_id = generate_id(source['site'], source['headline'], source['date'])
+            if hit['_id'] == new_id:
+                continue
+            if hit['_id'] != legacy_id(source['site'], source['headline'], source['date']):
+                print("Skipping document with unrecognised ID: " + hit['_id'])
+                continue
+            fingerprint = simhash(source['body'])
+            source['simhash'] = format_simhash(fingerprint) if fingerprint is not None else None
+            legacy[new_id] = hit['_id']
+            yield { '_op_type': 'index', '_index': index, '_id': new_id, '_source': source }
+
+    copied = []
+    errors = []
+    for ok, item in helpers.streaming_bulk(es, copies(), max_retries=3, raise_on_error=False):
+        old_id = legacy.pop(item['index']['_id'])
+        if ok:
+            copied.append(old_id)
+        else:
+            errors.append(item)
+
+    deletes = ( { '_op_type': 'delete', '_index': index, '_id': old_id } for old_id in copied )
+    deleted = 0
+    for ok, item in helpers.streaming_bulk(es, deletes, max_retries=3, raise_on_error=False):
+        if ok or item['delete'].get('status') == 404:
+            deleted += 1
+        else:
+            errors.append(item)
+
+    print(f"Migration done: {len(copied)} copied, {deleted} old IDs deleted, {len(errors)} errors")
+    for error in errors:
+        print(error)
+    return errors
+
 
 def main():
-    scroll_over_all_docs()
-    print("Articles Found: " + str(len(new_docs)))
-    for doc in new_docs:
-        write_article(doc)
+    parser = argparse.ArgumentParser(description="Copy articles into unique-articles, dropping repeated headlines")
+    parser.add_argument("--source", default="articles")
+    parser.add_argument("--dest", default="unique-articles")
+    parser.add_argument("--slices", type=int, default=4, help="parallel scroll slices")
+    parser.add_argument("--bulk-threads", type=int, default=4)
+    parser.add_argument("--chunk-size", type=int, default=500)
+    parser.add_argument("--dedup-db", help="keep the headline hashes in this file across runs, "
+                        "by default each run starts from an empty temporary one")
+    parser.add_argument("--migrate-ids", action="store_true", help="move unique-articles over to the compact IDs instead")
+    args = parser.parse_args()
 
-main()
+    print(str(es.info()) + "\n\n")
+    if args.migrate_ids:
+        if len(migrate_ids(args.dest)) > 0:
+            sys.exit(1)
+        return
+    if len(reindex(args.source, args.dest, args.slices, args.bulk_threads, args.chunk_size, args.dedup_db)) > 0:
+        sys.exit(1)
 
+main()
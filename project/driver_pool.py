@@ -0,0 +1,159 @@
+import time
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from threading import Condition, Thread
+from selenium import webdriver
+from selenium.common.exceptions import TimeoutException, WebDriverException
+from metrics import log
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+
+class PooledDriver:
+    def __init__(self, driver, number):
+        self.driver = driver
+        self.number = number
+        self.pages = 0
+        self.owner = None # Last crawler to use it, so it can get the same browser (and scroll position) back
+        self.page = None # Whatever the last user navigated to, so the next one knows if it has to reload
+        self.started = time.monotonic()
+
+
+class DriverPool:
+    # A fixed number of Chrome instances shared by all the crawlers.
+    # Drivers are recycled after max_pages page loads or once Chrome uses more than max_memory_mb,
+    # and a driver that hangs is quarantined (quit in the background) and replaced.
+    def __init__(self, options, size=2, max_pages=200, max_memory_mb=1500, page_load_timeout=60, on_start=None):
+        self.options = options
+        self.on_start = on_start # Called with each new driver, e.g. to apply DevTools settings
+        self.size = size
+        self.max_pages = max_pages
+        self.max_memory_mb = max_memory_mb
+        self.page_load_timeout = page_load_timeout
+        self.idle = []
+        self.owned = 0 # Browsers some crawler is keeping its listing open in
+        self.created = 0
+        self.quarantined = 0
+        self.recycled = 0
+        self.condition = Condition()
+
+        # Start every browser at once rather than one after another
+        with ThreadPoolExecutor(max_workers=size) as executor:
+            for pooled in executor.map(lambda _: self._start_driver(), range(size)):
+                self.idle.append(pooled)
+        log("Driver pool", f"Started {size} WebDrivers")
+
+    def _start_driver(self):
+        driver = webdriver.Chrome(options=self.options)
+        driver.set_page_load_timeout(self.page_load_timeout)
+        if self.on_start is not None:
+            self.on_start(driver)
+        with self.condition:
+            self.created += 1
+            number = self.created
+        return PooledDriver(driver, number)
+
+    def checkout(self, owner=None):
+        # Anonymous checkouts (owner=None) leave the browser's owner alone and wait for one nobody owns
+        # while there is one, so one-off pages don't navigate a crawler's listing away
+        with self.condition:
+            while True:
+                unowned = next((p for p in self.idle if p.owner is None), None)
+                if owner is None:
+                    if unowned is not None or (self.owned >= self.size and len(self.idle) > 0):
+                        break
+                elif len(self.idle) > 0:
+                    break
+                self.condition.wait()
+            if owner is None:
+                pooled = unowned or self.idle[0]
+            else:
+                # Prefer the browser this owner used last, then one nobody else is relying on
+                pooled = next((p for p in self.idle if p.owner == owner), None) or unowned or self.idle[0]
+                if pooled.owner is None:
+                    self.owned += 1
+                pooled.owner = owner
+            self.idle.remove(pooled)
+        return pooled
+
+    def checkin(self, pooled, pages=0, hung=False):
+        pooled.pages += pages
+        if hung:
+            self.quarantined += 1
+            log("Driver pool", f"WebDriver {pooled.number} hung, quarantining it")
+            self._replace(pooled)
+        elif pooled.pages >= self.max_pages or self.memory_mb(pooled) > self.max_memory_mb:
+            self.recycled += 1
+            log("Driver pool", f"Recycling WebDriver {pooled.number} after {pooled.pages} pages")
+            self._replace(pooled)
+        else:
+            with self.condition:
+                self.idle.append(pooled)
+                self.condition.notify_all()
+
+    @contextmanager
+    def lease(self, owner=None):
+        # with pool.lease(self.id) as pooled: pooled.driver.get(...); pooled.pages += 1
+        pooled = self.checkout(owner)
+        try:
+            yield pooled
+        except TimeoutException:
+            self.checkin(pooled, hung=True)
+            raise
+        except WebDriverException:
+            # The browser may have crashed, so don't hand it to anyone else
+            self.checkin(pooled, hung=True)
+            raise
+        except Exception:
+            self.checkin(pooled)
+            raise
+        else:
+            self.checkin(pooled)
+
+    def memory_mb(self, pooled):
+        # Resident memory of the chromedriver process and its Chrome children,
+        # or the page's JS heap when psutil isn't installed
+        try:
+            if psutil is not None:
+                process = psutil.Process(pooled.driver.service.process.pid)
+                processes = [process] + process.children(recursive=True)
+                return sum(p.memory_info().rss for p in processes) / 2**20
+            used = pooled.driver.execute_script("return performance.memory ? performance.memory.usedJSHeapSize : 0;")
+            return used / 2**20
+        except Exception:
+            return 0
+
+    def _replace(self, pooled):
+        # Quit the old browser and start a new one without blocking the crawler that returned it
+        if pooled.owner is not None:
+            with self.condition:
+                self.owned -= 1
+        def replace():
+            try:
+                pooled.driver.quit()
+            except Exception as e:
+                log("Driver pool", f"WebDriver {pooled.number} didn't quit cleanly: {e}")
+            try:
+                replacement = self._start_driver()
+            except WebDriverException as e:
+                log("Driver pool", f"Couldn't start a replacement WebDriver, shrinking pool: {e}")
+                with self.condition:
+                    self.size -= 1
+                    self.condition.notify_all()
+                return
+            with self.condition:
+                self.idle.append(replacement)
+                self.condition.notify_all()
+        Thread(target=replace, daemon=True).start()
+
+    def close(self):
+        with self.condition:
+            while len(self.idle) < self.size:
+                self.condition.wait()
+            for pooled in self.idle:
+                pooled.driver.quit()
+            self.idle = []
+        log("Driver pool", f"Closed after starting {self.created} WebDrivers ({self.recycled} recycled, {self.quarantined} quarantined)")
@@ -0,0 +1,265 @@
+# Finds article links in sitemaps, news sitemaps and RSS/Atom feeds instead of scrolling a listing.
+#
+#   python feed_discovery.py IGN                                      the site's own feeds
+#   python feed_discovery.py IGN benchmarks/fixtures/ign-sitemap-index.xml   local files work too
+#
+# Feeds are streamed with iterparse and every entry is dropped once it's been read, so memory
+# stays flat however big a sitemap is. Each feed's newest lastmod is kept in Redis: sitemaps
+# in an index that haven't changed since are skipped, and entries changed since are reported
+# so the crawler can fetch them again.
+import gzip
+import pathlib
+import argparse
+import hashlib
+import urllib.request
+import xml.etree.ElementTree as ElementTree
+from threading import Lock
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from urllib.error import HTTPError
+from urllib.parse import urlsplit, urljoin
+from urllib.robotparser import RobotFileParser
+from metrics import log
+from article_fetcher import USER_AGENT
+
+FEED_STATE_KEY = "feed-lastmod"
+# Elements that hold one sitemap, page or feed item
+ENTRY_TAGS = { "sitemap", "url", "item", "entry" }
+# Child elements giving an entry's date, most specific first
+DATE_TAGS = ("lastmod", "publication_date", "updated", "published", "pubDate", "date")
+# Sitemap indexes can point at each other, don't follow them forever
+MAX_SITEMAP_DEPTH = 4
+
+
+def local_name(tag):
+    return tag.rsplit("}", 1)[-1]
+
+
+def parse_timestamp(text):
+    # W3C datetime (sitemaps, Atom) or RFC 822 (RSS) to epoch seconds, None if it isn't either
+    if not text:
+        return None
+    text = text.strip()
+    try:
+        parsed = datetime.fromisoformat(text)
+    except ValueError:
+        try:
+            parsed = parsedate_to_datetime(text)
+        except (TypeError, ValueError):
+            return None
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed.timestamp()
+
+
+def read_entries(source):
+    # Yields ("sitemap" or "page", url, lastmod or None) from a sitemap, sitemap index, RSS or Atom document.
+    # Each entry is dropped from its parent once it's been read, so memory stays flat whether the entries
+    # hang off the root (sitemaps, Atom) or a level down (RSS items under <channel>)
+    parents = []
+    for event, element in ElementTree.iterparse(source, events=("start", "end")):
+        if event == "start":
+            parents.append(element)
+            continue
+        parents.pop()
+        if local_name(element.tag) not in ENTRY_TAGS:
+            continue
+        url = None
+        dates = {}
+        for child in element.iter():
+            name = local_name(child.tag)
+            if name in ("loc", "link") and url is None:
+                # Atom links are in href, alternate (the article) if the rel is given at all
+                if child.get("href") is not None:
+                    if child.get("rel", "alternate") == "alternate":
+                        url = child.get("href")
+                elif child.text and child.text.strip():
+                    url = child.text.strip()
+            elif name in DATE_TAGS and name not in dates:
+                dates[name] = child.text
+        if url is not None:
+            lastmod = next((parse_timestamp(dates[name]) for name in DATE_TAGS if name in dates), None)
+            yield ("sitemap" if local_name(element.tag) == "sitemap" else "page"), url, lastmod
+        element.clear()
+        if len(parents) > 0:
+            parents[-1].remove(element)
+
+
+class HashingReader:
+    # Passes reads through while hashing them, so a streamed feed can still go in the HttpCache
+    def __init__(self, stream):
+        self.stream = stream
+        self.hash = hashlib.blake2b(digest_size=16)
+
+    def read(self, size=-1):
+        data = self.stream.read(size)
+        self.hash.update(data)
+        return data
+
+
+class FeedDiscovery:
+    # Article links for one site from the given feeds, plus the sitemaps its robots.txt lists if use_robots.
+    # check_filters decides which links are articles, as it does for links found by scrolling.
+    # r (Redis) keeps each feed's newest lastmod between runs, without it state only lasts for this object.
+    # Crawlers on different sections of a site share one, each link is only handed to one of them.
+    def __init__(self, site, feeds, check_filters, r=None, scheduler=None, cache=None, use_robots=True):
+        self.site = site
+        self.host = urlsplit(site.value).netloc
+        self.configured_feeds = list(feeds)
+        self.check_filters = check_filters
+        self.r = r
+        self.scheduler = scheduler
+        self.cache = cache
+        self.use_robots = use_robots
+        self.state = {}
+        # Links without a lastmod come back on every read, these were already handed out
+        self.undated = set()
+        self.lock = Lock()
+
+    def feeds(self):
+        feeds = list(self.configured_feeds)
+        if self.use_robots:
+            feeds += [ url for url in self.robots_sitemaps() if url not in feeds ]
+        return feeds
+
+    def robots_sitemaps(self):
+        parser = RobotFileParser(f"https://{self.host}/robots.txt")
+        try:
+            if self.scheduler is not None:
+                self.scheduler.wait(parser.url)
+            parser.read()
+        except Exception as e:
+            log("Feeds", f"Couldn't read robots.txt for {self.host}: {e}")
+            return []
+        return parser.site_maps() or []
+
+    def matches(self, url):
+        # check_filters with the domain stripped for sites whose prefixes are paths
+        parts = urlsplit(url)
+        if parts.netloc != self.host:
+            return False
+        path = parts.path + (f"?{parts.query}" if parts.query else "")
+        return self.check_filters(url) or self.check_filters(path)
+
+    def last_seen(self, feed):
+        if self.r is not None:
+            value = self.r.hget(FEED_STATE_KEY, feed)
+            return float(value) if value is not None else None
+        return self.state.get(feed)
+
+    def save_last_seen(self, feed, lastmod):
+        self.state[feed] = lastmod
+        if self.r is not None:
+            self.r.hset(FEED_STATE_KEY, feed, lastmod)
+
+    def discover(self):
+        # {url: lastmod or None} for article links that are new to the feeds or changed since the last run,
+        # plus the set of those that changed. None if not a single feed could be read,
+        # so the caller can fall back to scrolling.
+        # Reads one at a time, a caller waiting on another gets only what that one didn't see
+        with self.lock:
+            return self._discover()
+
+    def _discover(self):
+        found = {}
+        changed = set()
+        readable = 0
+        pending = [ (feed, 0) for feed in self.feeds() ]
+        while len(pending) > 0:
+            feed, depth = pending.pop()
+            try:
+                entries = self.read_feed(feed, depth, pending, found, changed)
+            except Exception as e:
+                log("Feeds", f"Couldn't read {feed}: {e!r}")
+                continue
+            readable += 1
+            if entries is not None:
+                log("Feeds", f"{feed}: {entries} entries")
+        if readable == 0:
+            return None
+        return found, changed
+
+    def read_feed(self, feed, depth, pending, found, changed):
+        # Streams one feed, queuing child sitemaps on pending. Returns the number of entries read, None if unchanged
+        previous = self.last_seen(feed)
+        newest = previous
+        response = self.open(feed)
+        if response is None:
+            return None # 304, nothing's changed
+        entries = 0
+        with response:
+            reader = HashingReader(response)
+            source = gzip.GzipFile(fileobj=reader) if self.is_gzip(feed, response) else reader
+            for kind, url, lastmod in read_entries(source):
+                entries += 1
+                url = urljoin(feed, url)
+                if lastmod is not None and (newest is None or lastmod > newest):
+                    newest = lastmod
+                if kind == "sitemap":
+                    # Only walk into sitemaps that changed since we last read them
+                    child_seen = self.last_seen(url)
+                    if depth < MAX_SITEMAP_DEPTH and (lastmod is None or child_seen is None or lastmod > child_seen):
+                        pending.append((url, depth + 1))
+                    continue
+                if not self.matches(url):
+                    continue
+                if previous is not None and lastmod is not None and lastmod <= previous:
+                    continue # Was already in the feed last time
+                if lastmod is None:
+                    if url in self.undated:
+                        continue
+                    self.undated.add(url)
+                found[url] = lastmod
+                if previous is not None and lastmod is not None:
+                    changed.add(url)
+            if self.cache is not None:
+                self.cache.store(feed, None, response.headers.get("ETag"), response.headers.get("Last-Modified"), digest=reader.hash.digest())
+        if newest is not None:
+            self.save_last_seen(feed, newest)
+        return entries
+
+    def open(self, feed):
+        # The response for feed, or None if the server says it hasn't changed
+        headers = { "User-Agent": USER_AGENT, "Accept-Encoding": "gzip" }
+        if self.cache is not None:
+            headers.update(self.cache.validators(feed))
+        if self.scheduler is not None and urlsplit(feed).scheme in ("http", "https"):
+            self.scheduler.wait(feed)
+        try:
+            return urllib.request.urlopen(urllib.request.Request(feed, headers=headers), timeout=30)
+        except HTTPError as e:
+            if e.code == 304:
+                if self.cache is not None:
+                    self.cache.not_modified(feed)
+                return None
+            raise
+
+    def is_gzip(self, feed, response):
+        return urlsplit(feed).path.endswith(".gz") or response.headers.get("Content-Encoding") == "gzip"
+
+
+def main():
+    from scraper import SITE, EXTRACTION_PLANS
+    parser = argparse.ArgumentParser(description="List the article links a site's sitemaps and feeds point at")
+    parser.add_argument("site", choices=[ site.name for site in SITE ])
+    parser.add_argument("feeds", nargs="*", help="feed URLs or local files, instead of the site's own")
+    args = parser.parse_args()
+    site = SITE[args.site]
+    feeds = [ feed if "://" in feed else pathlib.Path(feed).resolve().as_uri() for feed in args.feeds ] or None
+    plan = EXTRACTION_PLANS[site.name]
+    if feeds is None:
+        discovery = FeedDiscovery(site, plan.feeds, plan.matches_url)
+    else:
+        discovery = FeedDiscovery(site, feeds, plan.matches_url, use_robots=False)
+    result = discovery.discover()
+    if result is None:
+        log("Feeds", "No feed could be read")
+        return
+    found, changed = result
+    for url, lastmod in sorted(found.items(), key=lambda item: item[1] or 0, reverse=True):
+        print(url if lastmod is None else f"{datetime.fromtimestamp(lastmod, timezone.utc):%Y-%m-%d %H:%M}  {url}")
+    log("Feeds", f"{len(found)} article links, {len(changed)} changed since the last run")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,186 @@
+import json
+import time
+import zlib
+
+# Number of Redis queues the shared frontier is split over
+NUM_SHARDS = 64
+# Seconds a popped link stays leased before it's handed to someone else
+LEASE_TIMEOUT = 300
+CHECKPOINTS_KEY = "crawl-checkpoints"
+HORIZONS_KEY = "crawl-horizons"
+PASS_TOPS_KEY = "crawl-pass-tops"
+
+# Adds (score, url) pairs to the queue, skipping any url the dedup set has already seen
+PUSH_SCRIPT = """
+local added = 0
+for i = 1, #ARGV, 2 do
+    if redis.call('SADD', KEYS[2], ARGV[i + 1]) == 1 then
+        redis.call('ZADD', KEYS[1], ARGV[i], ARGV[i + 1])
+        added = added + 1
+    end
+end
+return added
+"""
+
+# Puts expired leases back at the front of the queue, then pops and leases up to ARGV[1] links
+POP_SCRIPT = """
+local expired = redis.call('ZRANGEBYSCORE', KEYS[2], '-inf', ARGV[2])
+for _, url in ipairs(expired) do
+    redis.call('ZREM', KEYS[2], url)
+    redis.call('ZADD', KEYS[1], 0, url)
+end
+local popped = redis.call('ZPOPMIN', KEYS[1], ARGV[1])
+local urls = {}
+for i = 1, #popped, 2 do
+    table.insert(urls, popped[i])
+    redis.call('ZADD', KEYS[2], ARGV[3], popped[i])
+end
+return urls
+"""
+
+
+class Frontier:
+    # A persistent queue of links to scrape.
+    #   (name)-links   sorted set, lowest score is popped first (defaults to time queued, so FIFO)
+    #   (name)-seen    every link ever queued, so nothing is queued twice
+    #   (name)-leases  links popped but not acked yet, scored by when their lease runs out
+    # A worker that dies mid-batch never acks, so its links go back in the queue once the lease expires.
+    def __init__(self, r, name, seen_key=None, lease_timeout=LEASE_TIMEOUT):
+        self.r = r
+        self.key = f"{name}-links"
+        self.seen_key = seen_key or f"{name}-seen"
+        self.leases_key = f"{name}-leases"
+        self.lease_timeout = lease_timeout
+        self.push_script = r.register_script(PUSH_SCRIPT)
+        self.pop_script = r.register_script(POP_SCRIPT)
+
+    def push(self, links, priority=None, client=None):
+        # Returns how many links were new. Pass client=pipeline to batch with other pushes
+        if len(links) == 0:
+            return 0
+        score = time.time() if priority is None else priority
+        args = []
+        for link in links:
+            args += [score, link]
+        return self.push_script(keys=[self.key, self.seen_key], args=args, client=client or self.r)
+
+    def requeue(self, links, priority=None, client=None):
+        # Queue links again even though they've been seen before, e.g. articles a feed says were updated
+        if len(links) == 0:
+            return 0
+        score = time.time() if priority is None else priority
+        pipe = client or self.r.pipeline(transaction=False)
+        pipe.sadd(self.seen_key, *links)
+        pipe.zadd(self.key, { link: score for link in links })
+        if client is None:
+            pipe.execute()
+        return len(links)
+
+    def pop(self, count):
+        now = time.time()
+        links = self.pop_script(keys=[self.key, self.leases_key], args=[count, now, now + self.lease_timeout])
+        return [ link.decode('utf-8') for link in links ]
+
+    def ack(self, links):
+        # Done with these links, drop their leases
+        if len(links) > 0:
+            self.r.zrem(self.leases_key, *links)
+
+    def depth(self):
+        # Queued plus in-flight links
+        return self.r.zcard(self.key) + self.r.zcard(self.leases_key)
+
+    def clear(self):
+        self.r.delete(self.key, self.seen_key, self.leases_key)
+
+
+class ShardedFrontier:
+    # Links for every crawler, split into NUM_SHARDS frontiers by a hash of the URL,
+    # with one dedup set shared by all of them.
+    # A host's links are spread over every shard and so every worker. Workers take turns
+    # at each host through the rate limits they share in Redis, see scheduler.PolitenessScheduler.
+    def __init__(self, r, num_shards=NUM_SHARDS, lease_timeout=LEASE_TIMEOUT):
+        self.r = r
+        self.num_shards = num_shards
+        self.shards = [ Frontier(r, f"frontier:{shard}", "frontier-seen", lease_timeout) for shard in range(num_shards) ]
+
+    def shard_for(self, url):
+        return zlib.crc32(url.encode('utf-8')) % self.num_shards
+
+    def push(self, links, priority=None):
+        by_shard = {}
+        for link in links:
+            by_shard.setdefault(self.shard_for(link), []).append(link)
+        pipe = self.r.pipeline(transaction=False)
+        for shard, shard_links in by_shard.items():
+            self.shards[shard].push(shard_links, priority, client=pipe)
+        return sum(pipe.execute())
+
+    def requeue(self, links, priority=None):
+        by_shard = {}
+        for link in links:
+            by_shard.setdefault(self.shard_for(link), []).append(link)
+        pipe = self.r.pipeline(transaction=False)
+        for shard, shard_links in by_shard.items():
+            self.shards[shard].requeue(shard_links, priority, client=pipe)
+        pipe.execute()
+        return len(links)
+
+    def pop_shard(self, shard, count):
+        return self.shards[shard].pop(count)
+
+    def ack(self, links):
+        pipe = self.r.pipeline(transaction=False)
+        for link in links:
+            pipe.zrem(self.shards[self.shard_for(link)].leases_key, link)
+        pipe.execute()
+
+    def depth(self):
+        pipe = self.r.pipeline(transaction=False)
+        for frontier in self.shards:
+            pipe.zcard(frontier.key)
+            pipe.zcard(frontier.leases_key)
+        return sum(pipe.execute())
+
+    def clear(self):
+        for frontier in self.shards:
+            frontier.clear()
+
+
+def save_checkpoint(r, name, page_num):
+    # How far down its listing a crawler has scrolled, so a restart can pick up from there
+    r.hset(CHECKPOINTS_KEY, name, page_num)
+
+
+def load_checkpoint(r, name):
+    page_num = r.hget(CHECKPOINTS_KEY, name)
+    return int(page_num) if page_num is not None else 1
+
+
+def save_horizon(r, name, url, date):
+    # The newest link and article date a finished pass over a section saw, where the next refresh can stop
+    r.hset(HORIZONS_KEY, name, json.dumps({ "url": url, "date": date }))
+
+
+def load_horizon(r, name):
+    horizon = r.hget(HORIZONS_KEY, name)
+    return json.loads(horizon) if horizon is not None else None
+
+
+def clear_horizon(r, name):
+    r.hdel(HORIZONS_KEY, name)
+    r.hdel(PASS_TOPS_KEY, name)
+
+
+def save_pass_top(r, name, url):
+    # The newest link at the top of a full pass still going, so the pass has a horizon to save even if it's resumed
+    r.hset(PASS_TOPS_KEY, name, url)
+
+
+def load_pass_top(r, name):
+    url = r.hget(PASS_TOPS_KEY, name)
+    return url.decode('utf-8') if url is not None else None
+
+
+def clear_pass_top(r, name):
+    r.hdel(PASS_TOPS_KEY, name)
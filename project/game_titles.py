@@ -0,0 +1,88 @@
+import re
+import unicodedata
+
+# Canonical game title -> other names the sites tag it with. Matching ignores case,
+# punctuation and trademark signs, so only genuinely different spellings need listing.
+TITLE_ALIASES = {
+    "The Legend of Zelda: Tears of the Kingdom": ["Zelda Tears of the Kingdom", "Tears of the Kingdom", "TOTK"],
+    "The Legend of Zelda: Breath of the Wild": ["Zelda Breath of the Wild", "Breath of the Wild", "BOTW"],
+    "Elden Ring": ["Elden Ring: Shadow of the Erdtree", "Elden Ring Shadow of the Erdtree", "Shadow of the Erdtree"],
+    "Baldur's Gate 3": ["Baldurs Gate 3", "Baldur's Gate III", "BG3"],
+    "Cyberpunk 2077": ["Cyberpunk 2077: Phantom Liberty", "Cyberpunk 2077 Phantom Liberty", "Phantom Liberty"],
+    "Grand Theft Auto VI": ["Grand Theft Auto 6", "GTA 6", "GTA VI", "GTA6"],
+    "Grand Theft Auto V": ["Grand Theft Auto 5", "GTA 5", "GTA V", "GTA Online"],
+    "Star Wars Outlaws": [],
+    "Final Fantasy XIV": ["Final Fantasy 14", "FFXIV", "FF14", "Final Fantasy XIV Online", "Final Fantasy XIV: Dawntrail", "Dawntrail"],
+    "Final Fantasy VII Rebirth": ["Final Fantasy 7 Rebirth", "FF7 Rebirth", "FFVII Rebirth"],
+    "Call of Duty: Black Ops 6": ["Call of Duty Black Ops 6", "Black Ops 6", "COD Black Ops 6"],
+    "Call of Duty: Warzone": ["Warzone", "Call of Duty Warzone", "Warzone 2.0"],
+    "Counter-Strike 2": ["Counter Strike 2", "CS2", "CS:GO", "Counter-Strike: Global Offensive"],
+    "Fortnite": ["Fortnite Battle Royale"],
+    "Minecraft": [],
+    "League of Legends": ["LoL"],
+    "Valorant": [],
+    "Destiny 2": ["Destiny 2: The Final Shape", "The Final Shape"],
+    "Helldivers 2": ["Helldivers II"],
+    "Palworld": [],
+    "Starfield": ["Starfield: Shattered Space", "Shattered Space"],
+    "Diablo IV": ["Diablo 4", "Diablo IV: Vessel of Hatred", "Vessel of Hatred"],
+    "World of Warcraft": ["WoW", "World of Warcraft: The War Within", "The War Within"],
+    "Pokemon Scarlet and Violet": ["Pokemon Scarlet", "Pokemon Violet", "Pokémon Scarlet and Violet"],
+    "Black Myth: Wukong": ["Black Myth Wukong"],
+    "Hollow Knight: Silksong": ["Hollow Knight Silksong", "Silksong"],
+    "Metaphor: ReFantazio": ["Metaphor ReFantazio"],
+    "Dragon Age: The Veilguard": ["Dragon Age The Veilguard", "The Veilguard", "Dragon Age: Dreadwolf"],
+    "Marvel Rivals": [],
+    "Stalker 2: Heart of Chornobyl": ["S.T.A.L.K.E.R. 2: Heart of Chornobyl", "Stalker 2", "S.T.A.L.K.E.R. 2"],
+}
+
+# Topics that aren't games: platforms, hardware, companies and site sections
+NOT_GAMES = {
+    "PC", "PS5", "PS4", "PlayStation 5", "PlayStation 4", "PlayStation", "PlayStation Portal",
+    "Xbox", "Xbox Series X", "Xbox Series S", "Xbox Series X|S", "Xbox One", "Xbox Game Pass", "Game Pass",
+    "Nintendo Switch", "Nintendo Switch 2", "Switch", "Steam", "Steam Deck", "iOS", "Android", "Mac", "Linux",
+    "Nintendo", "Sony", "Microsoft", "Valve", "Epic Games", "Epic Games Store", "Ubisoft", "EA", "Activision Blizzard",
+    "News", "Reviews", "Previews", "Features", "Guides", "Hardware", "Gaming Hardware", "Deals", "Movies", "TV",
+    "Comics", "Anime", "Tech", "Esports", "Opinion", "Podcast", "Videos",
+}
+
+NON_WORD = re.compile(r"[^\w]+")
+TRADEMARKS = re.compile(r"[\u2122\u00ae\u00a9]")
+
+
+def normalize(topic):
+    # Key a topic is matched on: lower case, no accents, trademark signs or punctuation
+    topic = unicodedata.normalize("NFKD", TRADEMARKS.sub("", topic)).encode("ascii", "ignore").decode("ascii")
+    return NON_WORD.sub(" ", topic.lower()).strip()
+
+
+def build_title_index(aliases=TITLE_ALIASES, not_games=NOT_GAMES):
+    # {normalized name: canonical title or None for non-games}
+    index = { normalize(name): None for name in not_games }
+    for title, names in aliases.items():
+        for name in [title] + names:
+            index[normalize(name)] = title
+    return index
+
+
+class TitleMatcher:
+    # Turns an article's topics into the game titles it's about.
+    # Topics not in the dictionary are kept under their own cleaned-up name unless known_only,
+    # so new releases show up before anyone adds them.
+    def __init__(self, aliases=TITLE_ALIASES, not_games=NOT_GAMES, known_only=False):
+        self.index = build_title_index(aliases, not_games)
+        self.known_only = known_only
+
+    def title(self, topic):
+        # Canonical title for topic, or None if it isn't a game
+        key = normalize(topic)
+        if not key:
+            return None
+        if key in self.index:
+            return self.index[key]
+        return None if self.known_only else " ".join(TRADEMARKS.sub("", topic).split())
+
+    def titles(self, topics):
+        # Distinct titles for a list of topics, in the order they first appear
+        titles = ( self.title(topic) for topic in topics )
+        return list(dict.fromkeys(title for title in titles if title is not None))
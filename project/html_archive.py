@@ -0,0 +1,122 @@
+import os
+import json
+import mmap
+import time
+import zlib
+import socket
+import sqlite3
+import hashlib
+from threading import Lock
+
+# Where fetched HTML is archived, set to "" to turn archiving off
+HTML_ARCHIVE_DIR = os.getenv('HTML_ARCHIVE_DIR', "html-archive")
+# A new segment is started once the current one is this big
+SEGMENT_BYTES = 256 * 1024 * 1024
+COMPRESSION_LEVEL = 6
+
+
+class HtmlArchive:
+    # Append-only store of every page the crawler processed, so extractors can be re-run without re-crawling.
+    #
+    # Pages are content addressed: the same HTML under any number of URLs is stored once.
+    # Segments are WARC-like, each record is a JSON header line followed by the zlib-compressed HTML:
+    #   {"digest": ..., "url": ..., "site": ..., "date": ..., "length": N}\n<N bytes>\n
+    # so a segment can be read on its own. index.sqlite maps digests to (segment, offset, length)
+    # and each URL to the digest of its latest content. Readers mmap the segments.
+    #
+    # Each process appends to its own segments, so worker processes can share one directory.
+    def __init__(self, directory=HTML_ARCHIVE_DIR, segment_bytes=SEGMENT_BYTES):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.lock = Lock()
+        os.makedirs(directory, exist_ok=True)
+        self.db = sqlite3.connect(os.path.join(directory, "index.sqlite"), timeout=30, check_same_thread=False, isolation_level=None)
+        self.db.execute("PRAGMA journal_mode = WAL")
+        self.db.execute("PRAGMA synchronous = NORMAL")
+        self.db.execute("CREATE TABLE IF NOT EXISTS blobs (digest BLOB PRIMARY KEY, segment TEXT NOT NULL, offset INTEGER NOT NULL, length INTEGER NOT NULL, size INTEGER NOT NULL) WITHOUT ROWID")
+        self.db.execute("CREATE TABLE IF NOT EXISTS pages (url TEXT PRIMARY KEY, site TEXT NOT NULL, digest BLOB NOT NULL, archived_at REAL NOT NULL)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS pages_site ON pages (site)")
+        self.writer = f"{socket.gethostname()}-{os.getpid()}"
+        self.segment = None
+        self.file = None
+        self.maps = {}
+
+    def add(self, url, site, html):
+        # Archive html as the current content of url, returns its digest
+        data = html.encode('utf-8')
+        digest = hashlib.blake2b(data, digest_size=16).digest()
+        with self.lock:
+            known = self.db.execute("SELECT 1 FROM blobs WHERE digest = ?", (digest,)).fetchone() is not None
+            if not known:
+                compressed = zlib.compress(data, COMPRESSION_LEVEL)
+                header = json.dumps({ "digest": digest.hex(), "url": url, "site": site, "date": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()), "length": len(compressed) })
+                segment_file = self._segment_file(len(compressed))
+                segment_file.write(header.encode('utf-8') + b"\n")
+                offset = segment_file.tell()
+                segment_file.write(compressed + b"\n")
+                segment_file.flush() # Readers in other processes map the file, not our buffer
+                self.db.execute("INSERT OR IGNORE INTO blobs VALUES (?, ?, ?, ?, ?)", (digest, self.segment, offset, len(compressed), len(data)))
+            self.db.execute("INSERT OR REPLACE INTO pages VALUES (?, ?, ?, ?)", (url, site, digest, time.time()))
+        return digest
+
+    def _segment_file(self, upcoming):
+        # Our current segment, starting a new one if this record would take it over the limit
+        if self.file is not None and self.file.tell() + upcoming > self.segment_bytes:
+            self.file.close()
+            self.file = None
+        if self.file is None:
+            number = len([ name for name in os.listdir(self.directory) if name.startswith(self.writer + "-") ])
+            self.segment = f"{self.writer}-{number:05d}.seg"
+            self.file = open(os.path.join(self.directory, self.segment), "ab")
+        return self.file
+
+    def read(self, segment, offset, length):
+        # The HTML of the record at offset in segment
+        with self.lock:
+            mapped = self.maps.get(segment)
+            if mapped is None or offset + length > len(mapped):
+                # Segments still being appended to have to be mapped again to see the new records
+                if mapped is not None:
+                    mapped.close()
+                with open(os.path.join(self.directory, segment), "rb") as f:
+                    mapped = self.maps[segment] = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return zlib.decompress(mapped[offset:offset + length]).decode('utf-8')
+
+    def get(self, url):
+        # Latest archived HTML for url, or None
+        with self.lock:
+            row = self.db.execute("SELECT b.segment, b.offset, b.length FROM pages p JOIN blobs b ON b.digest = p.digest WHERE p.url = ?", (url,)).fetchone()
+        return self.read(*row) if row is not None else None
+
+    def pages(self, site=None):
+        # (url, site, segment, offset, length) for the latest content of every archived URL,
+        # in segment order so reading them back walks each file front to back
+        query = "SELECT p.url, p.site, b.segment, b.offset, b.length FROM pages p JOIN blobs b ON b.digest = p.digest"
+        args = ()
+        if site is not None:
+            query += " WHERE p.site = ?"
+            args = (site,)
+        with self.lock:
+            rows = self.db.execute(query + " ORDER BY b.segment, b.offset", args).fetchall()
+        return rows
+
+    def stats(self):
+        with self.lock:
+            pages = self.db.execute("SELECT COUNT(*) FROM pages").fetchone()[0]
+            blobs, size, stored = self.db.execute("SELECT COUNT(*), COALESCE(SUM(size), 0), COALESCE(SUM(length), 0) FROM blobs").fetchone()
+        return { "pages": pages, "blobs": blobs, "bytes": size, "stored_bytes": stored }
+
+    def close(self):
+        with self.lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+            for mapped in self.maps.values():
+                mapped.close()
+            self.maps = {}
+            self.db.close()
+
+
+def open_archive(directory=HTML_ARCHIVE_DIR):
+    # None when archiving is turned off
+    return HtmlArchive(directory) if directory else None
@@ -0,0 +1,118 @@
+import os
+import time
+import sqlite3
+import hashlib
+from threading import Lock
+from metrics import CACHE_LOOKUPS
+
+# Where validators are kept between runs, set to "" to turn the cache off
+HTTP_CACHE_PATH = os.getenv('HTTP_CACHE_PATH', "http-cache.sqlite")
+# Entries not revalidated for this long are dropped
+HTTP_CACHE_TTL = 30 * 24 * 3600
+HTTP_CACHE_MAX_ENTRIES = 1_000_000
+# Eviction runs after this many stores
+EVICT_EVERY = 1000
+
+# Returned in place of the HTML when the server says (or the content hash shows) a page hasn't changed
+NOT_MODIFIED = object()
+
+
+def content_hash(body):
+    if isinstance(body, str):
+        body = body.encode('utf-8')
+    return hashlib.blake2b(body, digest_size=16).digest()
+
+
+class HttpCache:
+    # Remembers the validators (ETag, Last-Modified) and a hash of the body for every URL fetched,
+    # so a refetch can be a conditional request and an unchanged page can be skipped.
+    # Only validators are stored, never bodies, so an entry is ~100 bytes and the size bound is a row count.
+    def __init__(self, path=HTTP_CACHE_PATH, ttl=HTTP_CACHE_TTL, max_entries=HTTP_CACHE_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.lock = Lock()
+        self.stores = 0
+        # Worker processes on the same machine share the file, WAL lets them read while one writes
+        self.db = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        self.db.execute("PRAGMA journal_mode = WAL")
+        self.db.execute("PRAGMA synchronous = NORMAL")
+        self.db.execute("""
+            CREATE TABLE IF NOT EXISTS pages (
+                url TEXT PRIMARY KEY,
+                etag TEXT,
+                last_modified TEXT,
+                hash BLOB NOT NULL,
+                fetched_at REAL NOT NULL,
+                checked_at REAL NOT NULL
+            )""")
+        self.db.execute("CREATE INDEX IF NOT EXISTS pages_checked_at ON pages (checked_at)")
+        self.evict()
+
+    def validators(self, url):
+        # Headers that make a request for url conditional, empty if we've never fetched it
+        with self.lock:
+            row = self.db.execute("SELECT etag, last_modified FROM pages WHERE url = ?", (url,)).fetchone()
+        headers = {}
+        if row is not None:
+            etag, last_modified = row
+            if etag:
+                headers["If-None-Match"] = etag
+            if last_modified:
+                headers["If-Modified-Since"] = last_modified
+        return headers
+
+    def not_modified(self, url):
+        # The server answered 304
+        CACHE_LOOKUPS.inc(outcome="not_modified")
+        with self.lock:
+            self.db.execute("UPDATE pages SET checked_at = ? WHERE url = ?", (time.time(), url))
+
+    def unchanged(self, url, body, etag=None, last_modified=None):
+        # A full response whose content is what we already have, servers without validators get caught here
+        digest = content_hash(body)
+        with self.lock:
+            updated = self.db.execute(
+                "UPDATE pages SET etag = ?, last_modified = ?, checked_at = ? WHERE url = ? AND hash = ?",
+                (etag, last_modified, time.time(), url, digest)
+            ).rowcount == 1
+        if updated:
+            CACHE_LOOKUPS.inc(outcome="unchanged")
+        return updated
+
+    def store(self, url, body, etag=None, last_modified=None, digest=None):
+        # Record a page once it's been processed. Pass the digest instead of the body for responses that were streamed
+        now = time.time()
+        if digest is None:
+            digest = content_hash(body)
+        with self.lock:
+            known = self.db.execute("SELECT 1 FROM pages WHERE url = ?", (url,)).fetchone() is not None
+            self.db.execute(
+                "INSERT OR REPLACE INTO pages VALUES (?, ?, ?, ?, ?, ?)",
+                (url, etag, last_modified, digest, now, now)
+            )
+            self.stores += 1
+            evict = self.stores % EVICT_EVERY == 0
+        CACHE_LOOKUPS.inc(outcome="changed" if known else "new")
+        if evict:
+            self.evict()
+
+    def evict(self):
+        # Drop entries past the TTL, then the least recently checked ones over max_entries
+        with self.lock:
+            self.db.execute("DELETE FROM pages WHERE checked_at < ?", (time.time() - self.ttl,))
+            excess = self.db.execute("SELECT COUNT(*) FROM pages").fetchone()[0] - self.max_entries
+            if excess > 0:
+                self.db.execute("DELETE FROM pages WHERE url IN (SELECT url FROM pages ORDER BY checked_at LIMIT ?)", (excess,))
+
+    def __len__(self):
+        with self.lock:
+            return self.db.execute("SELECT COUNT(*) FROM pages").fetchone()[0]
+
+    def close(self):
+        with self.lock:
+            self.db.close()
+
+
+def open_cache(path=HTTP_CACHE_PATH):
+    # None when caching is turned off
+    return HttpCache(path) if path else None
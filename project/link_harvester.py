@@ -0,0 +1,61 @@
+from selenium.common.exceptions import TimeoutException
+from selenium.webdriver.support.ui import WebDriverWait
+
+# Installed once per page load. Collects every <a href> already on the page, then a
+# MutationObserver adds hrefs from nodes as infinite scrolling inserts them.
+# Each call hands back only the hrefs found since the previous call.
+# Hrefs are read with getAttribute so they stay relative, the same as BeautifulSoup's a.get("href").
+HARVEST_SCRIPT = """
+if (!window.__harvester) {
+    const harvester = { seen: new Set(), pending: [] };
+    const add = (a) => {
+        const href = a.getAttribute('href');
+        if (href && !harvester.seen.has(href)) {
+            harvester.seen.add(href);
+            harvester.pending.push(href);
+        }
+    };
+    const collect = (node) => {
+        if (node.nodeType !== Node.ELEMENT_NODE) return;
+        if (node.matches('a[href]')) add(node);
+        node.querySelectorAll('a[href]').forEach(add);
+    };
+    collect(document.documentElement);
+    new MutationObserver((mutations) => {
+        for (const mutation of mutations) {
+            if (mutation.type === 'attributes') collect(mutation.target);
+            mutation.addedNodes.forEach(collect);
+        }
+    }).observe(document.documentElement, { childList: true, subtree: true, attributes: true, attributeFilter: ['href'] });
+    window.__harvester = harvester;
+}
+const hrefs = window.__harvester.pending;
+window.__harvester.pending = [];
+return hrefs;
+"""
+
+# Page height and number of links, either going up means the feed loaded more content
+GROWTH_SCRIPT = "return [document.body.scrollHeight, document.links.length];"
+
+
+def harvest_links(webdriver):
+    # New hrefs since the last call on this page (all of them on the first call)
+    return webdriver.execute_script(HARVEST_SCRIPT)
+
+
+def page_size(webdriver):
+    return webdriver.execute_script(GROWTH_SCRIPT)
+
+
+def wait_for_growth(webdriver, previous_size, timeout=5):
+    # Wait until the page gets taller or gains links instead of sleeping a fixed time.
+    # Returns False if nothing was added before the timeout, i.e. we hit the end of the feed
+    previous_height, previous_links = previous_size
+    def grew(driver):
+        height, links = driver.execute_script(GROWTH_SCRIPT)
+        return height > previous_height or links > previous_links
+    try:
+        WebDriverWait(webdriver, timeout, poll_frequency=0.2).until(grew)
+        return True
+    except TimeoutException:
+        return False
@@ -0,0 +1,96 @@
+import os
+from selenium.webdriver.chrome.options import Options
+from selenium.common.exceptions import TimeoutException
+from selenium.webdriver.support.ui import WebDriverWait
+
+# We only ever read the HTML, so most of what a page downloads is wasted.
+# page_load_strategy: "normal" waits for the load event, "eager" for DOMContentLoaded, "none" returns right away
+# block_images: Chrome content setting
+# blocked_urls: URL patterns dropped via DevTools (Network.setBlockedURLs), "*" is a wildcard.
+#   Chrome has no content setting for fonts, so they're blocked here by extension
+
+# Images, fonts, video, ads and trackers: nothing the HTML needs
+LEAN_BLOCKED_URLS = [
+    "*.png", "*.jpg", "*.jpeg", "*.gif", "*.webp", "*.avif", "*.svg",
+    "*.woff", "*.woff2", "*.ttf", "*.otf",
+    "*.mp4", "*.webm", "*.m3u8",
+    "*doubleclick.net*", "*googlesyndication.com*", "*googletagmanager.com*", "*google-analytics.com*",
+    "*amazon-adsystem.com*", "*adnxs.com*", "*scorecardresearch.com*", "*facebook.net*", "*chartbeat.com*",
+]
+
+LOAD_PROFILES = {
+    "full": {
+        "page_load_strategy": "normal",
+        "block_images": False,
+        "blocked_urls": [],
+    },
+    "lean": {
+        "page_load_strategy": "eager",
+        "block_images": True,
+        "blocked_urls": LEAN_BLOCKED_URLS,
+    },
+    "minimal": {
+        "page_load_strategy": "none",
+        "block_images": True,
+        # Everything lean blocks, plus stylesheets
+        "blocked_urls": LEAN_BLOCKED_URLS + [ "*.css" ],
+    },
+}
+
+LOAD_PROFILE = os.getenv('LOAD_PROFILE', "lean")
+
+# Bytes transferred for the document and every resource, and ms from navigation start until now
+PAGE_STATS_SCRIPT = """
+const entries = performance.getEntriesByType('navigation').concat(performance.getEntriesByType('resource'));
+const bytes = entries.reduce((total, e) => total + (e.transferSize || 0), 0);
+return [bytes, performance.now()];
+"""
+
+
+def build_chrome_options(profile_name=LOAD_PROFILE):
+    profile = LOAD_PROFILES[profile_name]
+    options = Options()
+    options.add_argument("--headless")  # Ensure it runs in headless mode
+    options.add_argument("--no-sandbox")  # Bypass OS security model, REQUIRED for Docker
+    options.add_argument("--disable-dev-shm-usage")  # Overcome limited resource problems
+    options.page_load_strategy = profile["page_load_strategy"]
+    prefs = {}
+    if profile["block_images"]:
+        prefs["profile.managed_default_content_settings.images"] = 2
+    prefs["profile.default_content_setting_values.notifications"] = 2
+    options.add_experimental_option("prefs", prefs)
+    return options
+
+
+def apply_profile(driver, profile_name=LOAD_PROFILE):
+    # DevTools settings have to be applied to each new browser
+    blocked_urls = LOAD_PROFILES[profile_name]["blocked_urls"]
+    if len(blocked_urls) > 0:
+        driver.execute_cdp_cmd("Network.enable", {})
+        driver.execute_cdp_cmd("Network.setBlockedURLs", { "urls": blocked_urls })
+
+
+def wait_until_ready(driver, ready_selector=None, profile_name=LOAD_PROFILE, timeout=20):
+    # With "eager" or "none", get() returns before the page is done, so wait for what we actually need:
+    # the DOM to be parsed and, if given, an element matching ready_selector to exist
+    if LOAD_PROFILES[profile_name]["page_load_strategy"] == "normal" and ready_selector is None:
+        return True
+    def ready(d):
+        state = d.execute_script("return document.readyState;")
+        if state == "loading":
+            return False
+        return ready_selector is None or d.execute_script("return document.querySelector(arguments[0]) !== null;", ready_selector)
+    try:
+        WebDriverWait(driver, timeout, poll_frequency=0.1).until(ready)
+        return True
+    except TimeoutException:
+        return False
+
+
+def page_stats(driver):
+    # (bytes transferred, milliseconds since navigation started) for the current page
+    try:
+        transferred, elapsed = driver.execute_script(PAGE_STATS_SCRIPT)
+        return int(transferred), float(elapsed)
+    except Exception:
+        return 0, 0.0
@@ -0,0 +1,347 @@
+# Counters, histograms and gauges for the crawler, served in the Prometheus text format.
+#
+#   METRICS_PORT=9100 python scraper.py
+#   curl localhost:9100/metrics           everything below, labelled by site and subdirectory
+#   curl localhost:9100/profile/start     start sampling every thread's stack
+#   curl localhost:9100/profile           what it has seen so far, in flamegraph.pl's collapsed format
+#   curl localhost:9100/profile/stop
+#
+# JSON_LOGS=1 turns log() output into one JSON object per line.
+import os
+import sys
+import json
+import time
+import functools
+import threading
+from collections import deque, Counter as Tally
+from contextlib import contextmanager
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit, parse_qs
+
+# Unset means no endpoint
+METRICS_PORT = os.getenv('METRICS_PORT')
+JSON_LOGS = os.getenv('JSON_LOGS') == "1"
+# Seconds, from a cached parse up to a slow page load
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+# Window pages/sec is averaged over
+RATE_WINDOW = 60
+
+
+def log(source, message, **fields):
+    # Replaces print(f"{source}: {message}"), fields only show up in JSON logs
+    if JSON_LOGS:
+        print(json.dumps({ "time": round(time.time(), 3), "source": source, "message": message, **fields }, default=str), flush=True)
+    else:
+        print(f"{source}: {message}")
+
+
+def format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if len(pairs) == 0:
+        return ""
+    escaped = [ (name, str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")) for name, value in pairs ]
+    return "{" + ",".join(f'{name}="{value}"' for name, value in escaped) + "}"
+
+
+class Metric:
+    kind = None
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.lock = threading.Lock()
+
+    def key(self, labels):
+        if set(labels) != set(self.labels):
+            raise ValueError(f"{self.name} takes labels {self.labels}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labels)
+
+    def render(self):
+        lines = [ f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}" ]
+        lines += self.samples()
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def __init__(self, name, help, labels=()):
+        super().__init__(name, help, labels)
+        self.values = {}
+
+    def inc(self, amount=1, **labels):
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def get(self, **labels):
+        return self.values.get(self.key(labels), 0)
+
+    def samples(self):
+        with self.lock:
+            return [ f"{self.name}{format_labels(self.labels, key)} {value}" for key, value in self.values.items() ]
+
+
+class Gauge(Metric):
+    # Either set directly or tracked with a callback that's read whenever metrics are collected
+    kind = "gauge"
+
+    def __init__(self, name, help, labels=()):
+        super().__init__(name, help, labels)
+        self.values = {}
+
+    def set(self, value, **labels):
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = value
+
+    def track(self, callback, **labels):
+        self.set(callback, **labels)
+
+    def samples(self):
+        with self.lock:
+            values = list(self.values.items())
+        samples = []
+        for key, value in values:
+            if callable(value):
+                try:
+                    value = value()
+                except Exception:
+                    continue # e.g. Redis is down, leave the sample out rather than fail the whole scrape
+            samples.append(f"{self.name}{format_labels(self.labels, key)} {value}")
+        return samples
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets))
+        self.values = {} # key -> [count per bucket..., count above the last bucket, sum]
+
+    def observe(self, value, **labels):
+        key = self.key(labels)
+        with self.lock:
+            counts = self.values.get(key)
+            if counts is None:
+                counts = self.values[key] = [0] * (len(self.buckets) + 2)
+            counts[next((i for i, bound in enumerate(self.buckets) if value <= bound), len(self.buckets))] += 1
+            counts[-1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def samples(self):
+        with self.lock:
+            values = [ (key, list(counts)) for key, counts in self.values.items() ]
+        samples = []
+        for key, counts in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += count
+                samples.append(f"{self.name}_bucket{format_labels(self.labels, key, [('le', bound)])} {cumulative}")
+            samples.append(f"{self.name}_sum{format_labels(self.labels, key)} {counts[-1]}")
+            samples.append(f"{self.name}_count{format_labels(self.labels, key)} {cumulative}")
+        return samples
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = {}
+        self.lock = threading.Lock()
+
+    def _add(self, metric):
+        with self.lock:
+            return self.metrics.setdefault(metric.name, metric)
+
+    def counter(self, name, help, labels=()):
+        return self._add(Counter(name, help, labels))
+
+    def gauge(self, name, help, labels=()):
+        return self._add(Gauge(name, help, labels))
+
+    def histogram(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        return self._add(Histogram(name, help, labels, buckets))
+
+    def render(self):
+        with self.lock:
+            metrics = list(self.metrics.values())
+        return "\n".join(metric.render() for metric in metrics) + "\n"
+
+
+class RateMeter:
+    # Events per second over the last `window` seconds
+    def __init__(self, window=RATE_WINDOW):
+        self.window = window
+        self.events = deque()
+        self.started = time.monotonic()
+        self.lock = threading.Lock()
+
+    def mark(self, count=1):
+        with self.lock:
+            self.events.append((time.monotonic(), count))
+
+    def rate(self):
+        now = time.monotonic()
+        with self.lock:
+            while len(self.events) > 0 and self.events[0][0] < now - self.window:
+                self.events.popleft()
+            total = sum(count for _, count in self.events)
+        return total / max(1e-9, min(self.window, now - self.started))
+
+
+REGISTRY = Registry()
+
+CRAWL_LABELS = ("site", "subdirectory")
+STAGE_SECONDS = REGISTRY.histogram("crawler_stage_seconds", "Time spent in each crawl stage, stages nest (scrape includes scrape_article_data)", CRAWL_LABELS + ("stage",))
+STAGE_ERRORS = REGISTRY.counter("crawler_stage_errors_total", "Crawl stages that raised", CRAWL_LABELS + ("stage",))
+PAGES = REGISTRY.counter("crawler_pages_total", "Pages loaded in a browser or fetched over HTTP", CRAWL_LABELS + ("via",))
+PAGES_PER_SECOND = REGISTRY.gauge("crawler_pages_per_second", f"Pages per second over the last {RATE_WINDOW}s", CRAWL_LABELS)
+LINKS = REGISTRY.counter("crawler_links_total", "Article links found on listing pages, and how many of them were new", CRAWL_LABELS + ("outcome",))
+FRONTIER_DEPTH = REGISTRY.gauge("crawler_frontier_depth", "Links queued or leased in the frontier", CRAWL_LABELS)
+PARSE_SECONDS = REGISTRY.histogram("html_parse_seconds", "Time to parse HTML into a tree or pull out its links", ("backend", "kind"))
+FETCH_SECONDS = REGISTRY.histogram("http_fetch_seconds", "Article fetch time, not counting the wait for the host's turn", ("host",))
+FETCH_RESPONSES = REGISTRY.counter("http_fetch_responses_total", "Article fetches by response status", ("host", "status"))
+CACHE_LOOKUPS = REGISTRY.counter("http_cache_total", "Revalidated fetches: not_modified (304), unchanged (200 with the same content), changed or new", ("outcome",))
+BULK_SECONDS = REGISTRY.histogram("es_bulk_seconds", "Time to write one batch with the bulk API")
+BULK_DOCUMENTS = REGISTRY.counter("es_bulk_documents_total", "Documents sent to Elasticsearch", ("outcome",))
+BULK_QUEUE = REGISTRY.gauge("es_bulk_queue_depth", "Documents waiting for the bulk writer")
+
+# pages/sec meters, one per (site, subdirectory)
+PAGE_RATES = {}
+PAGE_RATES_LOCK = threading.Lock()
+
+
+def record_pages(site, subdirectory, via, count=1):
+    PAGES.inc(count, site=site, subdirectory=subdirectory, via=via)
+    with PAGE_RATES_LOCK:
+        meter = PAGE_RATES.get((site, subdirectory))
+        if meter is None:
+            meter = PAGE_RATES[(site, subdirectory)] = RateMeter()
+            PAGES_PER_SECOND.track(meter.rate, site=site, subdirectory=subdirectory)
+    meter.mark(count)
+
+
+def timed(stage):
+    # Times a WebCrawler method into STAGE_SECONDS using the crawler's own labels
+    def decorate(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return method(self, *args, **kwargs)
+            except Exception:
+                STAGE_ERRORS.inc(stage=stage, **self.labels)
+                raise
+            finally:
+                STAGE_SECONDS.observe(time.perf_counter() - start, stage=stage, **self.labels)
+        return wrapper
+    return decorate
+
+
+class SamplingProfiler:
+    # Every `interval` seconds, records where each thread is (sys._current_frames) as a
+    # "thread;outer;...;inner" stack. Cheap enough to switch on in a live crawl and off again.
+    def __init__(self, interval=0.01, max_depth=64):
+        self.interval = interval
+        self.max_depth = max_depth
+        self.samples = Tally()
+        self.lock = threading.Lock()
+        self.stopping = threading.Event()
+        self.thread = None
+
+    @property
+    def running(self):
+        return self.thread is not None and self.thread.is_alive()
+
+    def start(self, interval=None):
+        if self.running:
+            return False
+        self.interval = interval or self.interval
+        self.stopping.clear()
+        self.thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+        self.thread.start()
+        return True
+
+    def stop(self):
+        if not self.running:
+            return False
+        self.stopping.set()
+        self.thread.join()
+        return True
+
+    def reset(self):
+        with self.lock:
+            self.samples.clear()
+
+    def _run(self):
+        me = threading.get_ident()
+        while not self.stopping.wait(self.interval):
+            names = { thread.ident: thread.name for thread in threading.enumerate() }
+            stacks = []
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == me:
+                    continue
+                calls = []
+                while frame is not None and len(calls) < self.max_depth:
+                    code = frame.f_code
+                    calls.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                    frame = frame.f_back
+                stacks.append(";".join([names.get(thread_id, str(thread_id))] + calls[::-1]))
+            with self.lock:
+                self.samples.update(stacks)
+
+    def collapsed(self):
+        with self.lock:
+            return "".join(f"{stack} {count}\n" for stack, count in self.samples.most_common())
+
+
+PROFILER = SamplingProfiler()
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        request = urlsplit(self.path)
+        if request.path == "/metrics":
+            return self.reply(REGISTRY.render(), "text/plain; version=0.0.4")
+        if request.path == "/profile":
+            return self.reply(PROFILER.collapsed())
+        if request.path == "/profile/start":
+            interval = parse_qs(request.query).get("interval", [None])[0]
+            started = PROFILER.start(float(interval) if interval else None)
+            return self.reply(f"Profiler {'started' if started else 'already running'}, sampling every {PROFILER.interval}s\n")
+        if request.path == "/profile/stop":
+            return self.reply("Profiler stopped\n" if PROFILER.stop() else "Profiler wasn't running\n")
+        if request.path == "/profile/reset":
+            PROFILER.reset()
+            return self.reply("Profiler samples cleared\n")
+        self.reply("Not found\n", status=404)
+
+    def reply(self, text, content_type="text/plain", status=200):
+        data = text.encode('utf-8')
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(port=METRICS_PORT, host=""):
+    # Serves /metrics and the profiler in a background thread, returns None if no port is configured
+    if port is None or port == "":
+        return None
+    server = ThreadingHTTPServer((host, int(port)), MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    log("Metrics", f"Serving metrics on port {server.server_port}")
+    return server
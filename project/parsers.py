@@ -0,0 +1,56 @@
+import os
+from bs4 import BeautifulSoup, SoupStrainer
+from metrics import PARSE_SECONDS
+
+# Pick the fastest parser that's installed unless one is set explicitly.
+# Full trees are always BeautifulSoup (lxml or html.parser builder) so the extractors don't change,
+# link-only parsing can use selectolax which doesn't build a Python object per node.
+try:
+    import lxml # noqa: F401
+    DEFAULT_TREE_BACKEND = "lxml"
+except ImportError:
+    DEFAULT_TREE_BACKEND = "html.parser"
+
+try:
+    from selectolax.parser import HTMLParser
+    DEFAULT_LINK_BACKEND = "selectolax"
+except ImportError:
+    HTMLParser = None
+    DEFAULT_LINK_BACKEND = "strainer"
+
+TREE_BACKEND = os.getenv('SCRAPER_TREE_PARSER', DEFAULT_TREE_BACKEND)
+LINK_BACKEND = os.getenv('SCRAPER_LINK_PARSER', DEFAULT_LINK_BACKEND)
+
+ANCHORS_ONLY = SoupStrainer("a", href=True)
+
+
+class Document:
+    # A fetched page, parsed at most once.
+    # Whichever of soup/hrefs is asked for first decides how much parsing happens:
+    # a full tree is reused for links, a links-only parse never builds the full tree.
+    def __init__(self, url, html):
+        self.url = url
+        self.html = html
+        self._soup = None
+        self._hrefs = None
+
+    @property
+    def soup(self):
+        if self._soup is None:
+            with PARSE_SECONDS.time(backend=TREE_BACKEND, kind="tree"):
+                self._soup = BeautifulSoup(self.html, TREE_BACKEND)
+        return self._soup
+
+    @property
+    def hrefs(self):
+        if self._hrefs is None:
+            if self._soup is not None:
+                self._hrefs = [ a.get("href") for a in self._soup.find_all("a") ]
+            elif LINK_BACKEND == "selectolax" and HTMLParser is not None:
+                with PARSE_SECONDS.time(backend="selectolax", kind="links"):
+                    self._hrefs = [ a.attributes.get("href") for a in HTMLParser(self.html).css("a[href]") ]
+            else:
+                with PARSE_SECONDS.time(backend="strainer", kind="links"):
+                    soup = BeautifulSoup(self.html, TREE_BACKEND, parse_only=ANCHORS_ONLY)
+                    self._hrefs = [ a.get("href") for a in soup.find_all("a") ]
+        return self._hrefs
@@ -0,0 +1,122 @@
+# Re-run the extractors over archived HTML instead of crawling again, e.g. after fixing a site's rules.
+#
+#   python replay.py                      every archived page
+#   python replay.py --site IGN --dry-run only count what IGN's current rules extract
+#
+# Pages are split into chunks and extracted by a process pool, each worker reading the
+# archive's segments itself so no HTML is pickled between processes. The results are
+# bulk written to unique-articles under the same IDs the crawler would have used.
+import os
+import time
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from elasticsearch import Elasticsearch
+from bulk_writer import BulkWriter
+from parsers import Document
+from site_rules import compile_site_rules
+from html_archive import HtmlArchive, HTML_ARCHIVE_DIR
+from article_ids import generate_id, simhash, format_simhash, NearDuplicateIndex
+
+# !! Set ES Cloud ID and API Key Here
+ES_CLOUD_ID = os.getenv('ELASTIC_CLOUD_ID')
+ES_API_KEY = os.getenv('ELASTIC_API_KEY')
+
+# Set in each pool process by start_worker
+archive = None
+plans = None
+
+
+def start_worker(directory):
+    global archive, plans
+    archive = HtmlArchive(directory)
+    plans = compile_site_rules()
+
+
+def extract_chunk(pages):
+    # Runs in a pool process: (articles, failures) for a chunk of archive.pages() rows.
+    # Fingerprinting costs more than extracting, so it happens out here too
+    articles = []
+    failures = []
+    for url, site, segment, offset, length in pages:
+        try:
+            soup = Document(url, archive.read(segment, offset, length)).soup
+            article = plans[site].extract(soup)
+            articles.append((url, site, article, simhash(article['body'])))
+        except Exception as e:
+            failures.append((url, site, f"{type(e).__name__}: {e}"))
+    return articles, failures
+
+
+def chunked(rows, size):
+    for start in range(0, len(rows), size):
+        yield rows[start:start + size]
+
+
+def replay(directory, site=None, processes=None, chunk_size=200, index='unique-articles', dry_run=False, show_failures=10):
+    source = HtmlArchive(directory)
+    pages = source.pages(site)
+    source.close()
+    print(f"Replaying {len(pages)} archived pages" + (f" from {site}" if site else ""))
+    writer = None
+    if not dry_run:
+        es = Elasticsearch(ES_CLOUD_ID, api_key=ES_API_KEY)
+        writer = BulkWriter(es)
+    # Only guards against near-duplicates within this replay, checking against the index
+    # would flag every article as a copy of its own earlier extraction
+    near_duplicates = NearDuplicateIndex()
+    extracted = duplicates = 0
+    failures_by_site = {}
+    started = time.monotonic()
+
+    with ProcessPoolExecutor(processes, initializer=start_worker, initargs=(directory,)) as pool:
+        for articles, failures in pool.map(extract_chunk, chunked(pages, chunk_size)):
+            for url, page_site, article, fingerprint in articles:
+                _id = generate_id(page_site, article['headline'], article['date'])
+                if fingerprint is not None:
+                    duplicate = near_duplicates.find(fingerprint)
+                    if duplicate is not None and duplicate[0] != _id:
+                        duplicates += 1
+                        continue
+                    near_duplicates.add(fingerprint, _id)
+                extracted += 1
+                if writer is not None:
+                    writer.add(index, _id, {
+                        'site': page_site,
+                        'headline': article['headline'],
+                        'date': article['date'],
+                        'authors': article['authors'],
+                        'body': article['body'],
+                        'topics': article['topics'],
+                        'simhash': format_simhash(fingerprint) if fingerprint is not None else None
+                    })
+            for url, page_site, error in failures:
+                failures_by_site.setdefault(page_site, []).append((url, error))
+            done = extracted + duplicates + sum(len(f) for f in failures_by_site.values())
+            print(f"{time.monotonic() - started:7.0f}s  {done}/{len(pages)} pages  {extracted} extracted  {duplicates} near-duplicates")
+
+    if writer is not None:
+        writer.close()
+    for page_site, site_failures in failures_by_site.items():
+        # Listing pages and other non-articles end up here as well as pages the rules don't fit
+        print(f"{page_site}: {len(site_failures)} pages didn't extract")
+        for url, error in site_failures[:show_failures]:
+            print(f"    {url}: {error}")
+    elapsed = time.monotonic() - started
+    print(f"Done in {elapsed:.0f}s ({len(pages) / max(elapsed, 1e-9):.0f} pages/s)")
+    return extracted
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Re-run the extractors over the HTML archive and write the results")
+    parser.add_argument("--archive", default=HTML_ARCHIVE_DIR, help="archive directory")
+    parser.add_argument("--site", help="only this site's pages, e.g. IGN")
+    parser.add_argument("--processes", type=int, default=None, help="defaults to os.cpu_count()")
+    parser.add_argument("--chunk-size", type=int, default=200, help="pages per task handed to a process")
+    parser.add_argument("--index", default="unique-articles")
+    parser.add_argument("--dry-run", action="store_true", help="extract and report, don't write to Elasticsearch")
+    args = parser.parse_args()
+    replay(args.archive, args.site, args.processes, args.chunk_size, args.index, args.dry_run)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,152 @@
+import time
+import urllib.request
+from urllib.parse import urlsplit
+from urllib.robotparser import RobotFileParser
+from threading import Lock
+from metrics import log
+
+# One request every 3 seconds per host unless configured otherwise (the old fixed sleep)
+DEFAULT_RATE = 1 / 3
+# Never slow a host down below one request a minute
+MIN_RATE = 1 / 60
+USER_AGENT = "*"
+# Per-host turn-taking state shared through Redis, dropped once a host hasn't been fetched from for this long
+SHARED_STATE_TTL = 3600
+
+# Gives the caller the next turn at a host shared by every process using this Redis: the turn starts at the
+# later of now, the end of the last turn handed out and any pause, and the next one an interval after that.
+#   KEYS: host's hash   ARGV: now (epoch seconds), interval, pause until (0 for none), TTL
+# Returns the seconds to wait as a string, Lua numbers come back from Redis as integers
+RESERVE_SCRIPT = """
+local now = tonumber(ARGV[1])
+local paused = math.max(tonumber(redis.call('HGET', KEYS[1], 'paused') or 0), tonumber(ARGV[3]))
+local start = math.max(now, tonumber(redis.call('HGET', KEYS[1], 'next') or 0), paused)
+redis.call('HSET', KEYS[1], 'next', start + tonumber(ARGV[2]), 'paused', paused)
+redis.call('EXPIRE', KEYS[1], ARGV[4])
+return tostring(start - now)
+"""
+
+
+class TokenBucket:
+    # Refills at `rate` tokens per second up to `capacity`.
+    # reserve() always takes a token and returns how long the caller must wait for it,
+    # so callers queue up behind each other instead of polling.
+    # Nothing refills while the host is paused, so requests queued behind a pause
+    # go out at the host's rate once it's over rather than all at once.
+    def __init__(self, rate, capacity=1):
+        self.rate = rate
+        self.base_rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+
+    def refill(self, now):
+        start = max(self.updated, self.paused_until)
+        if now > start:
+            self.tokens = min(self.capacity, self.tokens + (now - start) * self.rate)
+        self.updated = now
+
+    def reserve(self):
+        now = time.monotonic()
+        self.refill(now)
+        self.tokens -= 1
+        wait = 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+        return max(now, self.paused_until) - now + wait
+
+
+class PolitenessScheduler:
+    # Per-host rate limiting shared by every crawler thread.
+    # Each host gets its own token bucket, so a host cooling down only delays work for that host.
+    # Rates start at the configured value (capped by robots.txt Crawl-delay), halve on 429/5xx
+    # responses and creep back up on successes.
+    # With r (Redis), turns are handed out through Redis instead, so processes fetching from the same host
+    # take turns with each other too. Each still adapts the rate to the responses it sees, and pauses are shared.
+    def __init__(self, default_rate=DEFAULT_RATE, host_rates=None, burst=1, honor_robots=True, r=None):
+        self.default_rate = default_rate
+        self.host_rates = host_rates or {}
+        self.burst = burst
+        self.honor_robots = honor_robots
+        self.buckets = {}
+        self.lock = Lock()
+        self.r = r
+        self.reserve_script = r.register_script(RESERVE_SCRIPT) if r is not None else None
+
+    def bucket(self, host):
+        with self.lock:
+            if host in self.buckets:
+                return self.buckets[host]
+        rate = self.host_rates.get(host, self.default_rate)
+        if self.honor_robots:
+            delay = self.crawl_delay(host)
+            if delay:
+                rate = min(rate, 1 / delay)
+        with self.lock:
+            return self.buckets.setdefault(host, TokenBucket(rate, self.burst))
+
+    def crawl_delay(self, host):
+        parser = RobotFileParser()
+        try:
+            with urllib.request.urlopen(f"https://{host}/robots.txt", timeout=10) as response:
+                parser.parse(response.read().decode('utf-8', errors='replace').splitlines())
+        except Exception as e:
+            log("Scheduler", f"Couldn't read robots.txt for {host}: {e}")
+            return None
+        delay = parser.crawl_delay(USER_AGENT)
+        if delay:
+            log("Scheduler", f"{host} asks for a Crawl-delay of {delay}s")
+        return float(delay) if delay else None
+
+    def reserve(self, url):
+        # Seconds the caller has to wait before fetching url
+        host = urlsplit(url).netloc
+        bucket = self.bucket(host)
+        with self.lock:
+            if self.r is None:
+                return bucket.reserve()
+            interval = 1 / bucket.rate
+            paused_for = bucket.paused_until - time.monotonic()
+        now = time.time()
+        wait = self.reserve_script(keys=[shared_key(host)], args=[now, interval, now + paused_for if paused_for > 0 else 0, SHARED_STATE_TTL])
+        return float(wait)
+
+    def paused(self, url):
+        # True if the host was paused while the caller waited, so its turn has to be taken again
+        host = urlsplit(url).netloc
+        bucket = self.bucket(host)
+        with self.lock:
+            if bucket.paused_until > time.monotonic():
+                return True
+        if self.r is None:
+            return False
+        paused = self.r.hget(shared_key(host), "paused")
+        return paused is not None and float(paused) > time.time()
+
+    def wait(self, url):
+        time.sleep(self.reserve(url))
+        while self.paused(url):
+            time.sleep(self.reserve(url))
+
+    def feedback(self, url, status, retry_after=None):
+        # Adapt the host's rate to how the server is coping
+        host = urlsplit(url).netloc
+        bucket = self.bucket(host)
+        pause = None
+        with self.lock:
+            now = time.monotonic()
+            bucket.refill(now)
+            if status == 429 or status >= 500:
+                bucket.rate = max(MIN_RATE, bucket.rate / 2)
+                pause = float(retry_after) if retry_after and retry_after.isdigit() else 1 / bucket.rate
+                bucket.paused_until = max(bucket.paused_until, now + pause)
+                log("Scheduler", f"{host} returned {status}, slowing to {bucket.rate:.3f} req/s")
+            else:
+                bucket.rate = min(bucket.base_rate, bucket.rate * 1.1)
+        if pause is not None and self.r is not None:
+            # Pause the other processes too, a zero interval takes no turn
+            now = time.time()
+            self.reserve_script(keys=[shared_key(host)], args=[now, 0, now + pause, SHARED_STATE_TTL])
+
+
+def shared_key(host):
+    return f"politeness:{host}"
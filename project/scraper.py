@@ -3,13 +3,27 @@ import redis
 import os
 import time
 import hashlib
-from datetime import datetime
-from bs4 import BeautifulSoup
 from threading import Thread
 from enum import Enum
 from elasticsearch import Elasticsearch
-from selenium import webdriver
-from selenium.webdriver.chrome.options import Options
+from selenium.webdriver.support.ui import WebDriverWait
+from seen_urls import SeenUrlIndex
+from bulk_writer import BulkWriter
+from article_fetcher import ArticleFetcher
+from http_cache import NOT_MODIFIED, open_cache
+from html_archive import open_archive
+from feed_discovery import FeedDiscovery
+from trends import TrendRollup
+from parsers import Document
+from scheduler import PolitenessScheduler
+from driver_pool import DriverPool
+from frontier import Frontier, save_checkpoint, load_checkpoint, save_horizon, load_horizon, clear_horizon, save_pass_top, load_pass_top, clear_pass_top
+from load_profile import LOAD_PROFILE, build_chrome_options, apply_profile, wait_until_ready, page_stats
+from article_ids import generate_id, simhash, format_simhash, NearDuplicateIndex
+from link_harvester import harvest_links, page_size, wait_for_growth
+from urllib.parse import urlsplit, urljoin
+from site_rules import compile_site_rules
+from metrics import log, timed, record_pages, serve, LINKS, FRONTIER_DEPTH
 
 # !! Set ES Cloud ID and API Key Here
 ES_CLOUD_ID = os.getenv('ELASTIC_CLOUD_ID')
@@ -24,97 +38,382 @@ SITE = Enum('SITE',
                 ]
             )
 
-# Setup Chrome options
-CHROME_OPTIONS = Options()
-CHROME_OPTIONS.add_argument("--headless")  # Ensure it runs in headless mode
-CHROME_OPTIONS.add_argument("--no-sandbox")  # Bypass OS security model, REQUIRED for Docker
-CHROME_OPTIONS.add_argument("--disable-dev-shm-usage")  # Overcome limited resource problems
+# Sections crawled by main() and by the worker processes
+CRAWL_TARGETS = [
+    (SITE.IGN, "/news/"),
+    (SITE.IGN, "/reviews/"),
+    (SITE.PCGamer, "/games/"),
+    (SITE.PCGamer, "/archive/"),
+]
 
+# Per-site extraction rules, compiled once at startup
+EXTRACTION_PLANS = compile_site_rules()
 
-# Helper function to generate a unique ID for articles
-def generate_id(site, headline, date):
-    combined_key = "".join(site.split()) + "".join(headline.split()) + "".join(date.split())
-    _id = combined_key.encode('utf-8')
-    # Elasticsearch did not like using hashed IDs
-    return _id
+# Sites whose articles only render with JavaScript are always loaded through the WebDriver
+JS_ONLY_SITES = set()
+
+# Requests per second allowed for each host, anything not listed uses scheduler.DEFAULT_RATE
+HOST_RATES = {
+    "www.ign.com": 1 / 3,
+    "www.pcgamer.com": 1 / 3,
+}
+
+# Number of queued articles fetched concurrently over HTTP
+ARTICLE_BATCH_SIZE = 8
+
+# "feeds" finds links in each site's sitemaps and RSS/Atom feeds, scrolling the listing
+# only for sites without a readable feed. "scroll" always scrolls
+DISCOVERY = os.getenv('DISCOVERY', "feeds")
+
+# Refresh sections from the top and stop scrolling once we're back to content we already have.
+# Set to "0" to always scroll on until a listing runs out
+INCREMENTAL_CRAWL = os.getenv('INCREMENTAL_CRAWL', "1") == "1"
+
+# Already-indexed links, or articles older than the last pass's newest, in a row that mean a refresh is done
+HORIZON_RUN = int(os.getenv('HORIZON_RUN', 30))
+
+# Most screens to scroll each section, by crawler ID. Anything not listed uses MAX_SCROLL_PAGES, 0 for no limit
+SECTION_MAX_PAGES = {
+    "IGN/news/": 600,
+    "IGN/reviews/": 300,
+    "PCGamer/games/": 600,
+}
+MAX_SCROLL_PAGES = int(os.getenv('MAX_SCROLL_PAGES', 0))
+
+# Set to forget the queued links and scroll positions of earlier runs
+FRESH_CRAWL = os.getenv('FRESH_CRAWL') == "1"
+
+# Collect new listing links in the browser instead of pulling and parsing the whole page_source
+HARVEST_LINKS = os.getenv('HARVEST_LINKS', "1") == "1"
+
+# Number of Chrome instances shared by all crawlers
+DRIVER_POOL_SIZE = int(os.getenv('DRIVER_POOL_SIZE', 2))
+
+# Setup Chrome options, see load_profile.LOAD_PROFILES for what each profile blocks
+CHROME_OPTIONS = build_chrome_options(LOAD_PROFILE)
 
 
 class WebCrawler:
-    def __init__(self, site, subdirectory=""):
+    def __init__(self, site, subdirectory="", seen_urls=None, bulk_writer=None, fetcher=None, scheduler=None, driver_pool=None, frontier=None, near_duplicates=None, archive=None, trends=None, feed_discoveries=None, es_client=None, r=None, autorun=True):
 
         self.site = site
         self.subdirectory = subdirectory
         self.id = f"{self.site.name + self.subdirectory}"
-        print(f"{self.id}: Initializing WebCrawler for domain: {self.site.value + self.subdirectory}")
-        self.page_num = 1
+        # Labels on every metric this crawler reports
+        self.labels = { "site": self.site.name, "subdirectory": self.subdirectory or "/" }
+        self.plan = EXTRACTION_PLANS[self.site.name]
+        self.log(f"Initializing WebCrawler for domain: {self.site.value + self.subdirectory}")
         self.has_links = True
 
+        # Per-host rate limits, shared between crawlers so threads on the same site take turns
+        if scheduler is None:
+            scheduler = PolitenessScheduler(host_rates=HOST_RATES)
+        self.scheduler = scheduler
+
         ###### Set up the Selenium webdrivers ######
-        self.base_wd = webdriver.Chrome(options=CHROME_OPTIONS)
-        self.base_wd.get(self.site.value)
-        print(f"{self.id}: Initialized Base WebDriver")
-        self.article_wd = webdriver.Chrome(options=CHROME_OPTIONS)
-        self.article_wd.get(self.site.value)
-        print(f"{self.id}: Initialized Article WebDriver")
-        time.sleep(2) # Allow time for the web pages to open
+        # Browsers come from a pool shared by all crawlers, only held while they're in use
+        self.owns_driver_pool = driver_pool is None
+        if self.owns_driver_pool:
+            driver_pool = build_driver_pool()
+        self.driver_pool = driver_pool
+        self.log(f"Using WebDriver pool of {self.driver_pool.size}")
 
-        self.webdriver_scroll_pause_time = 1
-        self.webdriver_screen_height = self.base_wd.execute_script("return window.screen.height;")  # Get the screen height
+        self.webdriver_growth_timeout = 5 # Longest to wait for an infinite feed to load more
+        with self.driver_pool.lease(self.id) as pooled:
+            self.webdriver_screen_height = pooled.driver.execute_script("return window.screen.height;")  # Get the screen height
 
 
         ###### Initialize Elasticsearch client ######
-        self.es_client = Elasticsearch(
-            ES_CLOUD_ID,
-            api_key=ES_API_KEY
-        )
-        print(f"{self.id}: {self.es_client.info()}") # Test
+        if es_client is None:
+            es_client = Elasticsearch(
+                ES_CLOUD_ID,
+                api_key=ES_API_KEY
+            )
+        self.es_client = es_client
+        self.log(f"{self.es_client.info()}") # Test
+
+        # Seen-URL index can be shared between crawlers so it's only warmed once
+        if seen_urls is None:
+            seen_urls = SeenUrlIndex(self.es_client)
+            self.log(f"Warmed seen-URL index with {seen_urls.warm()} URLs")
+        self.seen_urls = seen_urls
+
+        # Fingerprints of indexed article bodies, so re-titled or syndicated copies are skipped
+        if near_duplicates is None:
+            near_duplicates = NearDuplicateIndex()
+            self.log(f"Warmed near-duplicate index with {near_duplicates.warm(self.es_client)} articles")
+        self.near_duplicates = near_duplicates
+
+        # Documents are queued and written in bulk in the background
+        self.owns_bulk_writer = bulk_writer is None
+        if self.owns_bulk_writer:
+            bulk_writer = BulkWriter(self.es_client)
+        self.bulk_writer = bulk_writer
+
+        # Articles are fetched over plain HTTP, the article WebDriver is only a fallback.
+        # Pages fetched on earlier runs are revalidated, see http_cache.py
+        self.owns_fetcher = fetcher is None
+        if self.owns_fetcher:
+            fetcher = ArticleFetcher(self.scheduler, cache=open_cache())
+        self.fetcher = fetcher
+
+        # Every processed page's HTML is archived so the extractors can be re-run without crawling again
+        self.owns_archive = archive is None
+        if self.owns_archive:
+            archive = open_archive()
+        self.archive = archive
 
 
         ###### Initialize Redis client ######
-        print(f"{self.id}: Initializing Redis cache")
-        self.r = redis.Redis()
-        self.r.delete(f"{self.id}-links")
+        self.log("Initializing Redis cache")
+        if r is None:
+            r = redis.Redis()
+        self.r = r
+        # Workers pass in the shared, sharded frontier instead of a private one.
+        # Only a private frontier is cleared here, the shared one is cleared by workers.py coordinator --fresh
+        if frontier is None:
+            frontier = Frontier(self.r, self.id)
+            FRONTIER_DEPTH.track(frontier.depth, **self.labels)
+            if FRESH_CRAWL:
+                frontier.clear()
+        if FRESH_CRAWL:
+            save_checkpoint(self.r, self.id, 1)
+            clear_horizon(self.r, self.id)
+        self.frontier = frontier
+        # Article counts per game title, see trends.py
+        if trends is None:
+            trends = TrendRollup(self.r)
+        self.trends = trends
+        # Pick up from where the last run scrolled to
+        self.page_num = load_checkpoint(self.r, self.id)
+        if self.page_num > 1:
+            self.log(f"Resuming from page {self.page_num}")
+
+        # A run from the top of a section an earlier pass finished is a refresh: it stops at the horizon,
+        # the newest link and date that pass saw. Anything else is a full pass, which checkpoints as it
+        # goes so it can be resumed. A refresh doesn't, if it's interrupted the next one starts from the top
+        self.horizon = load_horizon(self.r, self.id) if INCREMENTAL_CRAWL else None
+        self.refreshing = self.horizon is not None and self.page_num == 1
+        if self.refreshing:
+            self.log(f"Refreshing up to {self.horizon['url']} ({self.horizon['date']})")
+        self.max_pages = SECTION_MAX_PAGES.get(self.id, MAX_SCROLL_PAGES)
+        self.started_at_top = self.page_num == 1
+        self.listed = set() # Listing links already checked against the horizon
+        self.seen_run = 0
+        self.old_run = 0
+        # A resumed full pass picks up the top link it recorded when it started
+        self.newest_url = None if self.started_at_top or not INCREMENTAL_CRAWL else load_pass_top(self.r, self.id)
+        self.newest_date = None
+
+        # Links come from the site's sitemaps and feeds when it has any, see feed_discovery.py.
+        # Every section of a site reads the same feeds, so they share one FeedDiscovery (site name -> discovery)
+        self.feeds = None
+        if DISCOVERY == "feeds":
+            if feed_discoveries is None:
+                feed_discoveries = {}
+            self.feeds = feed_discoveries.setdefault(self.site.name, FeedDiscovery(
+                self.site, self.plan.feeds, self.check_filters, r=self.r, scheduler=self.scheduler, cache=self.fetcher.cache
+            ))
 
         # Run the crawler on initialization
-        print(f"{self.id}: Initialization complete. Running crawler...")
-        self.run()
+        if autorun:
+            self.log("Initialization complete. Running crawler...")
+            self.run()
+
+
+    def log(self, message, **fields):
+        log(self.id, message, **self.labels, **fields)
 
 
     def run(self):
-        print(f"{self.id}: Starting crawl of domain: {self.site.value + self.subdirectory}")
+        self.log(f"Starting crawl of domain: {self.site.value + self.subdirectory}")
 
         # Start crawl
         while(self.has_links):
             self.start_crawl()
 
-        print(f"{self.id}: No more links to crawl!")
-        self.base_wd.quit()
-        self.article_wd.quit()
+        self.log("No more links to crawl!")
+        self.end_pass()
+        for name, matches, seconds in self.plan.rule_stats():
+            self.log(f"Rule {name}: {matches} matches, {seconds * 1000:.1f} ms")
+        if self.owns_driver_pool:
+            self.driver_pool.close()
+        if self.owns_fetcher:
+            self.fetcher.close()
+        if self.owns_bulk_writer:
+            self.bulk_writer.close()
+        if self.owns_archive and self.archive is not None:
+            self.archive.close()
 
 
     def start_crawl(self):
-
+        self.discover()
+        # Scrape articles a batch at a time
+        while self.scrape_batch(self.frontier.pop(ARTICLE_BATCH_SIZE)):
+            pass
+
+
+    @timed("discover")
+    def discover(self):
+        if self.feeds is not None:
+            if self.discover_from_feeds():
+                return
+            # Nothing readable, this site gets scrolled from now on
+            self.log("No readable feeds, falling back to scrolling")
+            self.feeds = None
         # Start scrolling and scrape for links
-        self.page_num = self.scroll_page(self.base_wd, self.page_num)
-        self.extract_links(self.site.value + self.subdirectory, self.base_wd)
+        with self.driver_pool.lease(self.id) as pooled:
+            self.open_listing(pooled)
+            self.page_num = self.scroll_page(pooled.driver, self.page_num)
+            candidates, links = self.extract_links(self.site.value + self.subdirectory, pooled.driver, harvest=HARVEST_LINKS)
+        if self.started_at_top and self.newest_url is None:
+            # The first new link from the top of the listing, the next refresh can stop once it gets back to it.
+            # Links that were already there, like pinned features, would stop it before reaching anything new
+            new = set(links)
+            self.newest_url = next((link for link in candidates if link in new), None)
+            if self.newest_url is not None and INCREMENTAL_CRAWL and not self.refreshing:
+                save_pass_top(self.r, self.id, self.newest_url)
+        self.check_horizon(candidates, links)
+        if self.max_pages and self.page_num >= self.max_pages and self.has_links:
+            self.log(f"Reached the depth limit of {self.max_pages} pages")
+            self.has_links = False
+        if not self.refreshing:
+            save_checkpoint(self.r, self.id, self.page_num)
+
+
+    def check_horizon(self, candidates, links):
+        # On a refresh, stop scrolling once the listing is back to what the last pass had:
+        # its newest link, or HORIZON_RUN links in a row that are already indexed
+        if not self.refreshing or not self.has_links:
+            return
+        new = set(links)
+        for link in candidates:
+            if link in self.listed:
+                continue
+            self.listed.add(link)
+            if link == self.horizon["url"]:
+                self.log(f"Reached the newest link from the last pass on page {self.page_num}")
+                self.has_links = False
+                return
+            self.seen_run = 0 if link in new else self.seen_run + 1
+            if self.seen_run >= HORIZON_RUN:
+                self.log(f"Reached {HORIZON_RUN} indexed links in a row on page {self.page_num}")
+                self.has_links = False
+                return
+
+
+    def note_date(self, date):
+        # Articles scraped from this section, a refresh stops at HORIZON_RUN in a row older than the last pass's newest
+        if date == "N/A":
+            return
+        if self.newest_date is None or date > self.newest_date:
+            self.newest_date = date
+        if not self.refreshing or not self.horizon.get("date"):
+            return
+        self.old_run = self.old_run + 1 if date < self.horizon["date"] else 0
+        if self.old_run >= HORIZON_RUN and self.has_links:
+            self.log(f"Reached {HORIZON_RUN} articles in a row from before {self.horizon['date']}")
+            self.has_links = False
 
-        # Scrape each article
-        while link := self.r.rpop(f"{self.id}-links"):
-            self.scrape(link)
-            print(f"{self.id}: Scraped. Waiting a few seconds...")
-            time.sleep(3) # Be REALLY nice to the server
+
+    def end_pass(self):
+        # The section's listing is done with. The next run refreshes from the top and stops at what this one saw
+        if not INCREMENTAL_CRAWL or self.feeds is not None:
+            return
+        save_checkpoint(self.r, self.id, 1)
+        previous = self.horizon or {}
+        url = self.newest_url or previous.get("url")
+        dates = [ date for date in (self.newest_date, previous.get("date")) if date ]
+        # A pass resumed from a checkpoint written before it recorded its top link only has dates to go on
+        if url is not None or dates:
+            save_horizon(self.r, self.id, url, max(dates) if dates else None)
+        clear_pass_top(self.r, self.id)
+
+
+    def discover_from_feeds(self):
+        # False if none of the site's feeds could be read
+        result = self.feeds.discover()
+        if result is None:
+            return False
+        found, changed = result
+        # Updated articles are fetched again even though we've seen them, anything else has to be new
+        new = self.seen_urls.filter_unseen(list(found))
+        unseen = set(new)
+        updated = [ url for url in changed if url not in unseen ]
+        LINKS.inc(len(found), outcome="found", **self.labels)
+        LINKS.inc(len(new), outcome="new", **self.labels)
+        LINKS.inc(len(updated), outcome="updated", **self.labels)
+        self.log(f"Found {len(new)} new and {len(updated)} updated links in feeds")
+        self.frontier.push(new)
+        self.frontier.requeue(updated)
+        if len(new) + len(updated) == 0:
+            self.has_links = False
+        return True
 
 
+    @timed("scrape_batch")
+    def scrape_batch(self, urls):
+        if len(urls) == 0:
+            return 0
+        if self.site in JS_ONLY_SITES:
+            pages = [ (url, None) for url in urls ]
+        else:
+            pages = self.fetcher.fetch_all(urls)
+            record_pages(self.site.name, self.labels["subdirectory"], "http", sum(1 for _, html in pages if isinstance(html, str)))
+        unchanged = 0
+        for url, html in pages:
+            if html is NOT_MODIFIED:
+                # Same as when we last scraped it, no need to extract or write anything
+                unchanged += 1
+                continue
+            self.scrape(url, html)
+            if html is not None:
+                self.fetcher.remember(url, html)
+        # Only now are they done, if we crash before this the leases expire and they're queued again
+        self.frontier.ack(urls)
+        self.log(f"Scraped {len(pages) - unchanged} articles, {unchanged} unchanged")
+        return len(pages)
+
+
+    def open_listing(self, pooled):
+        # The pool hands back our last browser when it's free, otherwise
+        # reload the listing and scroll back down to where we got to
+        if pooled.page == self.id:
+            return
+        self.log(f"Opening listing in WebDriver {pooled.number}")
+        self.load_page(pooled, self.site.value, "a[href]")
+        pooled.page = self.id
+        if self.page_num > 1:
+            self.scroll_page(pooled.driver, 1, self.page_num - 1)
+
+
+    @timed("load_page")
+    def load_page(self, pooled, url, ready_selector=None):
+        # Load a page with the configured load profile and report what it cost
+        self.scheduler.wait(url)
+        pooled.driver.get(url)
+        pooled.pages += 1
+        record_pages(self.site.name, self.labels["subdirectory"], "browser")
+        if not wait_until_ready(pooled.driver, ready_selector, LOAD_PROFILE):
+            self.log(f"Timed out waiting for '{ready_selector}' on {url}")
+        transferred, elapsed = page_stats(pooled.driver)
+        self.log(f"Loaded {url} in {elapsed:.0f} ms, {transferred / 1024:.0f} KB ({LOAD_PROFILE} profile)", url=url, ms=round(elapsed), bytes=transferred)
+
+
+    @timed("scroll_page")
     def scroll_page(self, webdriver, page_num, num_pages_to_scroll=3):
         # Scroll down num_pages screens(pages) max of html content each time this method is called
-        print(f"{self.id}: Scrolling {webdriver.current_url}")
+        self.log(f"Scrolling {webdriver.current_url}")
         stopping_point = page_num + num_pages_to_scroll
         while page_num < stopping_point:
-            print(f"{self.id}: \tPage: {page_num}")
+            self.log(f"\tPage: {page_num}")
+            size = page_size(webdriver)
             # Scroll one screen height each time
             webdriver.execute_script("window.scrollTo(0, {screen_height}*{i});".format(screen_height=self.webdriver_screen_height, i=page_num))  
             page_num += 1
-            time.sleep(self.webdriver_scroll_pause_time)
+            # Only near the bottom does the feed need to load more, wait for the DOM to grow rather than a fixed pause
+            if self.webdriver_screen_height * (page_num + 1) > size[0]:
+                wait_for_growth(webdriver, size, self.webdriver_growth_timeout)
             # Update scroll height each time after scrolled, as the scroll height can change after we scrolled the page
             scroll_height = webdriver.execute_script("return document.body.scrollHeight;")
             # Break the loop when the height we need to scroll to is larger than the total scroll height
@@ -123,159 +422,221 @@ class WebCrawler:
         return stopping_point # new page number
 
 
-    def scrape(self, url):
-        decoded_url = url.decode('utf-8')
-        self.article_wd.get(decoded_url)
-        soup = BeautifulSoup(self.article_wd.page_source, "html.parser")
-        print (f"{self.id}: Scraping Data from: {decoded_url}")
+    @timed("scrape")
+    def scrape(self, decoded_url, html=None):
+        # Try the HTML fetched over HTTP first
+        if html is not None:
+            self.log(f"Scraping Data from: {decoded_url}")
+            try:
+                self.scrape_article_data(Document(decoded_url, html).soup)
+                self.write_to_elastic_webpages(decoded_url, self.site.value, html)
+                return
+            except Exception as e:
+                self.log(f"Extraction failed on fetched HTML, falling back to WebDriver: {e}")
 
+        document = None
         try:
-            self.scrape_article_data(soup)
-            # Cache article URLs to Elasticsearch
-        except Exception as e:
-            print(f"{self.id}: Invalid article format: {e}")
-            self.scroll_page(self.article_wd, 1)
-            self.extract_links(url, self.article_wd) # Try to find links on the page if it isn't an article
+            with self.driver_pool.lease() as pooled:
+                self.load_page(pooled, decoded_url, self.plan.ready_selector)
+                pooled.page = decoded_url
+                document = Document(decoded_url, pooled.driver.page_source)
+                self.log(f"Scraping Data from: {decoded_url}")
+
+                try:
+                    self.scrape_article_data(document.soup)
+                    # Cache article URLs to Elasticsearch
+                except Exception as e:
+                    self.log(f"Invalid article format: {e}")
+                    # Try to find links on the page if it isn't an article, reusing the tree we already parsed
+                    self.extract_links(decoded_url, pooled.driver, document)
         finally:
-            self.write_to_elastic_webpages(decoded_url, str(self.base_wd.current_url))
+            self.write_to_elastic_webpages(decoded_url, self.site.value, document.html if document is not None else None)
 
 
+    @timed("scrape_article_data")
     def scrape_article_data(self, soup):
-        match (self.site):
-            case SITE.IGN:
-                headline = soup.find("h1").get_text()
-                authors = [ a.get_text() if a is not None else "N/A" for a in soup.find_all("a", class_="jsx-3953721931 article-author underlined") ]
-                date = self.scrape_date(soup)
-                body = soup.find_all("p", class_="jsx-3649800006")
-                topics = [ t.get_text() if t is not None else "N/A" for t in soup.find_all("a", attrs={"data-cy": "object-breadcrumb"}) ]
-            case SITE.GameInformer:
-                headline = soup.find("h1", class_="page-title").get_text()
-                authors = [ a.get_text() if a is not None else "N/A" for a in soup.find("div", class_="author-details").find_all("a") ]
-                date = self.scrape_date(soup)
-                body = soup.find("div", class_="ds-main").find_all("p")
-                topics = [ t.get_text().strip("\n") if t is not None else "N/A" for t in soup.find("div", class_="gi5--product--summary").find_all("a", attrs={"rel": "bookmark"}) ]
-            case SITE.PCGamer:
-                headline = soup.find("h1").get_text()
-                authors = [ a.get_text() if a is not None else "N/A" for a in soup.find("div", class_="author-byline__authors").find_all("a", class_="link author-byline__link") ]
-                date = self.scrape_date(soup)
-                body = soup.find("div", attrs={"id" : "article-body"}).find_all("p", class_=None)
-                topics = [ t.find("a").get_text().strip("\n") if t is not None else "N/A" for t in soup.find_all("div", class_="tag", attrs={"data-analytics-id" : "article-product"}) ]
-        body_text = ""
-        for p in body:
-            body_text += p.get_text() + "\n"
-        self.write_to_elastic_articles(self.site.name, headline, date, authors, body_text, topics)
+        # Every field comes from one pass over the tree using this site's compiled rules
+        article = self.plan.extract(soup)
+        self.note_date(article['date'])
+        self.write_to_elastic_articles(self.site.name, article['headline'], article['date'], article['authors'], article['body'], article['topics'])
 
+    @timed("scrape_date")
     def scrape_date(self, soup):
         # Had a lot of trouble with finding publication dates.
-        # This method makes a few attempts for each site and gives
+        # Each site lists a few date rules which are tried in order, giving "N/A" if none parse
         try:
-            match (self.site):
-                case SITE.IGN:
-                    raw_date = soup.find("meta", attrs={"property" : "article:published_time"})
-                    if (raw_date is not None):
-                        date = datetime.strptime(raw_date.get("content").split("T")[0], "%Y-%m-%d").strftime("%Y-%m-%d")
-                    else:
-                        raw_date = soup.find("div", class_="caption jsx-1541923331")
-                        date = datetime.strptime(raw_date.get_text().split("Posted: ")[1], "%b %d, %Y %I:%M %p").strftime("%Y-%m-%d")
-                case SITE.GameInformer:
-                    raw_date = soup.find("div", class_="author-details")
-                    date = datetime.strptime(raw_date.get_text().split("on ")[1], "%b %d, %Y at %I:%M %p").strftime("%Y-%m-%d")
-                case SITE.PCGamer:
-                    raw_date = soup.find("meta", attrs={"name": "pub_date"})
-                    if (raw_date is not None):
-                        date = datetime.strptime(raw_date.get("content").split("T")[0], "%Y-%m-%d").strftime("%Y-%m-%d")
-                    else:
-                        raw_date = soup.find("span", class_="article-byline__date").find("time", class_="relative-date").getAttribute("datetime")
-                        date = datetime.strptime(raw_date, "%Y-%m-%dT%H:%M:%SZ").strftime("%Y-%m-%d")
-            return date
+            return self.plan.extract_date(soup)
         except Exception as e:
-            print(f"{self.id}: Error scraping article date: {e}")
+            self.log(f"Error scraping article date: {e}")
             return "N/A"
 
 
-    def extract_links(self, url, webdriver):
-        print(f"{self.id}: Scraping Links from: {url}")
+    @timed("extract_links")
+    def extract_links(self, url, webdriver, document=None, harvest=False):
+        self.log(f"Scraping Links from: {url}")
 
         attempts = 0
         links = []
         while (len(links) == 0 and attempts < 3):
             attempts += 1
-            time.sleep(5) # Wait for the page to load
-            soup = BeautifulSoup(webdriver.page_source, "html.parser") # This can probably be done without creating the object multiple times
-            a_tags = soup.find_all("a")
-            hrefs = [ a.get("href") for a in a_tags ]
+            if harvest:
+                # Only the hrefs added to the page since the last pass, straight from the browser
+                if attempts > 1:
+                    self.wait_for_page(webdriver, attempts)
+                hrefs = harvest_links(webdriver)
+            else:
+                if document is None or attempts > 1:
+                    self.wait_for_page(webdriver, attempts)
+                    html = webdriver.page_source
+                    # Only parse again if the page actually changed since the last attempt
+                    if document is None or html != document.html:
+                        document = Document(url, html)
+                hrefs = document.hrefs
 
             # Do domain specific URL filtering
             match (self.site):
                 case SITE.PCGamer: # PCGamer puts the whole URL in their hrefs
-                    print(f"{self.id}: PCGamer URL filtering")
-                    filtered = [ a for a in hrefs if a and self.check_filters(a) and self.es_client.exists(index='webpages', id=a) == False ]
+                    self.log("PCGamer URL filtering")
+                    candidates = [ a for a in hrefs if a and self.check_filters(a) ]
                 case _:
-                    print(f"{self.id}: Generic URL filtering")
-                    filtered = [ url + a for a in hrefs if a and self.check_filters(a) and self.es_client.exists(index='webpages', id=(url + a)) == False ]
+                    self.log("Generic URL filtering")
+                    candidates = [ urljoin(url, a) for a in hrefs if a and self.check_filters(a) ]
+            # One batched check against the seen-URL index instead of a request per link
+            filtered = self.seen_urls.filter_unseen(list(dict.fromkeys(candidates)))
             links = list(set(filtered)) # Remove duplicates
-            print(f"{self.id}: Found {len(links)} links")
+            LINKS.inc(len(candidates), outcome="found", **self.labels)
+            LINKS.inc(len(links), outcome="new", **self.labels)
+            self.log(f"Found {len(links)} links")
         if (len(links) > 0):
-            # Put links into a queue in Redis, call it "(name)-links"
-            self.r.lpush(f"{self.id}-links", *links)
+            # Put links into the frontier queue in Redis
+            self.frontier.push(links)
         else:
-            print(f"{self.id}: No links found after {attempts} attempts. Exiting.")
+            self.log(f"No links found after {attempts} attempts. Exiting.")
             self.has_links = False
+        # The listing's article links in page order, and the ones that were new
+        return candidates, links
+
+
+    @timed("wait_for_page")
+    def wait_for_page(self, webdriver, attempts, timeout=10):
+        # Wait for the page to finish loading instead of sleeping a fixed time.
+        # Retries happen when no links showed up, so give lazy content a little longer each time
+        WebDriverWait(webdriver, timeout).until(lambda d: d.execute_script("return document.readyState;") == "complete")
+        if attempts > 1:
+            time.sleep(attempts - 1)
 
 
-    def write_to_elastic_webpages(self, decoded_url, domain):
-        self.es_client.index(index='webpages', id=decoded_url, document={ 'url': decoded_url, 'domain': domain })
+    @timed("write_to_elastic_webpages")
+    def write_to_elastic_webpages(self, decoded_url, domain, html=None):
+        self.bulk_writer.add('webpages', decoded_url, { 'url': decoded_url, 'domain': domain })
+        self.seen_urls.add(decoded_url)
+        # Pages that failed extraction are kept too, they're the ones a fixed rule needs to see again (replay.py)
+        if html is not None and self.archive is not None:
+            self.archive.add(decoded_url, self.site.name, html)
 
 
+    @timed("write_to_elastic_articles")
     def write_to_elastic_articles(self, site, headline, date, authors, body, topics):
-        self.es_client.index(
-            index='unique-articles', 
-            id = generate_id(site, headline, date),
-            document={ 
+        _id = generate_id(site, headline, date)
+        fingerprint = simhash(body)
+        if fingerprint is not None:
+            duplicate = self.near_duplicates.find(fingerprint)
+            # An updated article is similar to its own earlier version, that one gets overwritten
+            if duplicate is not None and duplicate[0] != _id:
+                self.log(f"Skipping '{headline}', {duplicate[1]:.0%} similar to article {duplicate[0]}")
+                return
+            self.near_duplicates.add(fingerprint, _id)
+        self.bulk_writer.add(
+            'unique-articles', 
+            _id,
+            { 
                 'site': site, 
                 'headline': headline, 
                 'date': date, 
                 'authors': authors, 
                 'body': body, 
-                'topics': topics 
+                'topics': topics,
+                'simhash': format_simhash(fingerprint) if fingerprint is not None else None
             }
         )
+        # Counted once per article ID, so rewriting an updated article doesn't count it again
+        self.trends.count(_id, site, date, topics)
 
 
     def check_filters(self, href):
        # These cover most of our desired articles' URL patterns 
        # on sites with infinitely scrolling main pages
        # such as IGN, GameInformer, PCGamer, etc. 
-        match (self.site):
-            case SITE.IGN:
-                return (href.startswith("/articles/"))
-            case SITE.GameInformer:
-                return (href.startswith("/news/") or 
-                        href.startswith("/preview/") or
-                        href.startswith("/review/") or
-                        href.startswith("/feature/") or
-                        href.startswith("/blog/") or
-                        href.startswith("/gamer-culture/"))
-            case SITE.PCGamer:
-                return (href.startswith(SITE.PCGamer.value))
-            case _: # Stick to chosen sites
-                return False
-
-
-def start_webcrawler(url_base, iden):
-    print(f"{iden}: Started at {time.strftime('%X')}")
-    WebCrawler(url_base, iden)
-    print(f"{iden}: Finished at {time.strftime('%X')}")
+       # The prefixes for each site live in site_rules.SITE_RULES
+        return self.plan.matches_url(href)
+
+
+def site_for_url(url):
+    host = urlsplit(url).netloc
+    return next((site for site in SITE if urlsplit(site.value).netloc == host), None)
+
+
+def build_driver_pool(size=DRIVER_POOL_SIZE):
+    return DriverPool(CHROME_OPTIONS, size=size, on_start=lambda driver: apply_profile(driver, LOAD_PROFILE))
+
+
+def build_shared(es_client, driver_pool_size=DRIVER_POOL_SIZE, r=None):
+    # Everything the crawlers in one process share
+    # Warm the seen-URL index once and share it between all the crawler threads
+    seen_urls = SeenUrlIndex(es_client)
+    log("Crawler", f"Warmed seen-URL index with {seen_urls.warm()} URLs")
+    near_duplicates = NearDuplicateIndex()
+    log("Crawler", f"Warmed near-duplicate index with {near_duplicates.warm(es_client)} articles")
+    # All crawlers feed one bulk writer, flushed after every crawler is done
+    bulk_writer = BulkWriter(es_client)
+    # One set of per-host rate limits, one HTTP connection pool and one revalidation cache for article fetches.
+    # With r the rate limits are also shared with every other process using that Redis
+    scheduler = PolitenessScheduler(host_rates=HOST_RATES, r=r)
+    fetcher = ArticleFetcher(scheduler, cache=open_cache())
+    # More crawl targets than browsers, they take turns with the pooled WebDrivers
+    driver_pool = build_driver_pool(driver_pool_size)
+    # One archive writer per process
+    archive = open_archive()
+    # Filled in by the first crawler on each site, so a site's feeds are read by one discovery
+    feed_discoveries = {}
+    return {
+        'seen_urls': seen_urls,
+        'near_duplicates': near_duplicates,
+        'bulk_writer': bulk_writer,
+        'fetcher': fetcher,
+        'scheduler': scheduler,
+        'driver_pool': driver_pool,
+        'archive': archive,
+        'feed_discoveries': feed_discoveries
+    }
+
+
+def close_shared(shared):
+    shared['driver_pool'].close()
+    shared['fetcher'].close()
+    shared['bulk_writer'].close()
+    if shared['archive'] is not None:
+        shared['archive'].close()
+
+
+def start_webcrawler(url_base, iden, **shared):
+    log(iden, f"Started at {time.strftime('%X')}")
+    WebCrawler(url_base, iden, **shared)
+    log(iden, f"Finished at {time.strftime('%X')}")
 
 
 def main():
-    thread1 = Thread(target=start_webcrawler, args=(SITE.IGN, "/news/"))
-    thread2 = Thread(target=start_webcrawler, args=(SITE.IGN, "/reviews/"))
-    thread3 = Thread(target=start_webcrawler, args=(SITE.PCGamer, "/games/"))
-    thread4 = Thread(target=start_webcrawler, args=(SITE.PCGamer, "/archive/"))
-    thread1.start()
-    thread2.start()
-    thread3.start()
-    thread4.start()
-
-main()
\ No newline at end of file
+    serve() # Only if METRICS_PORT is set
+    shared = build_shared(Elasticsearch(ES_CLOUD_ID, api_key=ES_API_KEY))
+
+    # One thread per section. For more than one process or machine, see workers.py
+    threads = [ Thread(target=start_webcrawler, args=target, kwargs=shared) for target in CRAWL_TARGETS ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    close_shared(shared)
+
+
+if __name__ == "__main__":
+    main()
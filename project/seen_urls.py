@@ -0,0 +1,97 @@
+import math
+import hashlib
+from threading import Lock
+from urllib.parse import urlsplit, urlunsplit
+from elasticsearch import helpers, NotFoundError
+
+
+class BloomFilter:
+    # Fixed-size bit array with k hash probes per item.
+    # False positives are possible, false negatives are not.
+    def __init__(self, capacity=1_000_000, error_rate=0.001):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.num_bits = math.ceil(-capacity * math.log(error_rate) / (math.log(2) ** 2))
+        self.num_hashes = max(1, round((self.num_bits / capacity) * math.log(2)))
+        self.bits = bytearray((self.num_bits + 7) // 8)
+        self.count = 0
+
+    def _probes(self, item):
+        # Double hashing: two 64-bit halves of one digest give all k positions
+        digest = hashlib.blake2b(item.encode('utf-8'), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return [ (h1 + i * h2) % self.num_bits for i in range(self.num_hashes) ]
+
+    def add(self, item):
+        for bit in self._probes(item):
+            self.bits[bit >> 3] |= 1 << (bit & 7)
+        self.count += 1
+
+    def __contains__(self, item):
+        return all(self.bits[bit >> 3] & (1 << (bit & 7)) for bit in self._probes(item))
+
+
+def normalize_legacy_id(url):
+    # Older crawls stored links as listing URL + href, e.g. https://www.ign.com//news//articles/...
+    # The href starts at the last double slash, which is what urljoin now gives us
+    parts = urlsplit(url)
+    if "//" not in parts.path:
+        return url
+    path = parts.path[parts.path.rindex("//") + 1:]
+    return urlunsplit((parts.scheme, parts.netloc, path, parts.query, parts.fragment))
+
+
+class SeenUrlIndex:
+    # Local view of the 'webpages' index so duplicate checks don't need a round trip per link.
+    # A Bloom filter miss means the URL is definitely new. A hit may be a false positive,
+    # so hits are confirmed against Elasticsearch in a single batched mget.
+    def __init__(self, es_client, index='webpages', capacity=1_000_000, error_rate=0.001):
+        self.es_client = es_client
+        self.index = index
+        self.bloom = BloomFilter(capacity, error_rate)
+        # Links stored under a legacy ID, in the form they're found in now. They're only in the
+        # index under the old ID, so they're confirmed from here instead of by mget
+        self.legacy = set()
+        self.lock = Lock()
+
+    def warm(self):
+        # Load every URL already stored in the index (IDs only, no document bodies)
+        loaded = 0
+        try:
+            for hit in helpers.scan(self.es_client, index=self.index, query={"_source": False}, size=5000):
+                self.add(hit['_id'])
+                normalized = normalize_legacy_id(hit['_id'])
+                if normalized != hit['_id']:
+                    self.add(normalized)
+                    with self.lock:
+                        self.legacy.add(normalized)
+                loaded += 1
+        except NotFoundError:
+            pass # Index doesn't exist yet, nothing has been seen
+        return loaded
+
+    def add(self, url):
+        with self.lock:
+            self.bloom.add(url)
+
+    def filter_unseen(self, urls):
+        # Returns the URLs that are not in the index, preserving order
+        with self.lock:
+            maybe_seen = [ url in self.bloom for url in urls ]
+        candidates = [ url for url, hit in zip(urls, maybe_seen) if hit ]
+        confirmed = self.confirm(candidates)
+        return [ url for url, hit in zip(urls, maybe_seen) if not hit or url not in confirmed ]
+
+    def confirm(self, urls):
+        # Exact membership check for Bloom filter hits, one request for the whole batch
+        with self.lock:
+            legacy = { url for url in urls if url in self.legacy }
+        urls = [ url for url in urls if url not in legacy ]
+        if len(urls) == 0:
+            return legacy
+        try:
+            response = self.es_client.mget(index=self.index, ids=list(set(urls)), source=False)
+        except NotFoundError:
+            return legacy
+        return legacy | { doc['_id'] for doc in response['docs'] if doc.get('found') }
@@ -0,0 +1,272 @@
+import os
+import re
+import time
+import soupsieve as sv
+from datetime import datetime
+from bs4 import Tag
+
+# Declarative extraction rules for each supported site, keyed by SITE name.
+# fields: name -> (CSS selector, "first" or "all", required)
+# dates: tried in order, (CSS selector, attribute or None for text, split on, part to keep, date format)
+# url_prefixes: hrefs that look like articles on that site's listing pages
+# feeds: sitemaps and RSS/Atom feeds read by feed_discovery, on top of the sitemaps listed in robots.txt
+SITE_RULES = {
+    "IGN": {
+        "fields": {
+            "headline": ("h1", "first", True),
+            "authors": ("a.jsx-3953721931.article-author.underlined", "all", False),
+            "body": ("p.jsx-3649800006", "all", False),
+            "topics": ('a[data-cy="object-breadcrumb"]', "all", False),
+        },
+        "dates": [
+            ('meta[property="article:published_time"]', "content", "T", 0, "%Y-%m-%d"),
+            ("div.caption.jsx-1541923331", None, "Posted: ", 1, "%b %d, %Y %I:%M %p"),
+        ],
+        "url_prefixes": ["/articles/"],
+        "feeds": ["https://www.ign.com/sitemaps/ign/news.xml", "https://feeds.feedburner.com/ign/all"],
+    },
+    "GameInformer": {
+        "fields": {
+            "headline": ("h1.page-title", "first", True),
+            "authors": ("div.author-details a", "all", False),
+            "body": ("div.ds-main p", "all", True),
+            "topics": ('div.gi5--product--summary a[rel="bookmark"]', "all", False),
+        },
+        "dates": [
+            ("div.author-details", None, "on ", 1, "%b %d, %Y at %I:%M %p"),
+        ],
+        "url_prefixes": ["/news/", "/preview/", "/review/", "/feature/", "/blog/", "/gamer-culture/"],
+        "feeds": ["https://www.gameinformer.com/news.xml"],
+    },
+    "PCGamer": {
+        "fields": {
+            "headline": ("h1", "first", True),
+            "authors": ("div.author-byline__authors a.link.author-byline__link", "all", False),
+            "body": ("div#article-body p:not([class])", "all", True),
+            "topics": ('div.tag[data-analytics-id="article-product"] a', "all", False),
+        },
+        "dates": [
+            ('meta[name="pub_date"]', "content", "T", 0, "%Y-%m-%d"),
+            ("span.article-byline__date time.relative-date", "datetime", None, 0, "%Y-%m-%dT%H:%M:%SZ"),
+        ],
+        "url_prefixes": ["https://www.pcgamer.com/"], # PCGamer puts the whole URL in their hrefs
+        "feeds": ["https://www.pcgamer.com/feeds.xml", "https://www.pcgamer.com/sitemap-news.xml"],
+    },
+}
+
+# Set to time every rule match, at the cost of some overhead per element
+PROFILE_RULES = os.getenv('EXTRACTION_PROFILE') == "1"
+
+# "container target" selectors, split at the last descendant combinator, e.g. "div#article-body" and "p:not([class])"
+DESCENDANT = re.compile(r"^(.*[^\s>+~,])\s+([^\s>+~,]+)$")
+# Tag name and the plain class, ID and [attr] / [attr="value"] parts of a compound, checked before soupsieve
+COMPOUND_NAME = re.compile(r"[a-zA-Z][\w-]*")
+COMPOUND_PART = re.compile(r'\.(?P<cls>[\w-]+)|#(?P<id>[\w-]+)|\[(?P<attr>[\w-]+)(?:="(?P<value>[^"]*)")?\]')
+
+
+def balanced(text):
+    return text.count("[") == text.count("]") and text.count("(") == text.count(")") and text.count('"') % 2 == 0
+
+
+def split_descendant(selector):
+    # (container, target) if the selector ends in a descendant combinator, else None
+    match = DESCENDANT.match(selector)
+    if "," in selector or match is None or not balanced(match.group(2)):
+        return None
+    return match.group(1), match.group(2)
+
+
+class Selector:
+    # A compiled selector with a cheap check in front of soupsieve: the last compound's tag name,
+    # classes and attributes rule most tags out before the full match runs
+    def __init__(self, selector):
+        self.selector = selector
+        self.matcher = sv.compile(selector)
+        self.tag_name = "*"
+        self.classes = frozenset()
+        self.attrs = []
+        compound = re.split(r"[\s>+~]+", selector.strip())[-1]
+        if "," in selector or not balanced(compound):
+            return # Too much for the cheap check to be sure of, soupsieve alone decides
+        name = COMPOUND_NAME.match(compound)
+        position = name.end() if name else 0
+        if name:
+            self.tag_name = name.group(0)
+        classes = []
+        attrs = []
+        while position < len(compound):
+            part = COMPOUND_PART.match(compound, position)
+            if part is None:
+                break # A pseudo-class or something else only soupsieve understands
+            if part.group("cls"):
+                classes.append(part.group("cls"))
+            elif part.group("id"):
+                attrs.append(("id", part.group("id")))
+            else:
+                attrs.append((part.group("attr"), part.group("value")))
+            position = part.end()
+        else:
+            self.classes = frozenset(classes)
+            self.attrs = attrs
+
+    def match(self, tag):
+        if self.classes:
+            classes = tag.get("class")
+            if not classes or not self.classes.issubset(classes):
+                return False
+        for attr, value in self.attrs:
+            actual = tag.get(attr)
+            if actual is None:
+                return False
+            # Lower case both, soupsieve ignores case for some attributes' values
+            if value is not None and (" ".join(actual) if isinstance(actual, list) else actual).lower() != value.lower():
+                return False
+        return self.matcher.match(tag)
+
+
+class Rule:
+    def __init__(self, name, selector, mode="first", required=False, attr=None, split=None, part=0, date_format=None):
+        self.name = name
+        self.selector = selector
+        self.mode = mode
+        self.required = required
+        self.attr = attr
+        self.split = split
+        self.part = part
+        self.date_format = date_format
+        # "div.ds-main p" finds the div.ds-main containers in the walk over the tree, then only looks
+        # for p inside them, instead of checking every p in the page for a div.ds-main above it
+        scoped = split_descendant(selector)
+        self.container = scoped[0] if scoped else None
+        self.target = Selector(scoped[1] if scoped else selector)
+        self.matches = 0
+        self.seconds = 0.0
+
+
+class ExtractionPlan:
+    # One site's rules compiled for one pass over the tree, plus a search inside each container a rule is scoped to
+    def __init__(self, site_name, rules):
+        self.site_name = site_name
+        self.url_prefixes = tuple(rules["url_prefixes"])
+        self.feeds = tuple(rules.get("feeds", ()))
+        self.fields = [ Rule(name, selector, mode, required) for name, (selector, mode, required) in rules["fields"].items() ]
+        self.dates = [
+            Rule(f"date[{i}]", selector, "first", False, attr, split, part, date_format)
+            for i, (selector, attr, split, part, date_format) in enumerate(rules["dates"])
+        ]
+        # An article page is usable once its headline is in the DOM
+        self.ready_selector = next(rule.selector for rule in self.fields if rule.name == "headline")
+        self.rules = { rule.name: rule for rule in self.fields + self.dates }
+        self.article_index = index_by_tag(self.fields + self.dates)
+        self.date_index = index_by_tag(self.dates)
+
+    def matches_url(self, href):
+        return href.startswith(self.url_prefixes)
+
+    def extract(self, soup):
+        # Returns headline, authors, date, body text and topics from one traversal
+        found = self.collect(soup, self.article_index)
+        for rule in self.fields:
+            if rule.required and not found[rule.name]:
+                raise ValueError(f"No match for required {rule.name} selector '{rule.selector}'")
+        body_text = "".join(p.get_text() + "\n" for p in found["body"])
+        return {
+            'headline': found["headline"][0].get_text(),
+            'authors': [ a.get_text() for a in found["authors"] ],
+            'date': self.parse_date(found),
+            'body': body_text,
+            'topics': [ t.get_text().strip("\n") for t in found["topics"] ],
+        }
+
+    def extract_date(self, soup):
+        return self.parse_date(self.collect(soup, self.date_index))
+
+    def collect(self, soup, index):
+        # One walk over the tree for the rules and containers that can match anywhere,
+        # then each scoped rule only searches inside its containers
+        by_tag, wildcard, rules, containers = index
+        found = { key: [] for key in containers + [ rule.name for rule in rules ] }
+
+        for tag in soup.descendants:
+            if not isinstance(tag, Tag):
+                continue
+            candidates = by_tag.get(tag.name, ())
+            if wildcard:
+                candidates = list(candidates) + wildcard
+            for key, selector, first in candidates:
+                if first and found[key]:
+                    continue
+                if PROFILE_RULES and key in self.rules:
+                    started = time.perf_counter()
+                    matched = selector.match(tag)
+                    self.rules[key].seconds += time.perf_counter() - started
+                else:
+                    matched = selector.match(tag)
+                if matched:
+                    found[key].append(tag)
+
+        for rule in rules:
+            if rule.container is None:
+                rule.matches += len(found[rule.name])
+                continue
+            started = time.perf_counter() if PROFILE_RULES else None
+            found[rule.name] = self.search(found[rule.container], rule.target, rule.mode == "first")
+            if started is not None:
+                rule.seconds += time.perf_counter() - started
+            rule.matches += len(found[rule.name])
+        return found
+
+    def search(self, containers, selector, first):
+        # Tags matching selector inside any of containers, in document order.
+        # A container nested in an earlier one is skipped, its tags were already found
+        results = []
+        previous = None
+        for container in containers:
+            if previous is not None and any(parent is previous for parent in container.parents):
+                continue
+            previous = container
+            tags = container.find_all(selector.tag_name) if selector.tag_name != "*" else container.find_all(True)
+            for tag in tags:
+                if selector.match(tag):
+                    results.append(tag)
+                    if first:
+                        return results
+        return results
+
+    def parse_date(self, found):
+        # First date rule that matched and parses wins
+        for rule in self.dates:
+            if not found[rule.name]:
+                continue
+            tag = found[rule.name][0]
+            raw = tag.get(rule.attr) if rule.attr else tag.get_text()
+            try:
+                if rule.split is not None:
+                    raw = raw.split(rule.split)[rule.part]
+                return datetime.strptime(raw.strip(), rule.date_format).strftime("%Y-%m-%d")
+            except (AttributeError, IndexError, ValueError):
+                continue
+        return "N/A"
+
+    def rule_stats(self):
+        # (rule name, matches, seconds) for each rule, seconds are only tracked with EXTRACTION_PROFILE=1
+        return [ (rule.name, rule.matches, rule.seconds) for rule in self.fields + self.dates ]
+
+
+def index_by_tag(rules):
+    # Group what the walk over the tree matches by tag name, so each element only runs the relevant matchers:
+    # (rule name, selector, first only) for unscoped rules and (container, selector, False) for each container
+    by_tag = {}
+    containers = {}
+    for rule in rules:
+        if rule.container is None:
+            by_tag.setdefault(rule.target.tag_name, []).append((rule.name, rule.target, rule.mode == "first"))
+        elif rule.container not in containers:
+            containers[rule.container] = Selector(rule.container)
+            by_tag.setdefault(containers[rule.container].tag_name, []).append((rule.container, containers[rule.container], False))
+    wildcard = by_tag.pop("*", [])
+    return by_tag, wildcard, rules, list(containers)
+
+
+def compile_site_rules(site_rules=SITE_RULES):
+    return { name: ExtractionPlan(name, rules) for name, rules in site_rules.items() }
@@ -0,0 +1,182 @@
+# Article counts per game title, kept up to date as the crawler writes articles.
+#
+#   python trends.py top --days 7             most written about games this week
+#   python trends.py top --since 2026-09-01 --until 2026-09-30 --site IGN --top 20
+#   python trends.py backfill                 count everything already in unique-articles
+#
+# Counts are kept in Redis, one hash per day and one per ISO week, each field "site\ttitle" -> articles.
+# A window is answered from a few dozen buckets at most (whole weeks where it can, days at the edges),
+# never from the articles themselves.
+import os
+import redis
+import argparse
+from collections import Counter
+from datetime import date, timedelta
+from elasticsearch import Elasticsearch, helpers
+from game_titles import TitleMatcher
+from metrics import log
+
+# !! Set ES Cloud ID and API Key Here
+ES_CLOUD_ID = os.getenv('ELASTIC_CLOUD_ID')
+ES_API_KEY = os.getenv('ELASTIC_API_KEY')
+
+# Set to only count topics in game_titles.TITLE_ALIASES
+KNOWN_TITLES_ONLY = os.getenv('TRENDS_KNOWN_TITLES_ONLY') == "1"
+# Day buckets are dropped after this long, older windows are answered a week at a time
+DAY_RETENTION_DAYS = 400
+
+# Counts an article once: if its ID is new to the week's counted set, every field in ARGV[3..]
+# is incremented in the day (KEYS[2]) and week (KEYS[3]) buckets. Only the day bucket expires.
+#   KEYS: counted set, day hash, week hash   ARGV: article ID, day TTL, fields...
+COUNT_SCRIPT = """
+if redis.call('SADD', KEYS[1], ARGV[1]) == 0 then
+    return 0
+end
+for i = 3, #ARGV do
+    redis.call('HINCRBY', KEYS[2], ARGV[i], 1)
+    redis.call('HINCRBY', KEYS[3], ARGV[i], 1)
+end
+redis.call('EXPIRE', KEYS[2], ARGV[2])
+return 1
+"""
+
+
+def day_key(day):
+    return f"trends:day:{day.isoformat()}"
+
+
+def week_key(day):
+    year, week, _ = day.isocalendar()
+    return f"trends:week:{year}-W{week:02d}"
+
+
+def counted_key(day):
+    # IDs of the articles counted in day's week, kept as long as the week bucket is
+    year, week, _ = day.isocalendar()
+    return f"trends:counted:{year}-W{week:02d}"
+
+
+def parse_day(text):
+    # Article dates are "%Y-%m-%d", or "N/A" when no date rule matched
+    try:
+        return date.fromisoformat(text)
+    except (TypeError, ValueError):
+        return None
+
+
+class TrendRollup:
+    # Per-day and per-week article counts for each game title and site
+    def __init__(self, r, matcher=None, retention_days=DAY_RETENTION_DAYS):
+        self.r = r
+        self.matcher = matcher or TitleMatcher(known_only=KNOWN_TITLES_ONLY)
+        self.retention_days = retention_days
+        self.count_script = r.register_script(COUNT_SCRIPT)
+
+    def count(self, _id, site, published, topics, client=None):
+        # Adds one article, returns the titles it counted for (none if it was already counted).
+        # Undated articles are counted on the day they were crawled. With client=pipeline the
+        # script is only queued, so the titles are returned whether or not it turns out to count
+        titles = self.matcher.titles(topics)
+        if len(titles) == 0:
+            return []
+        day = parse_day(published) or date.today()
+        fields = [ f"{site}\t{title}" for title in titles ]
+        counted = self.count_script(
+            keys=[counted_key(day), day_key(day), week_key(day)],
+            args=[_id, self.retention_days * 24 * 3600] + fields,
+            client=client or self.r
+        )
+        return titles if client is not None or counted else []
+
+    def buckets(self, start, end):
+        # Keys covering start..end (inclusive): whole weeks inside the window, days for the rest.
+        # Days past retention are covered by their week, so old windows are rounded out to weeks
+        keys = []
+        oldest_day = date.today() - timedelta(days=self.retention_days)
+        day = start
+        while day <= end:
+            week_start = day - timedelta(days=day.weekday())
+            week_end = week_start + timedelta(days=6)
+            if (day == week_start and week_end <= end) or day < oldest_day:
+                keys.append(week_key(day))
+                day = week_end + timedelta(days=1)
+            else:
+                keys.append(day_key(day))
+                day += timedelta(days=1)
+        return keys
+
+    def totals(self, start, end, site=None):
+        # Counter of title -> articles published between start and end, optionally on one site
+        pipe = self.r.pipeline(transaction=False)
+        for key in self.buckets(start, end):
+            pipe.hgetall(key)
+        totals = Counter()
+        for fields in pipe.execute():
+            for field, count in fields.items():
+                field_site, title = field.decode('utf-8').split("\t", 1)
+                if site is None or field_site == site:
+                    totals[title] += int(count)
+        return totals
+
+    def top(self, start, end, n=10, site=None):
+        # [(title, articles)] for the n most written about titles between start and end
+        return self.totals(start, end, site).most_common(n)
+
+    def series(self, title, start, end, site=None):
+        # [(day, articles)] for one title, a day at a time, zero for days past retention
+        days = [ start + timedelta(days=offset) for offset in range((end - start).days + 1) ]
+        pipe = self.r.pipeline(transaction=False)
+        for day in days:
+            pipe.hgetall(day_key(day))
+        series = []
+        for day, fields in zip(days, pipe.execute()):
+            count = 0
+            for field, value in fields.items():
+                field_site, field_title = field.decode('utf-8').split("\t", 1)
+                if field_title == title and (site is None or field_site == site):
+                    count += int(value)
+            series.append((day, count))
+        return series
+
+    def backfill(self, es_client, index='unique-articles', batch_size=1000):
+        # Counts every article already in the index, returns how many weren't counted before
+        counted = queued = 0
+        pipe = self.r.pipeline(transaction=False)
+        query = { "_source": ["site", "date", "topics"] }
+        for hit in helpers.scan(es_client, index=index, query=query, size=batch_size):
+            article = hit['_source']
+            if self.count(hit['_id'], article.get('site'), article.get('date'), article.get('topics') or [], client=pipe):
+                queued += 1
+            if queued == batch_size:
+                counted += sum(pipe.execute())
+                queued = 0
+        counted += sum(pipe.execute())
+        return counted
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Trending game titles from the article counts in Redis")
+    commands = parser.add_subparsers(dest="command", required=True)
+    top_parser = commands.add_parser("top", help="most written about titles in a window")
+    top_parser.add_argument("--days", type=int, default=7, help="window ending today, ignored with --since")
+    top_parser.add_argument("--since", type=date.fromisoformat, help="first day, YYYY-MM-DD")
+    top_parser.add_argument("--until", type=date.fromisoformat, help="last day, YYYY-MM-DD, default today")
+    top_parser.add_argument("--site", help="only this site's articles, e.g. IGN")
+    top_parser.add_argument("--top", type=int, default=10)
+    commands.add_parser("backfill", help="count the articles already in unique-articles")
+    args = parser.parse_args()
+
+    trends = TrendRollup(redis.Redis())
+    if args.command == "backfill":
+        es = Elasticsearch(ES_CLOUD_ID, api_key=ES_API_KEY)
+        log("Trends", f"Counted {trends.backfill(es)} articles")
+        return
+    end = args.until or date.today()
+    start = args.since or end - timedelta(days=args.days - 1)
+    print(f"Top {args.top} titles {start} to {end}" + (f" on {args.site}" if args.site else ""))
+    for rank, (title, articles) in enumerate(trends.top(start, end, args.top, args.site), 1):
+        print(f"{rank:3d}. {title:<48} {articles}")
+
+
+if __name__ == "__main__":
+    main()
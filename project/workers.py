@@ -0,0 +1,180 @@
+# Multi-process crawl workers sharing the Redis frontier.
+#
+#   python workers.py coordinator --workers-per-core 1   # start and supervise workers on this machine
+#   python workers.py worker --id my-worker               # run a single worker
+#
+# Workers on any number of machines pointing at the same Redis split the work between them.
+# Each worker heartbeats into Redis, and shards and crawl targets are assigned to the live
+# workers with rendezvous hashing, so when a worker joins or leaves only its share moves.
+import argparse
+import hashlib
+import multiprocessing
+import os
+import socket
+import time
+import redis
+from threading import Thread, Event
+from elasticsearch import Elasticsearch
+from frontier import ShardedFrontier
+from metrics import log, serve, METRICS_PORT, FRONTIER_DEPTH
+from scraper import (
+    ES_CLOUD_ID, ES_API_KEY, CRAWL_TARGETS, ARTICLE_BATCH_SIZE,
+    WebCrawler, build_shared, close_shared, site_for_url
+)
+
+WORKERS_KEY = "workers"
+DONE_TARGETS_KEY = "workers-done-targets"
+# A worker that hasn't heartbeated for this long is treated as gone and its shards move
+WORKER_TTL = 60
+# Each worker process gets its own small WebDriver pool
+WORKER_DRIVER_POOL_SIZE = int(os.getenv('WORKER_DRIVER_POOL_SIZE', 1))
+
+
+def rendezvous_owner(item, workers):
+    # Highest random weight hashing: the worker with the biggest hash of (worker, item) owns item
+    return max(workers, key=lambda worker: hashlib.blake2b(f"{worker}:{item}".encode('utf-8'), digest_size=8).digest())
+
+
+class CrawlWorker:
+    def __init__(self, worker_id):
+        self.id = worker_id
+        self.r = redis.Redis()
+        self.frontier = ShardedFrontier(self.r)
+        # Shared by every worker, so it isn't broken down by site
+        FRONTIER_DEPTH.track(self.frontier.depth, site="all", subdirectory="all")
+        # Any worker can get links for any host, so the per-host rate limits live in Redis
+        self.shared = build_shared(Elasticsearch(ES_CLOUD_ID, api_key=ES_API_KEY), WORKER_DRIVER_POOL_SIZE, r=self.r)
+        self.discoverers = {} # (site, subdirectory) -> WebCrawler scrolling that section
+        self.scrapers = {} # site -> WebCrawler used to scrape that site's articles
+        self.stopping = Event()
+
+    def heartbeat(self):
+        # Runs in the background so a long scroll pass doesn't make us look dead
+        while not self.stopping.is_set():
+            self.r.hset(WORKERS_KEY, self.id, time.time())
+            self.stopping.wait(WORKER_TTL / 4)
+
+    def live_workers(self):
+        now = time.time()
+        workers = { w.decode('utf-8'): float(t) for w, t in self.r.hgetall(WORKERS_KEY).items() }
+        return sorted(w for w, t in workers.items() if now - t < WORKER_TTL)
+
+    def crawler(self, site, subdirectory=""):
+        return WebCrawler(site, subdirectory, frontier=self.frontier, autorun=False, **self.shared)
+
+    def run(self):
+        log(self.id, f"Worker started (pid {os.getpid()})")
+        self.r.hset(WORKERS_KEY, self.id, time.time())
+        Thread(target=self.heartbeat, daemon=True).start()
+        try:
+            while True:
+                workers = self.live_workers()
+                done = { t.decode('utf-8') for t in self.r.smembers(DONE_TARGETS_KEY) }
+                targets = [ t for t in CRAWL_TARGETS if f"{t[0].name}{t[1]}" not in done ]
+                my_targets = [ t for t in targets if rendezvous_owner(f"{t[0].name}{t[1]}", workers) == self.id ]
+                my_shards = [ s for s in range(self.frontier.num_shards) if rendezvous_owner(s, workers) == self.id ]
+
+                for site, subdirectory in my_targets:
+                    self.discover(site, subdirectory)
+                scraped = sum(self.scrape_shard(shard) for shard in my_shards)
+
+                if len(targets) == 0 and self.frontier.depth() == 0:
+                    log(self.id, "All targets done and the frontier is empty")
+                    break
+                if len(my_targets) == 0 and scraped == 0:
+                    time.sleep(1) # Nothing for us right now, other workers are busy
+        finally:
+            self.stopping.set()
+            self.r.hdel(WORKERS_KEY, self.id)
+            close_shared(self.shared)
+
+    def discover(self, site, subdirectory):
+        # One scroll/extract pass over a section we own
+        target = (site, subdirectory)
+        if target not in self.discoverers:
+            self.discoverers[target] = self.crawler(site, subdirectory)
+        crawler = self.discoverers[target]
+        crawler.discover()
+        # One read of the feeds finds everything they have, reading them again every loop would only
+        # spend the hosts' politeness turns. Sections that fell back to scrolling go on until the listing ends
+        if not crawler.has_links or crawler.feeds is not None:
+            crawler.end_pass()
+            self.r.sadd(DONE_TARGETS_KEY, crawler.id)
+
+    def scrape_shard(self, shard):
+        urls = self.frontier.pop_shard(shard, ARTICLE_BATCH_SIZE)
+        by_site = {}
+        for url in urls:
+            by_site.setdefault(site_for_url(url), []).append(url)
+        for site, site_urls in by_site.items():
+            if site is None:
+                log(self.id, f"Dropping links for unsupported sites: {site_urls}")
+                self.frontier.ack(site_urls)
+                continue
+            if site not in self.scrapers:
+                self.scrapers[site] = self.crawler(site)
+            self.scrapers[site].scrape_batch(site_urls)
+        return len(urls)
+
+
+def run_worker(worker_id, metrics_port=METRICS_PORT):
+    serve(metrics_port)
+    CrawlWorker(worker_id).run()
+
+
+def coordinator(workers_per_core, cores=None, fresh=False):
+    # Start N workers per core on this machine and restart any that die.
+    # Shards rebalance on their own as workers heartbeat in and out.
+    if fresh:
+        # Before any worker starts, so nothing is popped from the frontier while it's cleared
+        r = redis.Redis()
+        r.delete(DONE_TARGETS_KEY)
+        ShardedFrontier(r).clear()
+    cores = cores or os.cpu_count()
+    host = socket.gethostname()
+    processes = {}
+    # With METRICS_PORT set, worker i serves its metrics on METRICS_PORT + i
+    ports = {}
+    for i in range(workers_per_core * cores):
+        worker_id = f"{host}-{i}"
+        ports[worker_id] = int(METRICS_PORT) + i if METRICS_PORT else None
+        processes[worker_id] = multiprocessing.Process(target=run_worker, args=(worker_id, ports[worker_id]), name=worker_id)
+        processes[worker_id].start()
+    log("Coordinator", f"Started {len(processes)} workers on {host}")
+
+    try:
+        while any(p.is_alive() for p in processes.values()):
+            for worker_id, process in processes.items():
+                if not process.is_alive() and process.exitcode != 0:
+                    log("Coordinator", f"{worker_id} exited with {process.exitcode}, restarting it")
+                    processes[worker_id] = multiprocessing.Process(target=run_worker, args=(worker_id, ports[worker_id]), name=worker_id)
+                    processes[worker_id].start()
+            time.sleep(5)
+    except KeyboardInterrupt:
+        log("Coordinator", "Stopping workers")
+        for process in processes.values():
+            process.terminate()
+    for process in processes.values():
+        process.join()
+    log("Coordinator", "All workers finished")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run crawl workers over the shared Redis frontier")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    coordinator_parser = subparsers.add_parser("coordinator", help="start and supervise workers on this machine")
+    coordinator_parser.add_argument("--workers-per-core", type=int, default=1)
+    coordinator_parser.add_argument("--cores", type=int, default=None, help="defaults to os.cpu_count()")
+    coordinator_parser.add_argument("--fresh", action="store_true", help="forget which targets earlier runs finished and empty the shared frontier")
+    worker_parser = subparsers.add_parser("worker", help="run one worker in this process")
+    worker_parser.add_argument("--id", default=f"{socket.gethostname()}-{os.getpid()}")
+    args = parser.parse_args()
+
+    if args.command == "coordinator":
+        coordinator(args.workers_per_core, args.cores, args.fresh)
+    else:
+        run_worker(args.id)
+
+
+if __name__ == "__main__":
+    main()